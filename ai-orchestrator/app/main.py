@@ -1,43 +1,123 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
+from contextlib import asynccontextmanager
 import logging
-import io # For handling audio file in memory
+import asyncio
+import json
 import os # For environment variables
 
-# Faster-Whisper 導入
-from faster_whisper import WhisperModel
-
-from .services.document_service import process_document_embedding, search_documents_qdrant, summarize_document
-from .services.rag_pipeline import generate_response_from_rag
+from .services.document_service import process_document_embedding, process_documents_batch, search_documents_qdrant, summarize_text, bootstrap_qdrant, close_qdrant, warmup_embedding
+from .services.embedding_provider import embedding_provider
+from .services.rag_pipeline import generate_response_from_rag, init_rag_pipeline, stream_response_from_rag, summarize_conversation
+from .services.conversation_sessions import SessionStore
+from .services.job_queue import JobQueue, ProgressCallback, callback_url_allowed
+from .services.model_registry import ModelUnavailableError, model_registry
+from .services.metrics import (
+    METRICS_ENABLED, PROMETHEUS_CONTENT_TYPE, RequestMetricsMiddleware, registry as metrics_registry,
+    JOB_QUEUE_DEPTH, WHISPER_IN_FLIGHT, WHISPER_QUEUE_DEPTH
+)
+from .services.transcription_service import (
+    transcription_executor, StreamingTranscriptionSession,
+    TranscriptionQueueFullError, TranscriptionUnavailableError, WHISPER_RETRY_AFTER_SECONDS
+)
+from .services.whisper_sharing import WHISPER_SHARED, WhisperModelShare
+from .services.audio_intake import cached_transcript, prepare_audio, transcribe_file, transcript_cache
 from .models.document_models import DocumentUploadRequest, DocumentSearchResponse, DocumentSummaryResponse
 from .models.voice_models import VoiceTranscriptionResponse, VoiceResponseRequest, VoiceResponse
+from .models.job_models import JobAcceptedResponse, JobStatusResponse
+from .models.batch_models import DocumentBatchUploadRequest, DocumentBatchRejection, DocumentBatchAcceptedResponse
+from .models.search_models import DocumentSearchRequest
+from .models.session_models import SessionCreateRequest, SessionVoiceRequest, SessionStatusResponse
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="AI Orchestrator Microservice")
-
-# 全局載入 Whisper 模型，只載入一次
-# 從環境變數讀取模型配置
-WHISPER_MODEL_NAME = os.getenv("WHISPER_MODEL", "tiny")
-WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "cpu") # 'cpu' or 'cuda'
-WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8") # 'int8' for CPU, 'float16' for GPU
-WHISPER_DOWNLOAD_ROOT = "./data/whisper_models" # 模型下載路徑
-
-whisper_model = None
-try:
-    logger.info(f"嘗試載入 Faster-Whisper 模型: {WHISPER_MODEL_NAME} (Device: {WHISPER_DEVICE}, Compute Type: {WHISPER_COMPUTE_TYPE})")
-    whisper_model = WhisperModel(
-        WHISPER_MODEL_NAME,
-        device=WHISPER_DEVICE,
-        compute_type=WHISPER_COMPUTE_TYPE,
-        download_root=WHISPER_DOWNLOAD_ROOT
+# 文件處理完成後的預設通知網址 (可由上傳請求的 callback_url 參數覆寫，主機須在 JOB_CALLBACK_ALLOWED_HOSTS 中)
+DOCUMENT_JOB_CALLBACK_URL = os.getenv("DOCUMENT_JOB_CALLBACK_URL") or None
+DOCUMENT_BATCH_MAX_DOCUMENTS = int(os.getenv("DOCUMENT_BATCH_MAX_DOCUMENTS", 1000)) # 單一批次上傳請求的文件數上限
+
+async def _run_document_upload_job(payload: Dict[str, Any], progress: ProgressCallback) -> Dict[str, Any]:
+    """背景任務：向量化並摘要上傳的文件；payload 含 documents 時為批次上傳."""
+    await model_registry.ensure("qdrant", "embedding")
+    if "documents" in payload:
+        results = await process_documents_batch(payload["documents"], progress=progress)
+        failed = sum(1 for result in results if result["status"] == "failed")
+        return {"documents": results, "processed": len(results) - failed, "failed": failed}
+
+    request = DocumentUploadRequest(**payload)
+    summary_text = await process_document_embedding(request.document_id, request.file_path, request.metadata, progress=progress)
+    logger.info(f"文件 {request.document_id} 處理成功，摘要: {summary_text[:50]}...")
+    return {"document_id": request.document_id, "summary": summary_text, "status": "processed"}
+
+# 文件處理任務佇列 (SQLite 持久化於 ./data)
+document_job_queue = JobQueue(_run_document_upload_job)
+
+# 伺服器端對話工作階段 (SQLite 持久化於 ./data，各 worker 共用)，較舊的歷史在背景壓縮為滾動摘要
+session_store = SessionStore(summarize_conversation)
+
+# 佇列深度在輸出 /metrics 時才讀取
+WHISPER_QUEUE_DEPTH.set_function(lambda: transcription_executor.queue_depth)
+WHISPER_IN_FLIGHT.set_function(lambda: transcription_executor.in_flight)
+JOB_QUEUE_DEPTH.set_function(lambda: document_job_queue.depth, queue="documents")
+
+def _check_embedding_provider() -> None:
+    if embedding_provider is None:
+        raise RuntimeError("Embedding 模型未載入，請檢查 EMBEDDING_BACKEND 配置。")
+
+# 服務所需的元件：Qdrant collection、Embedding 模型、RAG 流程元件與 Whisper 模型 (由轉錄執行器持有)，
+# 載入時機由 MODEL_LOAD_MODE 決定；WHISPER_SHARED=true 時多個 worker 共用一個 Whisper 模型
+whisper_share = WhisperModelShare(transcription_executor) if WHISPER_SHARED else None
+model_registry.register("qdrant", bootstrap_qdrant)
+model_registry.register("embedding", _check_embedding_provider, warmup=warmup_embedding)
+model_registry.register("rag", init_rag_pipeline)
+model_registry.register("whisper", whisper_share.load if whisper_share else transcription_executor.load, warmup=transcription_executor.warmup)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """應用程式生命週期：啟動背景任務 worker、開啟工作階段資料庫並依 MODEL_LOAD_MODE 載入元件，關閉時停止 worker、轉錄工作池與 Qdrant 連線."""
+    await document_job_queue.start() # 任務在 Qdrant 與 Embedding 模型就緒後才開始處理
+    await session_store.start()
+    await model_registry.start()
+    yield
+    await model_registry.close()
+    await session_store.close()
+    await document_job_queue.stop()
+    if whisper_share is not None:
+        await whisper_share.close()
+    transcription_executor.shutdown()
+    await close_qdrant()
+
+app = FastAPI(title="AI Orchestrator Microservice", lifespan=lifespan)
+if METRICS_ENABLED:
+    # 記錄每個請求的耗時，並依設定附上 Server-Timing 標頭 (各階段耗時)
+    app.add_middleware(RequestMetricsMiddleware)
+
+SUPPORTED_AUDIO_TYPES = ["audio/webm", "audio/mp3", "audio/wav", "audio/ogg"]
+
+def _sse_event(event: str, data: Any) -> str:
+    """格式化一則 Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _require_models(*names: str) -> None:
+    """等待請求所需的元件載入完成 (背景或延遲載入時)；載入失敗回傳 503."""
+    try:
+        await model_registry.ensure(*names)
+    except ModelUnavailableError as e:
+        logger.error(f"所需元件無法使用: {e}")
+        raise HTTPException(status_code=503, detail=f"服務暫時不可用: {e}")
+
+def _queue_full_exception(e: TranscriptionQueueFullError) -> HTTPException:
+    """轉錄佇列已滿時的 429 回應，附上佇列深度與建議重試時間."""
+    logger.warning(f"語音轉錄佇列已滿，拒絕請求 (queue_depth={e.queue_depth}, max_queue={e.max_queue})。")
+    return HTTPException(
+        status_code=429,
+        detail=f"語音轉錄服務繁忙，目前有 {e.queue_depth} 個請求排隊中，請稍後再試。",
+        headers={"Retry-After": str(WHISPER_RETRY_AFTER_SECONDS), "X-Queue-Depth": str(e.queue_depth)}
     )
-    logger.info(f"Faster-Whisper model '{WHISPER_MODEL_NAME}' loaded successfully.")
-except Exception as e:
-    logger.error(f"載入 Faster-Whisper 模型失敗: {e}", exc_info=True)
 
 @app.get("/")
 async def root():
@@ -45,40 +125,154 @@ async def root():
     logger.info("收到根路由請求.")
     return {"message": "AI Orchestrator is running and ready for duty!"}
 
-@app.post("/documents/upload", response_model=DocumentSummaryResponse)
-async def upload_document(request: DocumentUploadRequest):
+@app.get("/health/live")
+async def health_live():
+    """存活檢查：程序可回應請求即為存活，不等待模型載入."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """就緒檢查：所有元件載入完成時回傳 200，否則回傳 503 與各元件的載入狀態."""
+    status = model_registry.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.post("/health/warmup")
+async def health_warmup():
+    """暖機：確保所有元件已載入，並以假資料執行一次轉錄與 Embedding，回傳各元件的載入與暖機耗時."""
+    components = await model_registry.warmup()
+    return JSONResponse(status_code=200 if model_registry.ready else 503, content={"ready": model_registry.ready, "components": components})
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 文字格式的服務指標：各階段耗時、Embedding/LLM 呼叫與 token 數、佇列深度與 Whisper 即時率."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="指標未啟用。")
+    return PlainTextResponse(metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+def _require_allowed_callback(callback_url: Optional[str]) -> None:
+    """通知會附帶 X-Callback-Token，只接受 JOB_CALLBACK_ALLOWED_HOSTS 中的主機."""
+    if callback_url and not callback_url_allowed(callback_url):
+        logger.warning(f"拒絕不在允許清單中的通知網址: {callback_url}")
+        raise HTTPException(status_code=400, detail="callback_url 的主機不在 JOB_CALLBACK_ALLOWED_HOSTS 允許清單中。")
+
+@app.post("/documents/upload", response_model=JobAcceptedResponse, status_code=202)
+async def upload_document(request: DocumentUploadRequest, callback_url: Optional[str] = None):
     """
     文件上傳後，通知 AI Orchestrator 進行向量化與摘要。
     實際文件內容由後端提供路徑或透過其他方式傳輸。
+    處理在背景任務中進行，立即回傳 202 與任務 ID，可透過 /jobs/{job_id} 查詢進度；
+    若提供 callback_url，處理完成後會以 POST 通知。
     """
     logger.info(f"收到文件上傳請求: document_id={request.document_id}, file_path={request.file_path}")
-    try:
-        # 這裡會模擬處理文件內容（例如從後端提供的路徑讀取）
-        # 實際應用中，文件可能需要從共享儲存或API獲取
-        summary_text = await process_document_embedding(request.document_id, request.file_path, request.metadata)
-        logger.info(f"文件 {request.document_id} 處理成功，摘要: {summary_text[:50]}...")
-        return DocumentSummaryResponse(document_id=request.document_id, summary=summary_text, status="processed")
-    except FileNotFoundError:
+    _require_allowed_callback(callback_url)
+    if not os.path.exists(request.file_path):
         logger.error(f"文件路徑不存在: {request.file_path}")
         raise HTTPException(status_code=404, detail=f"文件路徑不存在: {request.file_path}")
+    try:
+        job = await document_job_queue.enqueue(
+            jsonable_encoder(request),
+            document_id=request.document_id,
+            callback_url=callback_url or DOCUMENT_JOB_CALLBACK_URL
+        )
+        return JobAcceptedResponse(job_id=job["id"], document_id=request.document_id, status=job["status"], status_url=f"/jobs/{job['id']}")
     except Exception as e:
-        logger.error(f"文件 {request.document_id} 處理失敗: {e}", exc_info=True)
+        logger.error(f"文件 {request.document_id} 排入處理佇列失敗: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"文件處理失敗: {e}")
 
-@app.get("/documents/search", response_model=DocumentSearchResponse)
-async def search_documents(query: str):
+@app.post("/documents/upload-batch", response_model=DocumentBatchAcceptedResponse, status_code=202)
+async def upload_documents_batch(request: DocumentBatchUploadRequest, callback_url: Optional[str] = None):
     """
-    執行語意搜尋，從向量資料庫中檢索相關文件。
+    批次上傳：將多份文件排入同一個背景任務，不同文件的塊共用 Embedding 與 upsert 批次，
+    對供應商的請求數與 token 數受全局限流器控管，適合大量回填。
+    路徑不存在或重複的文件會立即列於 rejected；逐文件的處理結果可透過 /jobs/{job_id} 的 result.documents 查詢，
+    若提供 callback_url，整批處理完成後會以 POST 通知一次。
+    """
+    logger.info(f"收到批次文件上傳請求: {len(request.documents)} 份文件")
+    _require_allowed_callback(callback_url)
+    if not request.documents:
+        raise HTTPException(status_code=400, detail="批次上傳至少需要一份文件。")
+    if len(request.documents) > DOCUMENT_BATCH_MAX_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"單一批次最多 {DOCUMENT_BATCH_MAX_DOCUMENTS} 份文件，收到 {len(request.documents)} 份。")
+
+    accepted: List[DocumentUploadRequest] = []
+    rejected: List[DocumentBatchRejection] = []
+    seen_ids = set()
+    for document in request.documents:
+        if document.document_id in seen_ids:
+            rejected.append(DocumentBatchRejection(document_id=document.document_id, error="批次中重複的 document_id"))
+        elif not os.path.exists(document.file_path):
+            rejected.append(DocumentBatchRejection(document_id=document.document_id, error=f"文件路徑不存在: {document.file_path}"))
+        else:
+            accepted.append(document)
+        seen_ids.add(document.document_id)
+
+    if not accepted:
+        logger.error(f"批次上傳中沒有可處理的文件 ({len(rejected)} 份被拒絕)。")
+        raise HTTPException(status_code=404, detail={"message": "批次中沒有可處理的文件。", "rejected": jsonable_encoder(rejected)})
+    try:
+        job = await document_job_queue.enqueue({"documents": jsonable_encoder(accepted)}, callback_url=callback_url)
+        return DocumentBatchAcceptedResponse(
+            job_id=job["id"],
+            status=job["status"],
+            status_url=f"/jobs/{job['id']}",
+            accepted=[document.document_id for document in accepted],
+            rejected=rejected
+        )
+    except Exception as e:
+        logger.error(f"批次文件排入處理佇列失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"文件處理失敗: {e}")
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: str):
+    """
+    查詢背景任務的狀態與各階段 (split/embed/upsert/summarize) 進度。
     """
-    logger.info(f"收到文件搜尋請求: query='{query}'")
+    job = await document_job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任務不存在: {job_id}")
+    return JobStatusResponse(
+        job_id=job["id"],
+        document_id=job["document_id"],
+        status=job["status"],
+        stage=job["stage"],
+        progress=job["progress"],
+        result=job["result"],
+        error=job["error"],
+        created_at=job["created_at"],
+        updated_at=job["updated_at"]
+    )
+
+async def _search_documents(query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> DocumentSearchResponse:
+    logger.info(f"收到文件搜尋請求: query='{query}', filters={filters}")
+    await _require_models("qdrant", "embedding")
     try:
-        results = await search_documents_qdrant(query)
+        results = await search_documents_qdrant(query, limit=limit, filters=filters)
         logger.info(f"文件搜尋完成，找到 {len(results)} 個結果。")
         return DocumentSearchResponse(query=query, results=results)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"無效的過濾條件: {e}")
     except Exception as e:
         logger.error(f"文件搜尋失敗: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"文件搜尋失敗: {e}")
 
+@app.get("/documents/search", response_model=DocumentSearchResponse)
+async def search_documents(query: str):
+    """
+    執行語意搜尋，從向量資料庫中檢索相關文件。
+    """
+    return await _search_documents(query)
+
+@app.post("/documents/search", response_model=DocumentSearchResponse)
+async def search_documents_filtered(request: DocumentSearchRequest):
+    """
+    帶結構化過濾條件的語意搜尋 (document_id 列表、category、uploaded_by 等 SEARCH_FILTER_FIELDS 宣告的欄位)，
+    過濾在 Qdrant 端以 payload index 執行，而不是取回後在服務中篩選。
+    """
+    filters = dict(request.filters)
+    if request.document_ids is not None:
+        filters["document_id"] = request.document_ids
+    return await _search_documents(request.query, request.limit, filters)
+
 @app.post("/documents/summarize", response_model=DocumentSummaryResponse)
 async def get_document_summary(document_id: int, text_content: str):
     """
@@ -86,7 +280,7 @@ async def get_document_summary(document_id: int, text_content: str):
     """
     logger.info(f"收到文件摘要請求: document_id={document_id}")
     try:
-        summary = await summarize_document(document_id, text_content)
+        summary = await summarize_text(document_id, text_content)
         logger.info(f"文件 {document_id} 摘要完成: {summary[:50]}...")
         return DocumentSummaryResponse(document_id=document_id, summary=summary, status="completed")
     except Exception as e:
@@ -97,47 +291,149 @@ async def get_document_summary(document_id: int, text_content: str):
 async def transcribe_voice(audio_file: UploadFile = File(...)):
     """
     接收語音檔 (webm 格式)，使用 Faster-Whisper 進行轉錄。
+
+    上傳內容直接從 UploadFile 的暫存檔解碼，不另外讀成 bytes；靜音由 VAD 移除，相同的錄音由轉錄快取回應。
     """
     logger.info(f"收到語音轉錄請求: filename='{audio_file.filename}', content_type='{audio_file.content_type}'")
 
-    if whisper_model is None:
-        logger.error("Whisper 模型未載入，無法執行轉錄。")
-        raise HTTPException(status_code=503, detail="語音轉錄服務暫時不可用，模型載入失敗。")
-
     # 確保音頻格式為 Faster-Whisper 支援的類型，前端通常會發送 webm
     # Faster-Whisper 內部會使用 ffmpeg 處理多種格式，但為避免不必要的轉換複雜度，建議前端保持一致
-    if audio_file.content_type not in ["audio/webm", "audio/mp3", "audio/wav", "audio/ogg"]:
+    # 先檢查格式再等待模型載入，不支援的格式立即回傳 400 (與串流端點相同)
+    if audio_file.content_type not in SUPPORTED_AUDIO_TYPES:
          logger.warning(f"不支援的音頻格式: {audio_file.content_type}")
          raise HTTPException(status_code=400, detail=f"音頻格式 {audio_file.content_type} 不支援，請上傳 mp3, wav, ogg, webm。")
+    await _require_models("whisper")
 
     try:
-        # 將 UploadFile 讀入 BytesIO，然後傳遞給 Faster-Whisper
-        audio_bytes = await audio_file.read()
-        audio_stream = io.BytesIO(audio_bytes)
-
-        # Faster-Whisper 轉錄
-        # options 可以根據需求調整，例如語言、VAD 閾值等
-        # transcribe_options = dict(beam_size=5, vad_filter=True, vad_parameters=dict(min_silence_duration_ms=500))
-        segments, info = whisper_model.transcribe(audio_stream, beam_size=5) # 移除 options 參數
-        
-        transcribed_text = ""
-        for segment in segments:
-            transcribed_text += segment.text + " "
-        
-        transcribed_text = transcribed_text.strip()
-        
+        # Faster-Whisper 轉錄在專用工作池中執行，不阻塞 event loop
+        segments = await transcribe_file(audio_file.file)
+        transcribed_text = " ".join(segment["text"] for segment in segments).strip()
+
         logger.info(f"語音轉錄完成: '{transcribed_text[:50]}...'")
         return VoiceTranscriptionResponse(transcribed_text=transcribed_text)
+    except TranscriptionQueueFullError as e:
+        raise _queue_full_exception(e)
+    except TranscriptionUnavailableError:
+        raise HTTPException(status_code=503, detail="語音轉錄服務暫時不可用，模型載入失敗。")
     except Exception as e:
         logger.error(f"語音轉錄失敗: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"語音轉錄失敗: {e}")
 
+@app.post("/voice/transcribe/stream")
+async def transcribe_voice_stream(audio_file: UploadFile = File(...)):
+    """
+    串流轉錄：以 Server-Sent Events 逐段回傳 Faster-Whisper 的 segment (含時間戳)，
+    每個 segment 解碼完成即送出，最後送出 done 事件與完整文字。
+    時間戳對應原始音訊 (VAD 移除的靜音會換算回去)；快取命中時一次送出所有 segment。
+    """
+    logger.info(f"收到串流語音轉錄請求: filename='{audio_file.filename}', content_type='{audio_file.content_type}'")
+
+    if audio_file.content_type not in SUPPORTED_AUDIO_TYPES:
+        logger.warning(f"不支援的音頻格式: {audio_file.content_type}")
+        raise HTTPException(status_code=400, detail=f"音頻格式 {audio_file.content_type} 不支援，請上傳 mp3, wav, ogg, webm。")
+    await _require_models("whisper")
+
+    cached, cache_key = await cached_transcript(audio_file.file)
+    audio, segments = None, None
+    try:
+        if cached is None:
+            # 在開始串流回應前解碼並移除靜音，之後不再需要上傳的暫存檔
+            audio = await asyncio.to_thread(prepare_audio, audio_file.file)
+            if len(audio.samples):
+                segments = transcription_executor.stream(audio.samples)
+    except TranscriptionQueueFullError as e:
+        raise _queue_full_exception(e)
+    except TranscriptionUnavailableError:
+        raise HTTPException(status_code=503, detail="語音轉錄服務暫時不可用，模型載入失敗。")
+    except Exception as e:
+        logger.error(f"語音解碼失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"語音轉錄失敗: {e}")
+
+    async def event_stream() -> AsyncIterator[str]:
+        completed = []
+        try:
+            if cached is not None:
+                completed = cached
+                for segment in cached:
+                    yield _sse_event("segment", segment)
+            else:
+                if segments is not None:
+                    async for segment in segments:
+                        segment = audio.restore(segment)
+                        completed.append(segment)
+                        yield _sse_event("segment", segment)
+                if cache_key is not None:
+                    transcript_cache.set(cache_key, completed)
+            transcribed_text = " ".join(segment["text"] for segment in completed).strip()
+            logger.info(f"串流語音轉錄完成: '{transcribed_text[:50]}...'")
+            yield _sse_event("done", {"transcribed_text": transcribed_text})
+        except Exception as e:
+            logger.error(f"串流語音轉錄失敗: {e}", exc_info=True)
+            yield _sse_event("error", {"detail": f"語音轉錄失敗: {e}"})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.websocket("/voice/transcribe/ws")
+async def transcribe_voice_realtime(websocket: WebSocket):
+    """
+    即時轉錄：客戶端在錄音期間持續送出 16kHz 單聲道 PCM16 (little-endian) 二進位訊框，
+    錄音結束時送出文字訊框 "end"。伺服器每累積一小段音訊就回傳
+    {"event": "segment"} (已確認) 與 {"event": "partial"} (暫定) 結果，最後回傳 {"event": "done"}。
+    """
+    await websocket.accept()
+    try:
+        await model_registry.ensure("whisper")
+    except ModelUnavailableError:
+        await websocket.send_json({"event": "error", "status": 503, "detail": "語音轉錄服務暫時不可用，模型載入失敗。"})
+        await websocket.close(code=1011)
+        return
+
+    session = StreamingTranscriptionSession(transcription_executor)
+
+    async def decode_and_send(final: bool) -> None:
+        committed, pending = await session.decode(final=final)
+        for segment in committed:
+            await websocket.send_json({"event": "segment", **segment})
+        if pending:
+            await websocket.send_json({"event": "partial", "segments": pending})
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                session.append(message["bytes"])
+                if session.ready:
+                    try:
+                        await decode_and_send(final=False)
+                    except TranscriptionQueueFullError as e:
+                        # 工作池繁忙時略過本輪解碼，音訊保留在緩衝區待下一輪處理
+                        await websocket.send_json({"event": "busy", "queue_depth": e.queue_depth})
+            elif message.get("text") == "end":
+                break
+
+        await decode_and_send(final=True)
+        logger.info(f"即時語音轉錄完成: '{session.transcribed_text[:50]}...'")
+        await websocket.send_json({"event": "done", "transcribed_text": session.transcribed_text})
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.info("即時語音轉錄客戶端已斷線。")
+    except TranscriptionQueueFullError as e:
+        await websocket.send_json({"event": "error", "status": 429, "queue_depth": e.queue_depth, "detail": "語音轉錄服務繁忙，請稍後再試。"})
+        await websocket.close(code=1013)
+    except Exception as e:
+        logger.error(f"即時語音轉錄失敗: {e}", exc_info=True)
+        await websocket.send_json({"event": "error", "status": 500, "detail": f"語音轉錄失敗: {e}"})
+        await websocket.close(code=1011)
+
 @app.post("/voice/respond", response_model=VoiceResponse)
 async def get_voice_response(request: VoiceResponseRequest):
     """
     接收轉錄後的文字，透過 RAG Pipeline 進行語意解析並生成回應。
     """
     logger.info(f"收到語音回應請求: user_id={request.user_id}, prompt='{request.prompt}'")
+    await _require_models("qdrant", "embedding", "rag")
     try:
         response_text = await generate_response_from_rag(request.user_id, request.prompt, request.conversation_history)
         logger.info(f"語音回應生成完成: '{response_text[:50]}...'")
@@ -145,3 +441,91 @@ async def get_voice_response(request: VoiceResponseRequest):
     except Exception as e:
         logger.error(f"語音回應生成失敗: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"語音回應生成失敗: {e}")
+
+@app.post("/voice/respond/stream")
+async def get_voice_response_stream(request: VoiceResponseRequest):
+    """
+    串流版的語音回應：以 Server-Sent Events 先送出檢索到的文件 ID (sources 事件)，
+    再逐段送出 LLM 產生的回答 (token 事件)，最後送出 done 事件與完整回應。
+    首段文字的延遲約為檢索時間加上 LLM 的首個 token 延遲。
+    """
+    logger.info(f"收到串流語音回應請求: user_id={request.user_id}, prompt='{request.prompt}'")
+    await _require_models("qdrant", "embedding", "rag")
+    try:
+        events = stream_response_from_rag(request.user_id, request.prompt, request.conversation_history)
+    except Exception as e:
+        logger.error(f"語音回應生成失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"語音回應生成失敗: {e}")
+
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            async for event, data in events:
+                yield _sse_event(event, data)
+        except Exception as e:
+            logger.error(f"串流語音回應生成失敗: {e}", exc_info=True)
+            yield _sse_event("error", {"detail": f"語音回應生成失敗: {e}"})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/voice/sessions", response_model=SessionStatusResponse, status_code=201)
+async def create_voice_session(request: SessionCreateRequest):
+    """
+    建立伺服器端的對話工作階段 (已存在時回傳其狀態)。之後以 /voice/sessions/{session_id}/respond 只送出新的問題，
+    不需每次重送完整的對話歷史；閒置超過 SESSION_TTL_SECONDS 的工作階段會被移除。
+    """
+    session = await session_store.get_or_create(request.user_id, request.session_id) if request.session_id else await session_store.create(request.user_id)
+    return SessionStatusResponse(**session.describe())
+
+@app.get("/voice/sessions/{session_id}", response_model=SessionStatusResponse)
+async def get_voice_session(session_id: str, user_id: str):
+    """查詢工作階段的回合數、摘要與下一個回合的歷史 token 數."""
+    session = await session_store.get(user_id, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"工作階段 {session_id} 不存在或已過期。")
+    return SessionStatusResponse(**session.describe())
+
+@app.delete("/voice/sessions/{session_id}", status_code=204, response_class=Response)
+async def delete_voice_session(session_id: str, user_id: str):
+    """結束工作階段並移除其歷史."""
+    if not await session_store.delete(user_id, session_id):
+        raise HTTPException(status_code=404, detail=f"工作階段 {session_id} 不存在或已過期。")
+    return Response(status_code=204)
+
+@app.post("/voice/sessions/{session_id}/respond", response_model=VoiceResponse)
+async def get_session_voice_response(session_id: str, request: SessionVoiceRequest):
+    """
+    在工作階段中回應：對話歷史 (滾動摘要加上最近的回合) 由伺服器保存，回應後加入新的回合。
+    工作階段不存在時自動建立；同一工作階段的請求依序處理。
+    """
+    logger.info(f"收到工作階段語音回應請求: user_id={request.user_id}, session_id={session_id}, prompt='{request.prompt}'")
+    await _require_models("qdrant", "embedding", "rag")
+    try:
+        async with session_store.lock(request.user_id, session_id):
+            session = await session_store.get_or_create(request.user_id, session_id)
+            response_text = await generate_response_from_rag(request.user_id, request.prompt, session.history())
+            await session_store.record_turn(session, request.prompt, response_text)
+        logger.info(f"語音回應生成完成: '{response_text[:50]}...'")
+        return VoiceResponse(user_id=request.user_id, response_text=response_text)
+    except Exception as e:
+        logger.error(f"語音回應生成失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"語音回應生成失敗: {e}")
+
+@app.post("/voice/sessions/{session_id}/respond/stream")
+async def get_session_voice_response_stream(session_id: str, request: SessionVoiceRequest):
+    """工作階段版的串流語音回應，事件與 /voice/respond/stream 相同；回應完整送出後才加入新的回合."""
+    logger.info(f"收到工作階段串流語音回應請求: user_id={request.user_id}, session_id={session_id}, prompt='{request.prompt}'")
+    await _require_models("qdrant", "embedding", "rag")
+
+    async def event_stream() -> AsyncIterator[str]:
+        async with session_store.lock(request.user_id, session_id):
+            try:
+                session = await session_store.get_or_create(request.user_id, session_id)
+                async for event, data in stream_response_from_rag(request.user_id, request.prompt, session.history()):
+                    if event == "done":
+                        await session_store.record_turn(session, request.prompt, data["response_text"])
+                    yield _sse_event(event, data)
+            except Exception as e:
+                logger.error(f"串流語音回應生成失敗: {e}", exc_info=True)
+                yield _sse_event("error", {"detail": f"語音回應生成失敗: {e}"})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
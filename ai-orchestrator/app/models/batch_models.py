@@ -0,0 +1,17 @@
+from pydantic import BaseModel
+from typing import List, Optional
+from .document_models import DocumentUploadRequest
+
+class DocumentBatchUploadRequest(BaseModel):
+    documents: List[DocumentUploadRequest]
+
+class DocumentBatchRejection(BaseModel):
+    document_id: int
+    error: str
+
+class DocumentBatchAcceptedResponse(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+    accepted: List[int] # 排入批次任務的 document_id；逐文件結果在任務完成後的 result.documents
+    rejected: List[DocumentBatchRejection] = []
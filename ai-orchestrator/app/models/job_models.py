@@ -0,0 +1,23 @@
+from pydantic import BaseModel
+from typing import Any, Dict, Optional
+
+class JobStageProgress(BaseModel):
+    completed: int
+    total: int
+
+class JobAcceptedResponse(BaseModel):
+    job_id: str
+    document_id: Optional[int] = None
+    status: str
+    status_url: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    document_id: Optional[int] = None
+    status: str # queued, running, completed, failed
+    stage: Optional[str] = None # 目前或最後執行的階段：split, embed, upsert, summarize
+    progress: Dict[str, JobStageProgress] = {}
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
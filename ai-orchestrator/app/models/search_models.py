@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+
+class DocumentSearchRequest(BaseModel):
+    query: str
+    limit: int = 5
+    document_ids: Optional[List[int]] = None # 只搜尋這些文件
+    # 其他宣告為可過濾的 metadata 欄位 (SEARCH_FILTER_FIELDS)：單一值精確比對、列表任一符合、
+    # {"gte": ..., "lt": ...} 範圍 (datetime 欄位可用 ISO 8601 字串)，預設欄位下例如
+    # {"category": ["Policy", "FAQ"], "uploaded_by": 42}
+    filters: Dict[str, Any] = {}
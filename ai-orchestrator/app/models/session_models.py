@@ -0,0 +1,19 @@
+from pydantic import BaseModel
+from typing import Optional
+
+class SessionCreateRequest(BaseModel):
+    user_id: str
+    session_id: Optional[str] = None # 未指定時由伺服器產生
+
+class SessionVoiceRequest(BaseModel):
+    user_id: str
+    prompt: str # 只需送出新的問題，對話歷史由伺服器保存
+
+class SessionStatusResponse(BaseModel):
+    user_id: str
+    session_id: str
+    turns: int
+    summarized_messages: int # 已壓縮進摘要的訊息數
+    recent_messages: int # 逐字保留的訊息數
+    history_tokens: int # 下一個回合送入 LLM 的歷史估計 token 數
+    summary: Optional[str] = None
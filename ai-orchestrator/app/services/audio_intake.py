@@ -0,0 +1,172 @@
+from bisect import bisect_left, bisect_right
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import os
+import logging
+
+import numpy as np
+
+from faster_whisper import decode_audio
+
+from .cache_utils import LRUCache
+from .transcription_service import (
+    SAMPLE_RATE, WHISPER_BEAM_SIZE, WHISPER_MODEL_NAME, TranscriptionExecutor, transcription_executor
+)
+
+logger = logging.getLogger(__name__)
+
+# 語音活動偵測 (VAD)：解碼前移除開頭、結尾與過長的中間靜音，Whisper 只需處理有語音的部分
+AUDIO_VAD_ENABLED = os.getenv("AUDIO_VAD_ENABLED", "true").lower() == "true"
+AUDIO_VAD_THRESHOLD_DB = float(os.getenv("AUDIO_VAD_THRESHOLD_DB", -45)) # 音框 RMS 低於此值 (dBFS) 視為靜音
+AUDIO_VAD_DYNAMIC_RANGE_DB = float(os.getenv("AUDIO_VAD_DYNAMIC_RANGE_DB", 40)) # 比最大聲的音框低超過此值也視為靜音 (適應錄音增益)
+AUDIO_VAD_MIN_SILENCE_MS = int(os.getenv("AUDIO_VAD_MIN_SILENCE_MS", 500)) # 短於此長度的中間停頓保留，避免切斷語句
+AUDIO_VAD_PAD_MS = int(os.getenv("AUDIO_VAD_PAD_MS", 200)) # 每段語音前後保留的長度
+
+# 轉錄結果快取：以音訊內容的 SHA-256 為鍵，客戶端重送同一段錄音時不必重新解碼
+TRANSCRIPT_CACHE_ENABLED = os.getenv("TRANSCRIPT_CACHE_ENABLED", "true").lower() == "true"
+TRANSCRIPT_CACHE_MAX_ENTRIES = int(os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", 256))
+TRANSCRIPT_CACHE_TTL_SECONDS = float(os.getenv("TRANSCRIPT_CACHE_TTL_SECONDS", 3600))
+
+FRAME_MS = 30 # VAD 音框長度
+
+Segments = List[Dict[str, Any]]
+
+
+class PreparedAudio:
+    """解碼並移除靜音後的音訊；chunks 為保留的原始取樣區間，用於把 segment 時間戳換算回原始音訊."""
+
+    def __init__(self, samples: np.ndarray, original_samples: int, chunks: List[Tuple[int, int]]):
+        self.samples = samples
+        self.original_seconds = original_samples / SAMPLE_RATE
+        self.chunks = chunks
+        self._offsets = np.cumsum([0] + [end - start for start, end in chunks]).tolist() # 各區間在裁剪後音訊中的起點
+
+    @property
+    def seconds(self) -> float:
+        return len(self.samples) / SAMPLE_RATE
+
+    def to_original(self, seconds: float, is_end: bool = False) -> float:
+        """裁剪後音訊的時間 -> 原始音訊的時間；恰好落在區間交界的結束時間歸屬前一個區間."""
+        if not self.chunks:
+            return seconds
+        sample = seconds * SAMPLE_RATE
+        index = (bisect_left if is_end else bisect_right)(self._offsets, sample) - 1
+        index = min(max(index, 0), len(self.chunks) - 1)
+        return (self.chunks[index][0] + sample - self._offsets[index]) / SAMPLE_RATE
+
+    def restore(self, segment: Dict[str, Any]) -> Dict[str, Any]:
+        return {**segment, "start": round(self.to_original(segment["start"]), 2), "end": round(self.to_original(segment["end"], is_end=True), 2)}
+
+
+def speech_regions(samples: np.ndarray,
+                   threshold_db: float = AUDIO_VAD_THRESHOLD_DB,
+                   dynamic_range_db: float = AUDIO_VAD_DYNAMIC_RANGE_DB,
+                   min_silence_ms: int = AUDIO_VAD_MIN_SILENCE_MS,
+                   pad_ms: int = AUDIO_VAD_PAD_MS) -> List[Tuple[int, int]]:
+    """
+    以音框能量偵測語音，回傳要保留的取樣區間 [start, end)。
+
+    音框 RMS 高於 max(threshold_db, 最大音框 - dynamic_range_db) 即為語音；
+    間隔短於 min_silence_ms 的語音段合併，每段前後再各保留 pad_ms。
+    """
+    frame = SAMPLE_RATE * FRAME_MS // 1000
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return [(0, len(samples))] if len(samples) else []
+    frames = samples[:n_frames * frame].reshape(n_frames, frame)
+    levels = 10 * np.log10(np.mean(np.square(frames, dtype=np.float32), axis=1) + 1e-10)
+    voiced = levels > max(threshold_db, float(levels.max()) - dynamic_range_db)
+    if not voiced.any():
+        return []
+
+    # 語音段的起訖音框：voiced 由 False 轉 True 為起點，由 True 轉 False 為終點
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], voiced.astype(np.int8), [0]])))
+    starts, ends = edges[0::2], edges[1::2]
+    min_gap = min_silence_ms // FRAME_MS
+    pad = pad_ms * SAMPLE_RATE // 1000
+
+    runs: List[List[int]] = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if runs and start - runs[-1][1] < min_gap:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+
+    regions: List[Tuple[int, int]] = []
+    for start, end in runs:
+        start, end = max(0, start * frame - pad), min(len(samples), end * frame + pad)
+        if regions and start <= regions[-1][1]: # 前後保留的部分重疊
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    if regions[-1][1] >= n_frames * frame: # 不足一個音框的結尾跟隨最後一段語音
+        regions[-1] = (regions[-1][0], len(samples))
+    return regions
+
+
+def trim_silence(samples: np.ndarray, **options: Any) -> PreparedAudio:
+    """移除靜音；沒有可移除的部分時直接使用原陣列，不複製."""
+    regions = speech_regions(samples, **options)
+    if regions == [(0, len(samples))]:
+        return PreparedAudio(samples, len(samples), regions)
+    trimmed = np.concatenate([samples[start:end] for start, end in regions]) if regions else samples[:0]
+    return PreparedAudio(trimmed, len(samples), regions)
+
+
+def prepare_audio(file: BinaryIO, vad: bool = AUDIO_VAD_ENABLED) -> PreparedAudio:
+    """由上傳的檔案解碼為 16kHz 單聲道 float32 (ffmpeg 直接讀取檔案，不先讀成 bytes)，並依設定移除靜音."""
+    file.seek(0)
+    samples = decode_audio(file, sampling_rate=SAMPLE_RATE)
+    if not vad:
+        return PreparedAudio(samples, len(samples), [(0, len(samples))])
+    audio = trim_silence(samples)
+    if audio.seconds < audio.original_seconds:
+        logger.info(f"VAD 移除 {audio.original_seconds - audio.seconds:.2f} 秒靜音 (原始 {audio.original_seconds:.2f} 秒)。")
+    return audio
+
+
+def hash_audio(file: BinaryIO) -> str:
+    """以固定大小的緩衝區逐塊計算檔案內容的 SHA-256，不把整個檔案讀進記憶體."""
+    file.seek(0)
+    digest = hashlib.file_digest(file, "sha256").hexdigest()
+    file.seek(0)
+    return digest
+
+
+def transcript_cache_key(digest: str) -> Tuple[str, str, int, bool]:
+    """快取鍵包含模型與解碼設定，換模型或調整 VAD 後不會讀到舊結果."""
+    return digest, WHISPER_MODEL_NAME, WHISPER_BEAM_SIZE, AUDIO_VAD_ENABLED
+
+
+# 全局轉錄結果快取
+transcript_cache: Optional[LRUCache[Segments]] = LRUCache(TRANSCRIPT_CACHE_MAX_ENTRIES, TRANSCRIPT_CACHE_TTL_SECONDS) if TRANSCRIPT_CACHE_ENABLED else None
+
+
+async def cached_transcript(file: BinaryIO) -> Tuple[Optional[Segments], Optional[Tuple[str, str, int, bool]]]:
+    """查詢轉錄快取，回傳 (快取的 segments 或 None, 寫回快取用的鍵)；停用快取時兩者皆為 None."""
+    if transcript_cache is None:
+        return None, None
+    key = transcript_cache_key(await asyncio.to_thread(hash_audio, file))
+    segments = transcript_cache.get(key)
+    if segments is not None:
+        logger.info(f"轉錄快取命中: {key[0][:12]}")
+        return list(segments), key
+    return None, key
+
+
+async def transcribe_file(file: BinaryIO, executor: TranscriptionExecutor = transcription_executor) -> Segments:
+    """
+    轉錄上傳的音訊檔，回傳時間戳對應原始音訊的 segments。
+
+    先以內容雜湊查詢快取；未命中時在執行緒中解碼並移除靜音，只把有語音的部分交給轉錄執行器，
+    全為靜音時不進行轉錄。
+    """
+    segments, key = await cached_transcript(file)
+    if segments is not None:
+        return segments
+    audio = await asyncio.to_thread(prepare_audio, file)
+    segments = [audio.restore(segment) for segment in await executor.transcribe_segments(audio.samples)] if len(audio.samples) else []
+    if key is not None:
+        transcript_cache.set(key, segments)
+    return segments
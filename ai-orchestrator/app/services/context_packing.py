@@ -0,0 +1,147 @@
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+import math
+import os
+
+from langchain_core.documents import Document
+
+from .ingestion_pipeline import CHUNK_OVERLAP
+from .rate_limiter import estimate_tokens
+
+# 檢索與生成之間的上下文組裝：合併相鄰文件塊並移除重疊、以 MMR 挑選多樣的段落、依 token 預算打包
+RAG_CONTEXT_PACKING = os.getenv("RAG_CONTEXT_PACKING", "true").lower() == "true"
+RAG_CANDIDATE_K = int(os.getenv("RAG_CANDIDATE_K", 8)) # 啟用打包時向 Qdrant 取回的候選文件塊數
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", 2500)) # 送入回答 Prompt 的上下文 token 上限
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", 0.7)) # 1 只看相關度，越小越偏重與已選段落的差異
+
+MIN_OVERLAP_CHARS = 20 # 視為重疊的最短共同字串，避免把偶然相同的短字串當成重疊
+PASSAGE_SEPARATOR = "\n"
+
+
+def strip_overlap(previous: str, following: str, max_overlap: int = CHUNK_OVERLAP) -> Tuple[str, int]:
+    """移除 following 開頭與 previous 結尾重複的部分 (切塊時的 chunk_overlap)，回傳 (剩餘文字, 移除的字元數)."""
+    longest = min(len(previous), len(following), max_overlap)
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(following[:size]):
+            return following[size:].lstrip(), size
+    return following, 0
+
+
+def merge_adjacent(documents: List[Document]) -> Tuple[List[Document], int]:
+    """
+    將同一份文件中 chunk_index 連續的文件塊合併為一個段落並移除重疊，回傳 (段落, 移除的重疊 token 數)。
+
+    段落的相關度取其中最高的分數，順序依最高分排列；沒有 chunk_index 的文件塊各自成為一個段落。
+    """
+    groups: Dict[Any, List[Document]] = {}
+    passages: List[Document] = []
+    for document in documents:
+        if document.metadata.get("chunk_index") is None:
+            passages.append(document)
+        else:
+            groups.setdefault(document.metadata.get("document_id"), []).append(document)
+
+    removed_tokens = 0
+    for chunks in groups.values():
+        chunks.sort(key=lambda chunk: chunk.metadata["chunk_index"])
+        run: List[Document] = []
+        for chunk in chunks + [None]:
+            if run and (chunk is None or chunk.metadata["chunk_index"] != run[-1].metadata["chunk_index"] + 1):
+                text = run[0].page_content
+                for previous, following in zip(run, run[1:]):
+                    remainder, removed = strip_overlap(previous.page_content, following.page_content)
+                    removed_tokens += estimate_tokens(following.page_content[:removed]) if removed else 0
+                    text += PASSAGE_SEPARATOR + remainder if remainder else ""
+                passages.append(Document(page_content=text, metadata={
+                    **run[0].metadata,
+                    "chunk_index": run[0].metadata["chunk_index"],
+                    "chunk_end": run[-1].metadata["chunk_index"],
+                    "score": max(item.metadata.get("score") or 0.0 for item in run),
+                }))
+                run = []
+            if chunk is not None:
+                run.append(chunk)
+
+    passages.sort(key=lambda passage: passage.metadata.get("score") or 0.0, reverse=True)
+    return passages, removed_tokens
+
+
+def _shingles(text: str) -> Counter:
+    """字元二元組 (中文) 與小寫單字 (英數) 的計數，作為段落之間的詞彙相似度特徵."""
+    compact = "".join(text.split())
+    features = Counter(compact[i:i + 2] for i in range(len(compact) - 1))
+    features.update(word.lower() for word in text.split() if word.isascii())
+    return features
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b[key] for key, count in a.items() if key in b)
+    return dot / (math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values())))
+
+
+def select_and_pack(passages: List[Document], token_budget: int, mmr_lambda: float) -> List[Document]:
+    """
+    以 MMR (最大邊際相關性) 依序挑選段落並放入 token 預算：
+    分數 = λ × 相關度 - (1 - λ) × 與已選段落的最大相似度，相關度為 Qdrant 的 cosine 分數。
+    放不下的段落略過，繼續嘗試較短的段落；第一個段落超過預算時截斷。
+    """
+    if not passages:
+        return []
+    relevance = [passage.metadata.get("score") or 0.0 for passage in passages]
+    features = [_shingles(passage.page_content) for passage in passages]
+    tokens = [estimate_tokens(passage.page_content) for passage in passages]
+
+    selected: List[int] = []
+    redundancy = [0.0] * len(passages) # 與已選段落的最大相似度
+    remaining = set(range(len(passages)))
+    budget = token_budget
+    while remaining and budget > 0:
+        best = max(remaining, key=lambda i: mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy[i])
+        remaining.discard(best)
+        if tokens[best] > budget and selected:
+            continue
+        selected.append(best)
+        budget -= tokens[best]
+        for i in remaining:
+            redundancy[i] = max(redundancy[i], _cosine(features[best], features[i]))
+
+    packed = []
+    for i in selected:
+        passage = passages[i]
+        if tokens[i] > token_budget: # 只會是第一個段落
+            passage = Document(page_content=_truncate(passage.page_content, token_budget), metadata={**passage.metadata, "truncated": True})
+        packed.append(passage)
+    return packed
+
+
+def _truncate(text: str, token_budget: int) -> str:
+    """截斷到估計 token 數不超過預算 (以二分搜尋字元數)."""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= token_budget:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+def pack_context(documents: List[Document],
+                 token_budget: int = RAG_CONTEXT_TOKEN_BUDGET,
+                 mmr_lambda: float = RAG_MMR_LAMBDA) -> Tuple[List[Document], Dict[str, int]]:
+    """組裝回答 Prompt 的上下文，回傳 (段落, 統計)；統計中的 tokens_saved 為相較於直接填入所有檢索結果省下的 token 數."""
+    retrieved_tokens = sum(estimate_tokens(document.page_content) for document in documents)
+    passages, overlap_tokens = merge_adjacent(documents)
+    packed = select_and_pack(passages, token_budget, mmr_lambda)
+    context_tokens = sum(estimate_tokens(passage.page_content) for passage in packed)
+    stats = {
+        "retrieved_chunks": len(documents),
+        "passages": len(packed),
+        "retrieved_tokens": retrieved_tokens,
+        "context_tokens": context_tokens,
+        "overlap_tokens_removed": overlap_tokens,
+        "tokens_saved": retrieved_tokens - context_tokens,
+    }
+    return packed, stats
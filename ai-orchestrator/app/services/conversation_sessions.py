@@ -0,0 +1,326 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import asyncio
+import functools
+import json
+import os
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+
+from .rate_limiter import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 伺服器端的對話工作階段 (/voice/sessions)：客戶端只需送出新的問題，歷史由伺服器保存
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "./data/sessions.db") # 工作階段的 SQLite 檔案；多個 uvicorn worker 共用同一檔案，任一 worker 都能接續工作階段
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", 10000)) # 同時保存的工作階段上限，超過時淘汰最久未使用的
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", 1800)) # 閒置超過此秒數的工作階段被移除
+SESSION_HISTORY_TOKEN_BUDGET = int(os.getenv("SESSION_HISTORY_TOKEN_BUDGET", 1200)) # 逐字保留的歷史超過此 token 數時，較舊的對話壓縮為摘要
+SESSION_KEEP_RECENT_MESSAGES = int(os.getenv("SESSION_KEEP_RECENT_MESSAGES", 4)) # 壓縮時保留最近幾則訊息不摘要
+SESSION_SUMMARY_MAX_WORDS = int(os.getenv("SESSION_SUMMARY_MAX_WORDS", 300)) # 滾動摘要的長度上限 (提示 LLM)
+
+Message = Dict[str, str]
+CompactFn = Callable[[str, List[Message], int], Awaitable[str]]
+SessionChange = Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+
+def _message_tokens(messages: List[Message]) -> int:
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
+
+class ConversationSession:
+    """一個工作階段的滾動摘要與最近的對話 (從 SessionDB 載入的快照)."""
+
+    def __init__(self, user_id: str, session_id: str):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.summary = ""
+        self.messages: List[Message] = []
+        self.turns = 0
+        self.summarized_messages = 0
+        self.created_at = time.time()
+        self.compaction: Optional[asyncio.Task] = None
+
+    @property
+    def history_tokens(self) -> int:
+        return estimate_tokens(self.summary) + _message_tokens(self.messages) if self.summary else _message_tokens(self.messages)
+
+    def history(self) -> List[Message]:
+        """送入 RAG 流程的歷史：滾動摘要 (以 system 訊息) 加上逐字保留的最近對話."""
+        prefix = [{"role": "system", "content": f"先前對話的摘要：{self.summary}"}] if self.summary else []
+        return prefix + list(self.messages)
+
+    def add_turn(self, prompt: str, response: str) -> None:
+        self.messages.append({"role": "user", "content": prompt})
+        self.messages.append({"role": "assistant", "content": response})
+        self.turns += 1
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "user_id": self.user_id,
+            "session_id": self.session_id,
+            "summary": self.summary,
+            "messages": list(self.messages),
+            "turns": self.turns,
+            "summarized_messages": self.summarized_messages,
+            "created_at": self.created_at,
+        }
+
+    def load(self, state: Dict[str, Any]) -> "ConversationSession":
+        self.summary = state["summary"]
+        self.messages = list(state["messages"])
+        self.turns = state["turns"]
+        self.summarized_messages = state["summarized_messages"]
+        self.created_at = state["created_at"]
+        return self
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "user_id": self.user_id,
+            "session_id": self.session_id,
+            "turns": self.turns,
+            "summarized_messages": self.summarized_messages,
+            "recent_messages": len(self.messages),
+            "history_tokens": self.history_tokens,
+            "summary": self.summary or None,
+        }
+
+
+class SessionDB:
+    """以 SQLite 保存工作階段；多個程序 (uvicorn worker) 共用同一個檔案，修改在交易中以「讀取-修改-寫回」完成."""
+
+    def __init__(self, db_path: str = SESSION_DB_PATH):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                    user_id TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    summary TEXT NOT NULL DEFAULT '',
+                    messages TEXT NOT NULL DEFAULT '[]',
+                    turns INTEGER NOT NULL DEFAULT 0,
+                    summarized_messages INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, session_id)
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        state = dict(row)
+        state["messages"] = json.loads(state["messages"])
+        return state
+
+    def _select(self, user_id: str, session_id: str, expires_before: float) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT * FROM sessions WHERE user_id = ? AND session_id = ? AND updated_at >= ?", (user_id, session_id, expires_before)
+        ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def get(self, user_id: str, session_id: str, expires_before: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._select(user_id, session_id, expires_before)
+
+    def save(self, state: Dict[str, Any], max_sessions: int, expires_before: float) -> None:
+        """寫入 (或取代) 工作階段，並移除閒置過期與超過數量上限的最久未使用工作階段."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (user_id, session_id, summary, messages, turns, summarized_messages, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (state["user_id"], state["session_id"], state["summary"], json.dumps(state["messages"], ensure_ascii=False),
+                 state["turns"], state["summarized_messages"], state["created_at"], time.time()),
+            )
+            self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (expires_before,))
+            self._conn.execute(
+                "DELETE FROM sessions WHERE rowid IN (SELECT rowid FROM sessions ORDER BY updated_at DESC, rowid DESC LIMIT -1 OFFSET ?)",
+                (max_sessions,),
+            )
+
+    def modify(self, user_id: str, session_id: str, change: SessionChange, expires_before: float) -> Optional[Dict[str, Any]]:
+        """
+        在同一個寫入交易中讀取工作階段、交給 change 修改後寫回，其他程序的修改不會被覆蓋。
+        工作階段不存在 (或已過期) 時以 {} 呼叫 change；change 回傳 None 時不寫入並回傳 None。
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            state = change(self._select(user_id, session_id, expires_before) or {})
+            if state is None:
+                return None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (user_id, session_id, summary, messages, turns, summarized_messages, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, session_id, state["summary"], json.dumps(state["messages"], ensure_ascii=False),
+                 state["turns"], state["summarized_messages"], state["created_at"], time.time()),
+            )
+        return state
+
+    def delete(self, user_id: str, session_id: str, expires_before: float) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM sessions WHERE user_id = ? AND session_id = ? AND updated_at >= ?", (user_id, session_id, expires_before)
+            )
+        return cursor.rowcount == 1
+
+    def count(self, expires_before: float) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions WHERE updated_at >= ?", (expires_before,)).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SessionStore:
+    """
+    以 (user_id, session_id) 為鍵的工作階段儲存，保存在 SessionDB (SQLite) 中，數量有上限並在閒置 TTL 後移除。
+    多個 uvicorn worker 共用 SESSION_DB_PATH，因此在任一 worker 建立的工作階段都能由其他 worker 接續。
+
+    每個回合結束後，逐字保留的歷史超過 token_budget 時在背景把較舊的訊息與既有摘要交給 compact 合併為新摘要，
+    只保留最近 keep_recent 則訊息，因此每個回合送入 LLM 的歷史大致固定。壓縮進行中的回合照常使用目前的歷史；
+    壓縮失敗時保留原訊息，但歷史超過兩倍預算時捨棄最舊的訊息，避免無限增長。
+    回合與壓縮結果都在交易中寫回；同一工作階段在同一程序內以 lock 依序處理，不同程序同時送出的回合各自加入、不會互相覆蓋。
+    """
+
+    def __init__(self, compact: CompactFn,
+                 max_sessions: int = SESSION_MAX_SESSIONS,
+                 ttl: float = SESSION_TTL_SECONDS,
+                 token_budget: int = SESSION_HISTORY_TOKEN_BUDGET,
+                 keep_recent: int = SESSION_KEEP_RECENT_MESSAGES,
+                 summary_max_words: int = SESSION_SUMMARY_MAX_WORDS,
+                 db_path: str = SESSION_DB_PATH):
+        self._compact = compact
+        self._db_path = db_path
+        self._db: Optional[SessionDB] = None
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.summary_max_words = summary_max_words
+        self._locks: "weakref.WeakValueDictionary[Tuple[str, str], asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._compactions: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        """開啟工作階段資料庫."""
+        self._db = await asyncio.to_thread(SessionDB, self._db_path)
+
+    @staticmethod
+    def _key(user_id: str, session_id: str) -> Tuple[str, str]:
+        return user_id, session_id
+
+    def _expires_before(self) -> float:
+        return time.time() - self.ttl
+
+    def lock(self, user_id: str, session_id: str) -> asyncio.Lock:
+        """同一工作階段在本程序內共用的鎖；取得鎖後再載入工作階段，才會看到前一個回合."""
+        key = self._key(user_id, session_id)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    async def create(self, user_id: str, session_id: Optional[str] = None) -> ConversationSession:
+        session = ConversationSession(user_id, session_id or uuid.uuid4().hex)
+        await asyncio.to_thread(self._db.save, session.state(), self.max_sessions, self._expires_before())
+        return session
+
+    async def get(self, user_id: str, session_id: str) -> Optional[ConversationSession]:
+        state = await asyncio.to_thread(self._db.get, user_id, session_id, self._expires_before())
+        return ConversationSession(user_id, session_id).load(state) if state else None
+
+    async def get_or_create(self, user_id: str, session_id: str) -> ConversationSession:
+        return await self.get(user_id, session_id) or await self.create(user_id, session_id)
+
+    async def delete(self, user_id: str, session_id: str) -> bool:
+        compaction = self._compactions.pop(self._key(user_id, session_id), None)
+        if compaction is not None:
+            compaction.cancel()
+        return await asyncio.to_thread(self._db.delete, user_id, session_id, self._expires_before())
+
+    async def _modify(self, session: ConversationSession, change: SessionChange) -> Optional[Dict[str, Any]]:
+        state = await asyncio.to_thread(self._db.modify, session.user_id, session.session_id, change, self._expires_before())
+        if state is not None:
+            session.load(state)
+        return state
+
+    async def record_turn(self, session: ConversationSession, prompt: str, response: str) -> None:
+        """加入一個回合 (接在其他程序已寫入的回合之後) 並更新閒置期限；歷史超過預算時排程背景壓縮."""
+        def append(state: Dict[str, Any]) -> Dict[str, Any]:
+            # 工作階段已過期或被刪除時以這個回合重新開始
+            current = ConversationSession(session.user_id, session.session_id).load(state or session.state())
+            current.add_turn(prompt, response)
+            return current.state()
+
+        await self._modify(session, append)
+        key = self._key(session.user_id, session.session_id)
+        running = self._compactions.get(key)
+        if _message_tokens(session.messages) > self.token_budget and len(session.messages) > self.keep_recent \
+                and (running is None or running.done()):
+            session.compaction = self._compactions[key] = asyncio.create_task(self._run_compaction(session))
+            self._tasks.add(session.compaction)
+            session.compaction.add_done_callback(self._tasks.discard)
+            session.compaction.add_done_callback(functools.partial(self._compaction_done, key))
+
+    def _compaction_done(self, key: Tuple[str, str], task: asyncio.Task) -> None:
+        if self._compactions.get(key) is task:
+            del self._compactions[key]
+
+    async def _run_compaction(self, session: ConversationSession) -> None:
+        count = len(session.messages) - self.keep_recent
+        older = session.messages[:count]
+        base = session.summarized_messages
+        started = time.perf_counter()
+        try:
+            summary = await self._compact(session.summary, older, self.summary_max_words)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"工作階段 {session.session_id} 的歷史壓縮失敗: {e}", exc_info=True)
+
+            def trim(state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+                if not state:
+                    return None
+                messages = state["messages"]
+                while len(messages) > self.keep_recent and _message_tokens(messages) > 2 * self.token_budget:
+                    del messages[:2]
+                    state["summarized_messages"] += 2
+                return state
+
+            await self._modify(session, trim)
+            return
+
+        def apply(state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            # 壓縮期間其他程序已壓縮 (或工作階段已刪除) 時放棄這次結果；新增的回合接在 older 之後，只移除已摘要的部分
+            if not state or state["summarized_messages"] != base:
+                return None
+            del state["messages"][:count]
+            state["summary"] = summary
+            state["summarized_messages"] += count
+            return state
+
+        if await self._modify(session, apply) is None:
+            logger.info(f"工作階段 {session.session_id} 已被其他程序壓縮或已移除，捨棄這次的摘要。")
+            return
+        logger.info(f"工作階段 {session.session_id} 已將 {count} 則訊息壓縮為摘要 ({time.perf_counter() - started:.2f} 秒，歷史 {session.history_tokens} tokens)。")
+
+    async def count(self) -> int:
+        return await asyncio.to_thread(self._db.count, self._expires_before())
+
+    async def close(self) -> None:
+        """取消進行中的壓縮任務並關閉資料庫."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._db is not None:
+            self._db.close()
@@ -1,149 +1,658 @@
-from qdrant_client import QdrantClient, models
-from typing import List, Dict, Any
+from qdrant_client import AsyncQdrantClient, models
+from typing import List, Dict, Any, AsyncIterator, Awaitable, Callable, Iterable, Optional, Set, Tuple
+import asyncio
 import os
 import logging
+import time
+import uuid
 from dotenv import load_dotenv
 
 # 確保載入環境變數
 load_dotenv()
 
 # LangChain OpenAI 導入
-from langchain_community.embeddings import OpenAIEmbeddings
 from langchain_openai import ChatOpenAI
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from .cache_utils import content_hash
+from .embedding_cache import EmbeddingCache
+from .embedding_provider import embedding_provider
+from .ingestion_pipeline import batched, prefetch, read_text_blocks, split_text_stream
+from .job_queue import ProgressCallback
+from .llm_coalescing import LLMCallCoalescer
+from .metrics import observe_stage, record_llm_call, stage_timer
+from .rate_limiter import estimate_tokens, llm_rate_limiter
+from .qdrant_settings import QDRANT_MIGRATE_ON_STARTUP, collection_settings
+from .search_cache import SEARCH_CACHE_VERSION_PATH, SearchCache
+from .search_filters import TIMESTAMP_PAYLOAD_KEYS, SearchFilters, build_search_filter, filter_cache_key, indexed_payload_values, payload_index_specs
+from .summarization import SUMMARY_CACHE_ENABLED, SUMMARY_MODE, MapReduceSummarizer, SummaryCache, SummarySession
 
 logger = logging.getLogger(__name__)
 
 QDRANT_HOST = os.getenv("QDRANT_HOST", "qdrant")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true" # 使用 gRPC 取代 REST
+QDRANT_UPSERT_BATCH_SIZE = int(os.getenv("QDRANT_UPSERT_BATCH_SIZE", 256)) # 每個 upsert 請求的 point 數上限
+QDRANT_UPSERT_CONCURRENCY = int(os.getenv("QDRANT_UPSERT_CONCURRENCY", 4)) # 同時進行的 upsert 請求數
+QDRANT_BOOTSTRAP_RETRIES = int(os.getenv("QDRANT_BOOTSTRAP_RETRIES", 5)) # 啟動時建立 collection 的重試次數
 COLLECTION_NAME = "documents_collection"
-EMBEDDING_DIM = 1536 # OpenAI text-embedding-ada-002 dimension
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "true").lower() == "true"
+
+# 增量索引配置
+INCREMENTAL_INDEXING = os.getenv("INCREMENTAL_INDEXING", "true").lower() == "true" # 只向量化新增/變更的塊
+POINT_ID_NAMESPACE = uuid.UUID("6f1c1d2e-3b8a-4c5e-9f47-2d7e0a9b8c31") # 由塊指紋推導穩定 point ID 的命名空間
+INTERNAL_PAYLOAD_KEYS = ["document_id", "chunk_index", "chunk_hash", "text"] # 非使用者 metadata 的 payload 欄位
+
+# 串流索引配置
+INGEST_EMBED_BATCH_CHUNKS = int(os.getenv("INGEST_EMBED_BATCH_CHUNKS", 400)) # 每個 Embedding -> upsert 批次的塊數
+SUMMARY_MAX_INPUT_CHARS = 4000 # 摘要時送入 LLM 的最大字元數
+SUMMARY_TEMPERATURE = float(os.getenv("SUMMARY_TEMPERATURE", 0)) # 摘要的取樣溫度；0 時結果為確定性的，可跨重啟保存在磁碟快取
+DOCUMENT_BATCH_SUMMARY_CONCURRENCY = int(os.getenv("DOCUMENT_BATCH_SUMMARY_CONCURRENCY", 4)) # 批次上傳時同時進行的摘要數
 
-# 初始化 Qdrant 客戶端
-client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+ChunkRecord = Tuple[str, int, str, str] # (point_id, chunk_index, chunk, fingerprint)
 
-# 初始化 OpenAI Embedding 和 ChatOpenAI 模型
+# 初始化 Qdrant 非同步客戶端：全局共用一個實例，底層 HTTP/gRPC 連線由連線池重用
+client = AsyncQdrantClient(host=QDRANT_HOST, port=QDRANT_PORT, grpc_port=QDRANT_GRPC_PORT, prefer_grpc=QDRANT_PREFER_GRPC)
+
+# 初始化 ChatOpenAI 模型 (Embedding 由共用的 embedding_provider 負責)
 # 確保 OPENAI_API_KEY 已在環境變數中設定
 try:
-    embeddings_model = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
-    chat_llm = ChatOpenAI(temperature=0.7, openai_api_key=os.getenv("OPENAI_API_KEY"))
-    logger.info("OpenAI Embedding and ChatOpenAI models initialized.")
+    chat_llm = ChatOpenAI(temperature=SUMMARY_TEMPERATURE, openai_api_key=os.getenv("OPENAI_API_KEY"))
+    logger.info("ChatOpenAI model initialized.")
 except Exception as e:
     logger.error(f"初始化 OpenAI 模型失敗: {e}. 請檢查 OPENAI_API_KEY。", exc_info=True)
-    embeddings_model = None
     chat_llm = None
 
+# 以 (模型名稱, 文本) 雜湊為鍵的 Embedding 快取，避免重複向量化相同的塊
+embedding_cache = EmbeddingCache(embedding_provider.name, embedding_provider.dim) if EMBEDDING_CACHE_ENABLED and embedding_provider is not None else None
+
+# 語意搜尋結果快取 (精確 + 語意兩層)，collection 有寫入時失效 (失效版本號經共用檔案通知其他 worker)
+search_cache = SearchCache(version_path=SEARCH_CACHE_VERSION_PATH) if SEARCH_CACHE_ENABLED else None
+
+SUMMARY_MODEL_NAME = getattr(chat_llm, "model_name", "")
+
+# 長文件的 map-reduce 摘要，部分摘要以塊內容雜湊持久化快取 (SQLite)
+summary_cache = SummaryCache() if SUMMARY_CACHE_ENABLED else None
+
+# 摘要呼叫的合併層：同時上傳或重試的相同文件共用一次 LLM 呼叫；temperature 0 時單次摘要也寫入 summary_cache
+summary_calls = LLMCallCoalescer("summarize", persistent=summary_cache if SUMMARY_TEMPERATURE == 0 else None)
+
+def _summary_call_key(prompt: str) -> str:
+    return content_hash(SUMMARY_MODEL_NAME, f"temperature={SUMMARY_TEMPERATURE}", prompt)
+
+async def _invoke_summary_llm(prompt: str) -> str:
+    """實際的摘要 LLM 呼叫，與其他 LLM 呼叫共用全局限流器."""
+    prompt_tokens = estimate_tokens(prompt)
+    await llm_rate_limiter.acquire(prompt_tokens)
+    try:
+        response = await chat_llm.ainvoke(prompt)
+    except Exception:
+        record_llm_call("summarize", prompt_tokens)
+        raise
+    record_llm_call("summarize", prompt_tokens, estimate_tokens(response.content))
+    return response.content
+
+async def _complete_summary(prompt: str) -> str:
+    """map-reduce 摘要的單次 LLM 呼叫 (部分摘要已由 summarizer 寫入磁碟快取，這裡只合併同時進行的相同呼叫)."""
+    if chat_llm is None:
+        raise RuntimeError("OpenAI Chat LLM 模型未載入，無法執行摘要。")
+    return await summary_calls.run(_summary_call_key(prompt), lambda: _invoke_summary_llm(prompt))
+
+summarizer = MapReduceSummarizer(_complete_summary, SUMMARY_MODEL_NAME, summary_cache)
+
+def _require_embedding_provider():
+    if embedding_provider is None:
+        raise RuntimeError("Embedding 模型未載入，請檢查 EMBEDDING_BACKEND 配置。")
+    return embedding_provider
+
 async def initialize_qdrant_collection():
-    """確保 Qdrant Collection 存在."""
+    """
+    確保 Qdrant Collection 存在，向量維度由目前的 Embedding 提供者決定，
+    量化、磁碟儲存與 HNSW 參數由 collection_settings (環境變數) 決定。
+    """
     try:
-        collections = client.get_collections().collections
+        dim = _require_embedding_provider().dim
+        collections = (await client.get_collections()).collections
         if COLLECTION_NAME not in [c.name for c in collections]:
-            client.recreate_collection(
-                collection_name=COLLECTION_NAME,
-                vectors_config=models.VectorParams(size=EMBEDDING_DIM, distance=models.Distance.COSINE),
-            )
-            logger.info(f"Collection '{COLLECTION_NAME}' created in Qdrant.")
+            await client.recreate_collection(collection_name=COLLECTION_NAME, **collection_settings.create_kwargs(dim))
+            logger.info(f"Collection '{COLLECTION_NAME}' created in Qdrant (維度 {dim}, 模型 {embedding_provider.name}, 設定 {collection_settings.describe()}).")
         else:
             logger.info(f"Collection '{COLLECTION_NAME}' already exists.")
+            await migrate_collection_settings(dim)
+        await ensure_payload_indexes()
     except Exception as e:
         logger.error(f"初始化 Qdrant collection 失敗: {e}", exc_info=True)
         raise
 
+async def migrate_collection_settings(dim: int, apply: bool = QDRANT_MIGRATE_ON_STARTUP) -> Dict[str, Any]:
+    """
+    將既有 collection 的量化、磁碟儲存與 HNSW 設定更新為目前的配置，回傳變更的項目。
+    update_collection 立即返回，Qdrant 在背景重建量化資料與索引，期間搜尋仍可使用；
+    apply 為 False 時只記錄差異，讓維運人員選擇在離峰時段以 QDRANT_MIGRATE_ON_STARTUP=true 重啟套用。
+    """
+    info = await client.get_collection(collection_name=COLLECTION_NAME)
+    changes = collection_settings.diff(info, dim)
+    if not changes:
+        return changes
+    if not apply:
+        logger.warning(f"Collection '{COLLECTION_NAME}' 的設定與配置不同 ({', '.join(changes)})，設定 QDRANT_MIGRATE_ON_STARTUP=true 後重啟以套用。")
+        return changes
+    await client.update_collection(collection_name=COLLECTION_NAME, **changes)
+    logger.info(f"Collection '{COLLECTION_NAME}' 設定已更新: {', '.join(changes)}，Qdrant 將在背景重建索引。")
+    return changes
+
+async def ensure_payload_indexes() -> None:
+    """
+    為 document_id 與宣告的過濾欄位建立 payload index (已存在的略過)，
+    讓過濾搜尋與依 document_id 的 scroll/delete 不需掃描整個 collection。
+    """
+    existing = (await client.get_collection(collection_name=COLLECTION_NAME)).payload_schema or {}
+    for field_name, schema in payload_index_specs():
+        if field_name in existing:
+            continue
+        await client.create_payload_index(collection_name=COLLECTION_NAME, field_name=field_name, field_schema=schema, wait=True)
+        logger.info(f"已為 '{COLLECTION_NAME}' 建立 payload index: {field_name} ({schema.value})")
+
+async def bootstrap_qdrant(retries: int = QDRANT_BOOTSTRAP_RETRIES) -> None:
+    """
+    應用程式啟動時執行一次的 collection 初始化；Qdrant 尚未就緒時以指數退避重試。
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            await initialize_qdrant_collection()
+            return
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            delay = 2 ** (attempt - 1)
+            logger.warning(f"Qdrant 尚未就緒 (第 {attempt} 次嘗試): {e}，{delay} 秒後重試。")
+            await asyncio.sleep(delay)
+
+async def close_qdrant() -> None:
+    """關閉共用的 Qdrant 連線."""
+    await client.close()
+
+async def upsert_points_batched(points: List[models.PointStruct]) -> None:
+    """
+    將大量 point 切分為大小受限的批次，以有限併發數管線化送出，
+    避免單一巨大批次的 wait=True 主導整體寫入延遲。
+    """
+    batches = [points[i:i + QDRANT_UPSERT_BATCH_SIZE] for i in range(0, len(points), QDRANT_UPSERT_BATCH_SIZE)]
+    semaphore = asyncio.Semaphore(QDRANT_UPSERT_CONCURRENCY)
+
+    async def upsert_batch(batch: List[models.PointStruct]) -> None:
+        async with semaphore:
+            await client.upsert(
+                collection_name=COLLECTION_NAME,
+                points=batch,
+                wait=True # 等待操作完成
+            )
+
+    await asyncio.gather(*(upsert_batch(batch) for batch in batches))
+    logger.info(f"已分 {len(batches)} 個批次寫入 {len(points)} 個 point (併發上限 {QDRANT_UPSERT_CONCURRENCY})。")
+
+async def warmup_embedding() -> None:
+    """以短字串呼叫一次 Embedding 模型 (不經過快取)，預先建立連線或初始化推論環境."""
+    await _require_embedding_provider().embed_query("warmup")
+
 async def get_embedding(text: str) -> List[float]:
     """
-    使用 OpenAIEmbeddings 獲取文本 Embedding。
+    使用共用的 Embedding 提供者獲取查詢文本的 Embedding。
+    """
+    if embedding_cache is not None:
+        cached = embedding_cache.get(text)
+        if cached is not None:
+            return cached
+    embedding = await _require_embedding_provider().embed_query(text)
+    if embedding_cache is not None:
+        embedding_cache.set(text, embedding)
+    return embedding
+
+async def _report_progress(progress: Optional[ProgressCallback], stage: str, completed: int, total: int) -> None:
+    if progress is not None:
+        await progress(stage, completed, total)
+
+async def get_embeddings_batched(texts: List[str], progress: Optional[ProgressCallback] = None) -> List[List[float]]:
+    """
+    透過 Embedding 提供者批次向量化 (批次切分、併發上限與重試由提供者處理)。
+    重複的文本只向量化一次，已快取的文本不會送出請求。回傳的向量順序與輸入文本一致。
+    progress 會在每個批次完成時以 ("embed", 已完成塊數, 需向量化塊數) 被呼叫。
     """
-    if embeddings_model is None:
-        raise RuntimeError("OpenAI Embedding 模型未載入，請檢查配置。")
+    if not texts:
+        await _report_progress(progress, "embed", 0, 0)
+        return []
+
+    # 去除重複文本 (保持順序)，並查詢快取
+    unique_texts = list(dict.fromkeys(texts))
+    vectors: Dict[str, List[float]] = {}
+    if embedding_cache is not None:
+        for text in unique_texts:
+            cached = embedding_cache.get(text)
+            if cached is not None:
+                vectors[text] = cached
+    missing = [text for text in unique_texts if text not in vectors]
+    logger.info(f"Embedding 請求: {len(texts)} 個塊，去重後 {len(unique_texts)} 個，快取命中 {len(vectors)} 個，需向量化 {len(missing)} 個。")
+
+    if missing:
+        provider = _require_embedding_provider()
+        completed = 0
+        await _report_progress(progress, "embed", completed, len(missing))
+
+        async def report_batch(batch_size: int) -> None:
+            nonlocal completed
+            completed += batch_size
+            await _report_progress(progress, "embed", completed, len(missing))
+
+        for text, embedding in zip(missing, await provider.embed_documents(missing, on_batch=report_batch)):
+            vectors[text] = embedding
+            if embedding_cache is not None:
+                embedding_cache.set(text, embedding)
+    else:
+        await _report_progress(progress, "embed", 0, 0)
+
+    return [vectors[text] for text in texts]
+
+def chunk_fingerprint(chunk: str) -> str:
+    """塊內容的指紋 (SHA-256)."""
+    return content_hash(chunk)
+
+def chunk_point_id(document_id: int, fingerprint: str, occurrence: int) -> str:
+    """
+    由 (document_id, 塊指紋, 同文件內第幾次出現) 推導穩定的 UUID point ID。
+    內容不變的塊在重新索引時保有相同 ID，因此可以跳過向量化。
+    """
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{document_id}:{fingerprint}:{occurrence}"))
+
+def _document_filter(document_id: int) -> models.Filter:
+    return models.Filter(must=[models.FieldCondition(key="document_id", match=models.MatchValue(value=document_id))])
+
+async def fetch_indexed_chunks(document_id: int) -> Dict[str, Dict[str, Any]]:
+    """
+    取得 Qdrant 中該文件已索引的 point ID 與 payload (不含文本與向量)。
+    """
+    indexed: Dict[str, Dict[str, Any]] = {}
+    offset = None
+    while True:
+        records, offset = await client.scroll(
+            collection_name=COLLECTION_NAME,
+            scroll_filter=_document_filter(document_id),
+            limit=256,
+            offset=offset,
+            with_payload=models.PayloadSelectorExclude(exclude=["text"]),
+            with_vectors=False
+        )
+        for record in records:
+            indexed[str(record.id)] = record.payload or {}
+        if offset is None:
+            return indexed
+
+async def _write_to_qdrant(target: str, operation: Awaitable[Any]) -> None:
     try:
-        # LangChain 的 embed_query 可能是同步的，在非同步環境中需要用 run_in_executor
-        # 為了簡潔，這裡直接呼叫，假設它足夠快或在 async context 中被包裝
-        embedding = embeddings_model.embed_query(text)
-        return embedding
+        await operation
     except Exception as e:
-        logger.error(f"獲取 Embedding 失敗: {e}", exc_info=True)
-        raise RuntimeError(f"Embedding 服務錯誤: {e}")
+        logger.error(f"儲存{target}到 Qdrant 失敗: {e}", exc_info=True)
+        raise RuntimeError(f"儲存到向量資料庫失敗: {e}")
+
 
-async def process_document_embedding(document_id: int, file_path: str, metadata: Dict[str, Any]) -> str:
+class DocumentIndexer:
     """
-    處理文件：讀取內容，分割，向量化，儲存到 Qdrant。
-    並生成文件摘要。
+    單一文件的索引狀態。
+
+    增量模式下，比對塊指紋與 Qdrant 中已有的 point：只有新增或變更的塊需要向量化與 upsert，
+    內容未變但位置或 metadata 改變的塊只更新 payload，不再存在的舊塊在 finalize 時批次刪除。
+    完整模式下所有塊都重新向量化並寫入 (相同 ID 的 point 直接覆蓋)，舊塊同樣在 finalize 時才刪除，
+    因此重新索引期間或中途失敗時，該文件仍可被搜尋到。
     """
-    await initialize_qdrant_collection()
-    logger.info(f"開始處理文件 {document_id}，路徑: {file_path}")
 
-    content = ""
-    try:
-        # 在實際應用中，需要考慮文件類型（PDF, DOCX, TXT）並使用對應的解析器
-        # 這裡為了範例，假設 file_path 指向一個純文本文件
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        logger.info(f"文件 {document_id} 內容讀取成功，長度: {len(content)}.")
-    except FileNotFoundError:
+    def __init__(self, document_id: int, metadata: Dict[str, Any], incremental: Optional[bool] = None):
+        self.document_id = document_id
+        self.metadata = metadata
+        self.incremental = INCREMENTAL_INDEXING if incremental is None else incremental
+        self.stats = {"total": 0, "embedded": 0, "payload_updated": 0, "deleted": 0}
+        self._indexed: Dict[str, Dict[str, Any]] = {}
+        self._seen_ids: Set[str] = set()
+        self._occurrences: Dict[str, int] = {}
+        self._payload_updates: List[models.OverwritePayloadOperation] = []
+
+    @property
+    def label(self) -> str:
+        return f"文件 {self.document_id} "
+
+    async def prepare(self) -> None:
+        try:
+            self._indexed = await fetch_indexed_chunks(self.document_id)
+        except Exception as e:
+            logger.error(f"讀取文件 {self.document_id} 的既有索引失敗: {e}", exc_info=True)
+            raise RuntimeError(f"讀取向量資料庫失敗: {e}")
+
+    def _build_payload(self, chunk_index: int, fingerprint: str) -> Dict[str, Any]:
+        return {**self.metadata, **indexed_payload_values(self.metadata), "document_id": self.document_id, "chunk_index": chunk_index, "chunk_hash": fingerprint}
+
+    async def _flush_payload_updates(self) -> None:
+        if self._payload_updates:
+            await _write_to_qdrant(self.label, client.batch_update_points(collection_name=COLLECTION_NAME, update_operations=list(self._payload_updates), wait=True))
+            self._payload_updates.clear()
+
+    async def add(self, chunk: str) -> Optional[ChunkRecord]:
+        """計算塊的指紋與穩定 ID (重複的塊以出現次序區分)；需要向量化時回傳該塊的紀錄."""
+        chunk_index = self.stats["total"]
+        fingerprint = chunk_fingerprint(chunk)
+        occurrence = self._occurrences.get(fingerprint, 0)
+        self._occurrences[fingerprint] = occurrence + 1
+        point_id = chunk_point_id(self.document_id, fingerprint, occurrence)
+        self._seen_ids.add(point_id)
+        self.stats["total"] += 1
+        if not self.incremental or point_id not in self._indexed:
+            return point_id, chunk_index, chunk, fingerprint
+        payload = self._build_payload(chunk_index, fingerprint)
+        if self._indexed[point_id] != payload:
+            # 以覆寫取代合併 (SetPayload)，新 metadata 中已移除的欄位不會殘留；既有 payload 不含文本，因此一併寫回
+            self._payload_updates.append(models.OverwritePayloadOperation(overwrite_payload=models.SetPayload(payload={**payload, "text": chunk}, points=[point_id])))
+            self.stats["payload_updated"] += 1
+            if len(self._payload_updates) >= QDRANT_UPSERT_BATCH_SIZE:
+                await self._flush_payload_updates()
+        return None
+
+    def build_point(self, record: ChunkRecord, embedding: List[float]) -> models.PointStruct:
+        point_id, chunk_index, chunk, fingerprint = record
+        return models.PointStruct(id=point_id, vector=embedding, payload={**self._build_payload(chunk_index, fingerprint), "text": chunk})
+
+    async def finalize(self) -> Dict[str, int]:
+        """所有塊都寫入後呼叫：送出剩餘的 payload 更新並刪除舊版本遺留的塊."""
+        await self._flush_payload_updates()
+        orphan_ids = [point_id for point_id in self._indexed if point_id not in self._seen_ids]
+        if orphan_ids:
+            await _write_to_qdrant(self.label, client.delete(collection_name=COLLECTION_NAME, points_selector=models.PointIdsList(points=orphan_ids), wait=True))
+        self.stats["deleted"] = len(orphan_ids)
+        logger.info(f"文件 {self.document_id} 索引完成 ({'增量' if self.incremental else '完整'}): {self.stats}")
+        return self.stats
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.stats["embedded"] or self.stats["payload_updated"] or self.stats["deleted"] or not self.incremental)
+
+
+IndexItem = Tuple[DocumentIndexer, ChunkRecord]
+BatchErrorHandler = Callable[[Set[DocumentIndexer], Exception], None]
+
+async def _run_index_pipeline(items: AsyncIterator[IndexItem], progress: Optional[ProgressCallback] = None, on_error: Optional[BatchErrorHandler] = None) -> None:
+    """
+    串流索引管線：需要向量化的塊 -> Embedding 批次 -> upsert 批次，相鄰階段之間以有界佇列銜接，
+    因此各階段在時間上重疊，記憶體用量不隨文件大小增長。塊可以來自多份文件，共用同一批次。
+
+    on_error 為 None 時任何批次失敗都會中止管線；否則以 (受影響的文件, 例外) 呼叫後略過該批次。
+    """
+    planned = embedded = upserted = 0
+
+    async def counted() -> AsyncIterator[IndexItem]:
+        nonlocal planned
+        async for item in items:
+            planned += 1
+            yield item
+
+    async def embed(batches: AsyncIterator[List[IndexItem]]) -> AsyncIterator[List[Tuple[DocumentIndexer, models.PointStruct]]]:
+        """只向量化新增或變更的塊：耗時取決於批次數而非塊數."""
+        nonlocal embedded
+        async for batch in batches:
+            try:
+                with stage_timer("ingest", "embed"):
+                    embeddings = await get_embeddings_batched([record[2] for _, record in batch])
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error({indexer for indexer, _ in batch}, e)
+                continue
+            embedded += len(batch)
+            await _report_progress(progress, "embed", embedded, planned)
+            yield [(indexer, indexer.build_point(record, embedding)) for (indexer, record), embedding in zip(batch, embeddings)]
+
+    async for batch in prefetch(embed(prefetch(batched(counted(), INGEST_EMBED_BATCH_CHUNKS)))):
+        indexers = {indexer for indexer, _ in batch}
+        try:
+            with stage_timer("ingest", "upsert"):
+                await _write_to_qdrant(f" {len(indexers)} 份文件的塊", upsert_points_batched([point for _, point in batch]))
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(indexers, e)
+            continue
+        for indexer, _ in batch:
+            indexer.stats["embedded"] += 1
+        upserted += len(batch)
+        await _report_progress(progress, "upsert", upserted, embedded)
+
+    await _report_progress(progress, "embed", embedded, embedded)
+    await _report_progress(progress, "upsert", upserted, upserted)
+
+async def index_chunk_stream(document_id: int, chunks: AsyncIterator[str], metadata: Dict[str, Any], incremental: Optional[bool] = None, progress: Optional[ProgressCallback] = None) -> Dict[str, int]:
+    """
+    以串流方式將文件的塊寫入 Qdrant (見 DocumentIndexer 與 _run_index_pipeline)。
+    回傳各類塊的數量統計。
+    """
+    indexer = DocumentIndexer(document_id, metadata, incremental)
+    await indexer.prepare()
+
+    async def items() -> AsyncIterator[IndexItem]:
+        async for chunk in chunks:
+            record = await indexer.add(chunk)
+            if record is not None:
+                yield indexer, record
+
+    await _run_index_pipeline(items(), progress)
+    stats = await indexer.finalize()
+    if search_cache is not None and indexer.changed:
+        search_cache.invalidate()
+    return stats
+
+async def _iterate(items: Iterable[str]) -> AsyncIterator[str]:
+    for item in items:
+        yield item
+
+async def index_document_chunks(document_id: int, chunks: List[str], metadata: Dict[str, Any], incremental: Optional[bool] = None, progress: Optional[ProgressCallback] = None) -> Dict[str, int]:
+    """將已在記憶體中的塊列表寫入 Qdrant，行為同 index_chunk_stream."""
+    return await index_chunk_stream(document_id, _iterate(chunks), metadata, incremental, progress)
+
+async def _read_document_chunks(document_id: int, file_path: str, head: List[str], on_read: Optional[Callable[[int, int], Awaitable[None]]] = None) -> AsyncIterator[str]:
+    """
+    串流讀取並分割文件；文件開頭 (摘要所需的 SUMMARY_MAX_INPUT_CHARS + 1 個字元) 會附加到 head。
+    """
+    # 在實際應用中，需要考慮文件類型（PDF, DOCX, TXT）並使用對應的解析器
+    # 這裡為了範例，假設 file_path 指向一個純文本文件
+    if not os.path.isfile(file_path):
         logger.error(f"處理文件 {document_id} 失敗: 文件路徑不存在: {file_path}")
         raise FileNotFoundError(f"文件未找到: {file_path}")
-    except Exception as e:
-        logger.error(f"讀取文件 {document_id} 時發生錯誤: {e}", exc_info=True)
-        raise RuntimeError(f"讀取文件失敗: {e}")
-
-    # 使用 LangChain 的文本分割器
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = text_splitter.split_text(content)
-    
-    if not chunks:
-        chunks = [""] # 處理空文件情況
-
-    points = []
-    for i, chunk in enumerate(chunks):
-        embedding = await get_embedding(chunk)
-        points.append(
-            models.PointStruct(
-                id=f"{document_id}_{i}", # 結合 document_id 和 chunk 索引作為 point ID
-                vector=embedding,
-                payload={"document_id": document_id, "chunk_index": i, "text": chunk, **metadata}
-            )
-        )
-    
-    if points:
+
+    head_chars = 0
+
+    async def blocks() -> AsyncIterator[str]:
+        nonlocal head_chars
         try:
-            client.upsert(
-                collection_name=COLLECTION_NAME,
-                points=points,
-                wait=True # 等待操作完成
-            )
-            logger.info(f"文件 {document_id} 的 {len(points)} 個塊已儲存到 Qdrant。")
+            async for block in read_text_blocks(file_path, on_read=on_read):
+                if head_chars <= SUMMARY_MAX_INPUT_CHARS:
+                    head.append(block[:SUMMARY_MAX_INPUT_CHARS + 1 - head_chars])
+                    head_chars += len(head[-1])
+                yield block
         except Exception as e:
-            logger.error(f"儲存文件 {document_id} 到 Qdrant 失敗: {e}", exc_info=True)
-            raise RuntimeError(f"儲存到向量資料庫失敗: {e}")
+            logger.error(f"讀取文件 {document_id} 時發生錯誤: {e}", exc_info=True)
+            raise RuntimeError(f"讀取文件失敗: {e}")
+
+    empty = True
+    async for chunk in split_text_stream(prefetch(blocks())):
+        empty = False
+        yield chunk
+    if empty:
+        yield "" # 處理空文件情況
+
+def _start_summary(document_id: int, progress: Optional[ProgressCallback] = None) -> Optional[SummarySession]:
+    """SUMMARY_MODE 為 map_reduce 時建立摘要工作階段，超過 SUMMARY_MAX_INPUT_CHARS 的文件才會實際 map."""
+    if SUMMARY_MODE != "map_reduce":
+        return None
+    return summarizer.start(document_id, min_chars=SUMMARY_MAX_INPUT_CHARS, progress=progress)
+
+async def _finish_summary(document_id: int, session: Optional[SummarySession], head: List[str]) -> str:
+    """短文件 (或 truncate 模式) 以單次呼叫摘要文件開頭，長文件等待 map-reduce 結果."""
+    with stage_timer("ingest", "summarize"):
+        if session is None or not session.mapped:
+            return await summarize_document(document_id, "".join(head))
+        if chat_llm is None:
+            session.cancel()
+            raise RuntimeError("OpenAI Chat LLM 模型未載入，無法執行摘要。")
+        try:
+            return await session.result()
+        except Exception as e:
+            logger.error(f"文件 {document_id} map-reduce 摘要失敗: {e}", exc_info=True)
+            return "無法生成摘要。"
+
+async def process_document_embedding(document_id: int, file_path: str, metadata: Dict[str, Any], incremental: Optional[bool] = None, progress: Optional[ProgressCallback] = None) -> str:
+    """
+    處理文件：串流讀取內容、分割、向量化並分批儲存到 Qdrant，最後生成文件摘要。
+    檔案以固定大小的區塊讀取，整份內容與所有向量都不會同時存在記憶體中。
+    incremental 為 None 時依 INCREMENTAL_INDEXING 設定決定是否增量索引；
+    progress 會收到 split (已讀/總位元組數)、embed、upsert、summarize 各階段的進度。
+    """
+    logger.info(f"開始處理文件 {document_id}，路徑: {file_path}")
+
+    async def report_read(read: int, total: int) -> None:
+        await _report_progress(progress, "split", read, total)
+
+    head: List[str] = [] # 短文件以單次呼叫摘要開頭即可
+    session = _start_summary(document_id, progress)
+    chunks = _read_document_chunks(document_id, file_path, head, report_read)
+    try:
+        # 長文件的 map 摘要與向量化同時進行
+        await index_chunk_stream(document_id, session.tee(chunks) if session else chunks, metadata, incremental, progress)
+    except BaseException:
+        if session is not None:
+            session.cancel()
+        raise
 
     # 生成摘要
-    summary = await summarize_document(document_id, content)
+    summary = await _finish_summary(document_id, session, head)
+    await _report_progress(progress, "summarize", 1, 1)
     return summary
 
-async def search_documents_qdrant(query: str, limit: int = 5) -> List[Dict[str, Any]]:
+async def process_documents_batch(documents: List[Dict[str, Any]], incremental: Optional[bool] = None, progress: Optional[ProgressCallback] = None) -> List[Dict[str, Any]]:
+    """
+    批次處理多份文件 (每項含 document_id、file_path、metadata)。
+
+    文件依序串流讀取與分割，但來自不同文件的塊共用 Embedding 批次與 upsert 批次，
+    因此大量小文件不會各自產生未滿的批次；供應商配額由全局限流器控管。
+    單一文件失敗不影響其他文件；失敗的文件不會刪除舊塊，重新上傳即可修復。
+    回傳與輸入順序相同的逐文件結果；progress 的 split 與 summarize 以文件數計。
+    """
+    logger.info(f"開始批次處理 {len(documents)} 份文件。")
+    indexers: List[DocumentIndexer] = []
+    heads: Dict[int, List[str]] = {}
+    sessions: Dict[int, Optional[SummarySession]] = {}
+    errors: Dict[int, str] = {}
+
+    def fail(failed: Set[DocumentIndexer], error: Exception) -> None:
+        for indexer in failed:
+            errors.setdefault(indexer.document_id, str(error))
+            if sessions.get(indexer.document_id) is not None:
+                sessions[indexer.document_id].cancel()
+        logger.error(f"批次處理中 {len(failed)} 份文件失敗: {error}")
+
+    async def items() -> AsyncIterator[IndexItem]:
+        for n, document in enumerate(documents, 1):
+            indexer = DocumentIndexer(document["document_id"], document.get("metadata") or {}, incremental)
+            indexers.append(indexer)
+            heads[indexer.document_id] = []
+            session = sessions[indexer.document_id] = _start_summary(indexer.document_id)
+            try:
+                await indexer.prepare()
+                async for chunk in _read_document_chunks(indexer.document_id, document["file_path"], heads[indexer.document_id]):
+                    if session is not None:
+                        await session.add(chunk)
+                    record = await indexer.add(chunk)
+                    if record is not None:
+                        yield indexer, record
+            except Exception as e:
+                fail({indexer}, e)
+            await _report_progress(progress, "split", n, len(documents))
+
+    await _run_index_pipeline(items(), progress, on_error=fail)
+
+    completed = [indexer for indexer in indexers if indexer.document_id not in errors]
+    for indexer in completed:
+        try:
+            await indexer.finalize()
+        except Exception as e:
+            fail({indexer}, e)
+    if search_cache is not None and any(indexer.changed for indexer in indexers):
+        search_cache.invalidate()
+
+    # 摘要 (LLM 呼叫受全局限流器約束，這裡另外限制同時進行的數量；長文件的 map 在索引期間已開始)
+    semaphore = asyncio.Semaphore(DOCUMENT_BATCH_SUMMARY_CONCURRENCY)
+    summaries: Dict[int, str] = {}
+    summarized = 0
+
+    async def summarize(indexer: DocumentIndexer) -> None:
+        nonlocal summarized
+        async with semaphore:
+            summaries[indexer.document_id] = await _finish_summary(indexer.document_id, sessions[indexer.document_id], heads[indexer.document_id])
+        summarized += 1
+        await _report_progress(progress, "summarize", summarized, len(documents))
+
+    await asyncio.gather(*(summarize(indexer) for indexer in indexers if indexer.document_id not in errors))
+
+    results = []
+    for indexer in indexers:
+        if indexer.document_id in errors:
+            results.append({"document_id": indexer.document_id, "status": "failed", "error": errors[indexer.document_id]})
+        else:
+            results.append({"document_id": indexer.document_id, "status": "processed", "summary": summaries[indexer.document_id], "stats": indexer.stats})
+    logger.info(f"批次處理完成: {len(documents) - len(errors)} 份成功，{len(errors)} 份失敗。")
+    return results
+
+async def search_documents_qdrant(query: str, limit: int = 5, filters: Optional[SearchFilters] = None) -> List[Dict[str, Any]]:
     """
     在 Qdrant 中進行語意搜尋。
+    filters 為結構化過濾條件 (見 search_filters.build_search_filter)，在 Qdrant 端以 payload index 執行；
+    不支援的欄位或條件會拋出 ValueError。
     """
-    await initialize_qdrant_collection() # 確保 collection 存在
-    logger.info(f"在 Qdrant 中搜尋: query='{query}'")
+    logger.info(f"在 Qdrant 中搜尋: query='{query}', filters={filters}")
+    query_filter = build_search_filter(filters)
+    scope = filter_cache_key(filters)
 
-    query_embedding = await get_embedding(query)
+    cache_version = None
+    if search_cache is not None:
+        cached = search_cache.get_exact(query, limit, scope)
+        if cached is not None:
+            logger.info(f"搜尋快取精確命中: query='{query}'")
+            return cached
+        cache_version = search_cache.current_version()
+
+    with stage_timer("search", "embed_query"):
+        query_embedding = await get_embedding(query)
+    if search_cache is not None:
+        cached = search_cache.get_semantic(query, query_embedding, limit, scope)
+        if cached is not None:
+            return cached
     try:
-        search_result = client.search(
+        started = time.perf_counter()
+        search_result = await client.search(
             collection_name=COLLECTION_NAME,
             query_vector=query_embedding,
+            query_filter=query_filter,
+            search_params=collection_settings.search_params(),
             limit=limit,
             with_payload=True
         )
+        observe_stage("search", "qdrant", time.perf_counter() - started)
         results = []
         for hit in search_result:
             results.append({
                 "score": hit.score,
                 "document_id": hit.payload.get("document_id"),
+                "chunk_index": hit.payload.get("chunk_index"),
                 "text_chunk": hit.payload.get("text"),
-                "metadata": {k: v for k, v in hit.payload.items() if k not in ["document_id", "chunk_index", "text"]}
+                "metadata": {k: v for k, v in hit.payload.items() if k not in INTERNAL_PAYLOAD_KEYS and k not in TIMESTAMP_PAYLOAD_KEYS}
             })
         logger.info(f"Qdrant 搜尋完成，找到 {len(results)} 個結果。")
+        if search_cache is not None:
+            search_cache.set(query, query_embedding, limit, results, version=cache_version, scope=scope)
         return results
     except Exception as e:
         logger.error(f"Qdrant 搜尋失敗: {e}", exc_info=True)
@@ -159,15 +668,26 @@ async def summarize_document(document_id: int, text_content: str) -> str:
     try:
         # 限制輸入長度，避免超出 LLM token 限制
         # 注意：實際應基於 tokenizer 估計長度
-        max_input_length = 4000 
+        max_input_length = SUMMARY_MAX_INPUT_CHARS
         truncated_content = text_content[:max_input_length] + ("..." if len(text_content) > max_input_length else "")
 
         prompt = f"請簡潔、清晰地總結以下文件內容：\n\n{truncated_content}"
-        # chat_llm.ainvoke 是非同步呼叫
-        summary_response = await chat_llm.ainvoke(prompt)
-        summary = summary_response.content
+        # 相同內容的摘要 (重試、重複上傳) 共用進行中的呼叫或快取的結果
+        summary = await summary_calls.run(_summary_call_key(prompt), lambda: _invoke_summary_llm(prompt), persist=True)
         logger.info(f"文件 {document_id} 摘要生成完成。")
         return summary
     except Exception as e:
         logger.error(f"文件 {document_id} 摘要失敗 (LLM 錯誤): {e}", exc_info=True)
         return "無法生成摘要。"
+
+async def summarize_text(document_id: int, text_content: str) -> str:
+    """
+    摘要任意長度的文本：不超過 SUMMARY_MAX_INPUT_CHARS 時單次呼叫，
+    否則以與索引相同的方式分割後進行 map-reduce 摘要 (truncate 模式則只摘要開頭)。
+    """
+    if SUMMARY_MODE != "map_reduce" or len(text_content) <= SUMMARY_MAX_INPUT_CHARS:
+        return await summarize_document(document_id, text_content)
+    session = _start_summary(document_id)
+    async for chunk in split_text_stream(_iterate([text_content])):
+        await session.add(chunk)
+    return await _finish_summary(document_id, session, [text_content])
@@ -0,0 +1,147 @@
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+import fcntl
+import os
+import re
+import logging
+import threading
+
+import numpy as np
+
+from .cache_utils import LRUCache, content_hash
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./data/embedding_cache") # 磁碟層根目錄
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", 20000)) # 記憶體 LRU 層可保存的向量數
+
+
+class EmbeddingCache:
+    """
+    以內容雜湊 (模型名稱 + 文本) 為鍵的兩層 Embedding 快取。
+
+    - 記憶體層：有容量上限的 LRU，存放 float32 向量。
+    - 磁碟層：每個模型一個目錄，vectors.f32 為 append-only 的 float32 矩陣 (以 memmap 讀取)，
+      index.tsv 記錄「雜湊 -> 列號」。先寫向量再寫索引，因此中途崩潰只會遺失最後一筆。
+      多個程序 (uvicorn worker) 共用同一目錄時，寫入在 lock 檔的 fcntl 排他鎖下進行，
+      列號由 vectors.f32 的實際大小推導，而非各程序自己的計數。
+    """
+
+    def __init__(self, model_name: str, dim: int,
+                 max_memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS,
+                 cache_dir: str = EMBEDDING_CACHE_DIR):
+        self.model_name = model_name
+        self.dim = dim
+        self._memory: LRUCache[np.ndarray] = LRUCache(max_memory_items)
+        self._lock = threading.Lock()
+        self._index: Dict[str, int] = {}
+        self._mmap: Optional[np.memmap] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._dir = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+        self._vectors_path = os.path.join(self._dir, "vectors.f32")
+        self._index_path = os.path.join(self._dir, "index.tsv")
+        self._lock_path = os.path.join(self._dir, "lock")
+        self._row_bytes = dim * np.dtype(np.float32).itemsize
+        self._load_index()
+
+    @contextmanager
+    def _file_lock(self, operation: int) -> Iterator[None]:
+        """跨程序的檔案鎖 (operation 為 fcntl.LOCK_SH 或 fcntl.LOCK_EX)."""
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _load_index(self) -> None:
+        """載入磁碟索引，忽略不完整的索引列與沒有對應向量資料的索引列 (寫入中途崩潰的情況)."""
+        try:
+            os.makedirs(self._dir, exist_ok=True)
+            with self._file_lock(fcntl.LOCK_SH):
+                rows_on_disk = os.path.getsize(self._vectors_path) // self._row_bytes if os.path.exists(self._vectors_path) else 0
+                if os.path.exists(self._index_path):
+                    with open(self._index_path, "r", encoding="utf-8") as f:
+                        for line in f:
+                            if not line.endswith("\n"):
+                                break
+                            key, _, row = line.rstrip("\n").partition("\t")
+                            if row.isdigit() and int(row) < rows_on_disk:
+                                self._index[key] = int(row)
+            self._rows = rows_on_disk
+            logger.info(f"Embedding 快取 '{self.model_name}' 已載入 {len(self._index)} 筆磁碟項目。")
+        except Exception as e:
+            logger.error(f"載入 Embedding 磁碟快取失敗: {e}，僅使用記憶體快取。", exc_info=True)
+            self._index = {}
+            self._rows = 0
+
+    def key(self, text: str) -> str:
+        return content_hash(self.model_name, text)
+
+    def _read_row(self, row: int) -> np.ndarray:
+        # memmap 在檔案增長後需要重新映射才能看到新的列
+        if self._mmap is None or row >= self._mmap.shape[0]:
+            self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._rows, self.dim))
+        return np.array(self._mmap[row])
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """查詢快取，依序檢查記憶體層與磁碟層；磁碟命中會回填記憶體層."""
+        key = self.key(text)
+        vector = self._memory.get(key)
+        if vector is not None:
+            self.memory_hits += 1
+            return vector.tolist()
+
+        with self._lock:
+            row = self._index.get(key)
+            if row is not None:
+                try:
+                    vector = self._read_row(row)
+                except Exception as e:
+                    logger.warning(f"讀取 Embedding 磁碟快取失敗: {e}")
+                    vector = None
+        if vector is not None:
+            self.disk_hits += 1
+            self._memory.set(key, vector)
+            return vector.tolist()
+
+        self.misses += 1
+        return None
+
+    def set(self, text: str, embedding: List[float]) -> None:
+        """寫入記憶體層並附加到磁碟層；維度不符的向量不寫入磁碟."""
+        key = self.key(text)
+        vector = np.asarray(embedding, dtype=np.float32)
+        self._memory.set(key, vector)
+        if vector.shape != (self.dim,):
+            return
+
+        with self._lock:
+            if key in self._index:
+                return
+            try:
+                with self._file_lock(fcntl.LOCK_EX):
+                    with open(self._vectors_path, "ab") as f:
+                        size = f.seek(0, os.SEEK_END)
+                        row = size // self._row_bytes
+                        if size % self._row_bytes:
+                            f.truncate(row * self._row_bytes) # 捨棄崩潰時寫到一半的列
+                        f.write(vector.tobytes())
+                    with open(self._index_path, "a", encoding="utf-8") as f:
+                        f.write(f"{key}\t{row}\n")
+                self._index[key] = row
+                self._rows = max(self._rows, row + 1)
+            except Exception as e:
+                logger.warning(f"寫入 Embedding 磁碟快取失敗: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_items": len(self._memory),
+            "disk_items": len(self._index),
+        }
@@ -0,0 +1,301 @@
+from typing import Any, Awaitable, Callable, List, Optional
+import asyncio
+import hashlib
+import os
+import random
+import re
+import logging
+import time
+from dotenv import load_dotenv
+
+import numpy as np
+
+# 確保載入環境變數
+load_dotenv()
+
+# LangChain OpenAI 導入
+from langchain_community.embeddings import OpenAIEmbeddings
+
+from .metrics import EMBEDDING_INPUTS, EMBEDDING_REQUESTS, EMBEDDING_SECONDS, EMBEDDING_TOKENS
+from .rate_limiter import ProviderRateLimiter, embedding_rate_limiter, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower() # openai | local | hashing
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "") # 留空時使用各後端的預設模型
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 0)) # 0 表示依模型自動決定
+
+# 批次 Embedding 配置 (遠端後端)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 100)) # 每次 embed_documents 呼叫的塊數
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 4)) # 同時進行的批次數上限
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 3)) # 每個批次的最大嘗試次數
+EMBEDDING_RETRY_BASE_DELAY = float(os.getenv("EMBEDDING_RETRY_BASE_DELAY", 1.0)) # 指數退避的基礎秒數
+
+# 本地 CPU 後端 (ONNX) 配置
+EMBEDDING_LOCAL_MODEL_DIR = os.getenv("EMBEDDING_LOCAL_MODEL_DIR", "./data/embedding_models") # 每個模型一個子目錄
+EMBEDDING_LOCAL_BATCH_SIZE = int(os.getenv("EMBEDDING_LOCAL_BATCH_SIZE", 32))
+EMBEDDING_LOCAL_MAX_LENGTH = int(os.getenv("EMBEDDING_LOCAL_MAX_LENGTH", 256)) # 超過的 token 會被截斷
+EMBEDDING_LOCAL_THREADS = int(os.getenv("EMBEDDING_LOCAL_THREADS", 0)) # ONNX Runtime intra-op 執行緒數，0 為預設值
+
+OPENAI_EMBEDDING_DIMS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+DEFAULT_MODELS = {
+    "openai": "text-embedding-ada-002",
+    "local": "all-MiniLM-L6-v2",
+    "hashing": "hashing",
+}
+HASHING_DEFAULT_DIM = 384
+
+BatchCallback = Callable[[int], Awaitable[None]]
+
+
+class EmbeddingProvider:
+    """
+    Embedding 後端的共用介面。
+
+    子類別只需實作同步的 _embed_sync (在執行緒中執行)；批次切分、併發上限、
+    失敗重試與 (遠端後端的) 全局限流由 embed_documents 統一處理。
+    name 用於快取鍵，dim 決定 collection 的向量維度。
+    """
+
+    name: str
+    dim: int
+    rate_limiter: Optional[ProviderRateLimiter] = None
+
+    def __init__(self, batch_size: int = EMBEDDING_BATCH_SIZE, max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+                 max_retries: int = EMBEDDING_MAX_RETRIES, retry_base_delay: float = EMBEDDING_RETRY_BASE_DELAY):
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+
+    @property
+    def is_available(self) -> bool:
+        return True
+
+    def _embed_sync(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    def _embed_query_sync(self, text: str) -> List[float]:
+        return self._embed_sync([text])[0]
+
+    def _ensure_available(self) -> None:
+        if not self.is_available:
+            raise RuntimeError(f"Embedding 模型 '{self.name}' 未載入，請檢查配置。")
+
+    async def embed_query(self, text: str) -> List[float]:
+        """向量化單一查詢；同步的模型呼叫放到執行緒中執行以免阻塞 event loop."""
+        self._ensure_available()
+        tokens = await self._throttle([text])
+        try:
+            return await self._call_model("query", self._embed_query_sync, text, 1, tokens)
+        except Exception as e:
+            logger.error(f"獲取 Embedding 失敗: {e}", exc_info=True)
+            raise RuntimeError(f"Embedding 服務錯誤: {e}")
+
+    async def _throttle(self, texts: List[str]) -> int:
+        """估計 token 數 (遠端後端依此向全局限流器取得額度)，回傳估計值供指標使用."""
+        tokens = sum(estimate_tokens(text) for text in texts)
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(tokens)
+        return tokens
+
+    async def _call_model(self, kind: str, fn: Callable[[Any], Any], arg: Any, inputs: int, tokens: int) -> Any:
+        """在執行緒中呼叫模型並記錄呼叫次數、耗時、文本數與估計 token 數."""
+        started = time.perf_counter()
+        try:
+            result = await asyncio.to_thread(fn, arg)
+        except Exception:
+            EMBEDDING_REQUESTS.inc(backend=self.name, kind=kind, status="error")
+            raise
+        EMBEDDING_SECONDS.observe(time.perf_counter() - started, backend=self.name, kind=kind)
+        EMBEDDING_REQUESTS.inc(backend=self.name, kind=kind, status="ok")
+        EMBEDDING_INPUTS.inc(inputs, backend=self.name)
+        EMBEDDING_TOKENS.inc(tokens, backend=self.name)
+        return result
+
+    async def _embed_batch_with_retry(self, batch: List[str], batch_no: int, semaphore: asyncio.Semaphore) -> List[List[float]]:
+        """對單一批次呼叫模型，失敗時以指數退避 (含抖動) 重試."""
+        async with semaphore:
+            for attempt in range(1, self.max_retries + 1):
+                tokens = await self._throttle(batch)
+                try:
+                    return await self._call_model("batch", self._embed_sync, batch, len(batch), tokens)
+                except Exception as e:
+                    if attempt >= self.max_retries:
+                        logger.error(f"Embedding 批次 {batch_no} 在 {attempt} 次嘗試後仍失敗: {e}", exc_info=True)
+                        raise RuntimeError(f"Embedding 服務錯誤: {e}")
+                    delay = self.retry_base_delay * (2 ** (attempt - 1)) + random.uniform(0, self.retry_base_delay)
+                    logger.warning(f"Embedding 批次 {batch_no} 第 {attempt} 次嘗試失敗: {e}，{delay:.2f} 秒後重試。")
+                    await asyncio.sleep(delay)
+
+    async def embed_documents(self, texts: List[str], on_batch: Optional[BatchCallback] = None) -> List[List[float]]:
+        """
+        將文本分組為批次，以有限併發數同時向量化，回傳的向量順序與輸入一致。
+        on_batch 會在每個批次完成時以該批次的塊數被呼叫。
+        """
+        if not texts:
+            return []
+        self._ensure_available()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        logger.info(f"開始批次 Embedding ({self.name}): {len(texts)} 個塊，分為 {len(batches)} 個批次 (併發上限 {self.max_concurrency})。")
+
+        async def embed_and_report(batch: List[str], batch_no: int) -> List[List[float]]:
+            batch_embeddings = await self._embed_batch_with_retry(batch, batch_no, semaphore)
+            if on_batch is not None:
+                await on_batch(len(batch))
+            return batch_embeddings
+
+        batch_results = await asyncio.gather(
+            *(embed_and_report(batch, batch_no) for batch_no, batch in enumerate(batches))
+        )
+        return [embedding for batch_embeddings in batch_results for embedding in batch_embeddings]
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI Embedding API (經由 LangChain OpenAIEmbeddings)，受全局 Embedding 限流器約束."""
+
+    def __init__(self, model_name: str = DEFAULT_MODELS["openai"], dim: int = EMBEDDING_DIM, **kwargs):
+        super().__init__(**kwargs)
+        self.name = model_name
+        self.rate_limiter = embedding_rate_limiter
+        self.dim = dim or OPENAI_EMBEDDING_DIMS.get(model_name, 1536)
+        # 確保 OPENAI_API_KEY 已在環境變數中設定
+        try:
+            self._client: Optional[OpenAIEmbeddings] = OpenAIEmbeddings(model=model_name, openai_api_key=os.getenv("OPENAI_API_KEY"))
+            logger.info(f"OpenAI Embedding model '{model_name}' initialized.")
+        except Exception as e:
+            logger.error(f"初始化 OpenAI Embedding 模型失敗: {e}. 請檢查 OPENAI_API_KEY。", exc_info=True)
+            self._client = None
+
+    @property
+    def is_available(self) -> bool:
+        return self._client is not None
+
+    def _embed_sync(self, texts: List[str]) -> List[List[float]]:
+        return self._client.embed_documents(texts)
+
+    def _embed_query_sync(self, text: str) -> List[float]:
+        return self._client.embed_query(text)
+
+
+class LocalOnnxEmbeddingProvider(EmbeddingProvider):
+    """
+    在本機 CPU 上執行的 sentence-transformers 類 ONNX 模型 (可為量化版本)。
+
+    模型目錄 (EMBEDDING_LOCAL_MODEL_DIR/<model>) 需包含 tokenizer.json 與
+    model_quantized.onnx 或 model.onnx；輸出以 attention mask 做 mean pooling 並 L2 正規化。
+    需要選用相依套件 onnxruntime 與 tokenizers。
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODELS["local"], model_dir: str = EMBEDDING_LOCAL_MODEL_DIR,
+                 max_length: int = EMBEDDING_LOCAL_MAX_LENGTH, threads: int = EMBEDDING_LOCAL_THREADS, **kwargs):
+        kwargs.setdefault("batch_size", EMBEDDING_LOCAL_BATCH_SIZE)
+        kwargs.setdefault("max_concurrency", 1) # 單一 session 已使用多個 intra-op 執行緒
+        kwargs.setdefault("max_retries", 1) # 本地推論失敗通常不是暫時性錯誤
+        super().__init__(**kwargs)
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise RuntimeError("本地 Embedding 後端需要安裝 onnxruntime 與 tokenizers。") from e
+
+        path = os.path.join(model_dir, model_name)
+        model_path = next(
+            (os.path.join(path, f) for f in ("model_quantized.onnx", "model.onnx") if os.path.exists(os.path.join(path, f))),
+            None,
+        )
+        if model_path is None:
+            raise RuntimeError(f"在 {path} 找不到 model_quantized.onnx 或 model.onnx。")
+
+        self.name = f"local/{model_name}"
+        self._tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length=max_length)
+        self._tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self._session = onnxruntime.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self._session.get_inputs()}
+        self.dim = len(self._embed_sync(["dimension probe"])[0])
+        logger.info(f"本地 Embedding 模型 '{model_path}' 已載入 (維度 {self.dim})。")
+
+    def _embed_sync(self, texts: List[str]) -> List[List[float]]:
+        encodings = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        output = self._session.run(None, {k: v for k, v in feeds.items() if k in self._input_names})[0]
+        if output.ndim == 3: # (batch, seq, hidden) -> mean pooling
+            mask = attention_mask[..., None].astype(np.float32)
+            output = (output * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(output, axis=1, keepdims=True)
+        return (output / np.clip(norms, 1e-12, None)).astype(np.float32).tolist()
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    以特徵雜湊產生的確定性向量，不需要模型或網路，供離線負載測試使用。
+
+    詞 (\\w+) 與非 ASCII 文字的字元 bigram 經 blake2b 映射到維度與正負號後累加並 L2 正規化，
+    因此共享詞彙的文本仍有較高的 cosine 相似度，但不具備真正的語意。
+    """
+
+    _TOKEN_PATTERN = re.compile(r"\w+")
+
+    def __init__(self, dim: int = EMBEDDING_DIM, **kwargs):
+        kwargs.setdefault("max_concurrency", 1)
+        super().__init__(**kwargs)
+        self.dim = dim or HASHING_DEFAULT_DIM
+        self.name = f"hashing-{self.dim}"
+
+    def _features(self, text: str) -> List[str]:
+        features = []
+        for token in self._TOKEN_PATTERN.findall(text.lower()):
+            if token.isascii():
+                features.append(token)
+            else: # 中文等不以空白分詞的文字
+                features.extend(token[i:i + 2] for i in range(max(1, len(token) - 1)))
+        return features
+
+    def _embed_one(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if (digest >> 63) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0] = 1.0 # 空文本也回傳單位向量，避免 cosine 距離出現 NaN
+            return vector.tolist()
+        return (vector / norm).tolist()
+
+    def _embed_sync(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed_one(text) for text in texts]
+
+
+def create_embedding_provider(backend: str = EMBEDDING_BACKEND, model_name: str = EMBEDDING_MODEL) -> Optional[EmbeddingProvider]:
+    """依 EMBEDDING_BACKEND 建立 Embedding 提供者；本地模型載入失敗時回傳 None."""
+    if backend not in DEFAULT_MODELS:
+        raise ValueError(f"不支援的 EMBEDDING_BACKEND: {backend} (可選 {', '.join(DEFAULT_MODELS)})")
+    model_name = model_name or DEFAULT_MODELS[backend]
+    if backend == "openai":
+        return OpenAIEmbeddingProvider(model_name)
+    if backend == "hashing":
+        return HashingEmbeddingProvider()
+    try:
+        return LocalOnnxEmbeddingProvider(model_name)
+    except Exception as e:
+        logger.error(f"載入本地 Embedding 模型失敗: {e}", exc_info=True)
+        return None
+
+
+# 全局 Embedding 提供者，文件索引與查詢向量化共用同一個模型
+embedding_provider = create_embedding_provider()
@@ -0,0 +1,152 @@
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, TypeVar
+import asyncio
+import codecs
+import os
+import logging
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from .metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+INGEST_READ_BLOCK_BYTES = int(os.getenv("INGEST_READ_BLOCK_BYTES", 256 * 1024)) # 每次從檔案讀取的位元組數
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 2)) # 相鄰階段之間最多暫存的批次數
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+T = TypeVar("T")
+
+_END = object() # 來源迭代結束標記
+
+
+async def read_text_blocks(file_path: str, block_bytes: Optional[int] = None,
+                           on_read: Optional[Callable[[int, int], Awaitable[None]]] = None) -> AsyncIterator[str]:
+    """
+    以固定大小的區塊逐步讀取 UTF-8 文字檔，檔案 I/O 在執行緒中進行。
+    增量解碼器會保留跨區塊的多位元組字元。on_read 以 (已讀位元組數, 檔案大小) 被呼叫。
+    """
+    block_bytes = block_bytes or INGEST_READ_BLOCK_BYTES
+    total = os.path.getsize(file_path)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    read = 0
+    with open(file_path, "rb") as f:
+        while True:
+            started = time.perf_counter()
+            data = await asyncio.to_thread(f.read, block_bytes)
+            read += len(data)
+            text = decoder.decode(data, final=not data)
+            observe_stage("ingest", "read", time.perf_counter() - started)
+            if on_read is not None:
+                await on_read(read, total)
+            if text:
+                yield text
+            if not data:
+                return
+
+
+class StreamingTextSplitter:
+    """
+    逐區塊餵入文字的 RecursiveCharacterTextSplitter。
+
+    每次 feed 都對緩衝區分割，但保留最後 holdback 個塊不輸出 (它們可能被區塊邊界截斷)，
+    緩衝區從第一個未輸出塊的起點重新開始。該塊本身與已輸出的最後一塊重疊，
+    因此塊之間的 overlap 能跨越讀取邊界延續，記憶體只需保存一個區塊加上尾段。
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP, holdback: int = 2):
+        self._splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self._holdback = holdback
+        self._buffer = ""
+
+    @staticmethod
+    def _chunk_starts(text: str, chunks: List[str]) -> List[int]:
+        starts, position = [], 0
+        for chunk in chunks:
+            start = text.find(chunk, position)
+            if start < 0: # 理論上不會發生；找不到時保守地視為從上一個位置開始
+                start = position
+            starts.append(start)
+            position = start + 1
+        return starts
+
+    def feed(self, text: str) -> List[str]:
+        """加入一段文字，回傳已確定不會再改變的塊."""
+        self._buffer += text
+        chunks = self._splitter.split_text(self._buffer)
+        if len(chunks) <= self._holdback:
+            return []
+        ready, pending = chunks[:-self._holdback], chunks[-self._holdback:]
+        resume_at = self._chunk_starts(self._buffer, chunks)[len(ready)]
+        self._buffer = self._buffer[resume_at:]
+        logger.debug(f"串流分割: 輸出 {len(ready)} 個塊，保留 {len(pending)} 個塊 ({len(self._buffer)} 字元) 到下一個區塊。")
+        return ready
+
+    def flush(self) -> List[str]:
+        """輸入結束，回傳剩餘的所有塊."""
+        chunks = self._splitter.split_text(self._buffer) if self._buffer else []
+        self._buffer = ""
+        return chunks
+
+
+async def split_text_stream(blocks: AsyncIterator[str], splitter: Optional[StreamingTextSplitter] = None) -> AsyncIterator[str]:
+    """將文字區塊串流轉為塊串流."""
+    splitter = splitter or StreamingTextSplitter()
+    async for block in blocks:
+        started = time.perf_counter()
+        chunks = splitter.feed(block)
+        observe_stage("ingest", "split", time.perf_counter() - started)
+        for chunk in chunks:
+            yield chunk
+    started = time.perf_counter()
+    chunks = splitter.flush()
+    observe_stage("ingest", "split", time.perf_counter() - started)
+    for chunk in chunks:
+        yield chunk
+
+
+async def batched(items: AsyncIterator[T], size: int) -> AsyncIterator[List[T]]:
+    """將串流分組為最多 size 個項目的批次."""
+    batch: List[T] = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(source: AsyncIterator[T], maxsize: int = INGEST_QUEUE_SIZE) -> AsyncIterator[T]:
+    """
+    在背景任務中執行 source，經由有界佇列交給消費者，讓相鄰的處理階段在時間上重疊。
+
+    佇列已滿時上游會等待 (背壓)，因此記憶體用量由 maxsize 決定而不是檔案大小。
+    上游的例外會在消費端重新拋出；消費端提前結束時上游任務會被取消。
+    """
+    async def iterate() -> AsyncIterator[T]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+        async def produce() -> None:
+            try:
+                async for item in source:
+                    await queue.put((item, None))
+                await queue.put((_END, None))
+            except Exception as e:
+                await queue.put((_END, e))
+
+        task = asyncio.create_task(produce())
+        try:
+            while True:
+                item, error = await queue.get()
+                if item is _END:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    return iterate()
@@ -0,0 +1,338 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+import asyncio
+import json
+import os
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "./data/jobs.db") # 任務佇列的 SQLite 持久化檔案
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2)) # 背景處理任務的 worker 數
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 120)) # 任務認領的租約秒數；執行中定期續約，程序中止後租約過期的任務由其他程序接手
+JOB_CALLBACK_TOKEN = os.getenv("JOB_CALLBACK_TOKEN", "") # 完成通知時附帶的共享密鑰 (X-Callback-Token)
+JOB_CALLBACK_MAX_RETRIES = int(os.getenv("JOB_CALLBACK_MAX_RETRIES", 3))
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", 10.0))
+# 允許接收完成通知的主機 (逗號分隔)；通知附帶共享密鑰，不能送往呼叫端任意指定的網址
+JOB_CALLBACK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "backend").split(",") if host.strip()}
+
+# 任務狀態
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+# 文件處理的各階段，用於回報進度
+JOB_STAGES = ["split", "embed", "upsert", "summarize"]
+
+ProgressCallback = Callable[[str, int, int], Awaitable[None]]
+JobHandler = Callable[[Dict[str, Any], ProgressCallback], Awaitable[Dict[str, Any]]]
+
+
+def callback_url_allowed(url: str, allowed_hosts: Optional[Set[str]] = None) -> bool:
+    """通知網址須為 http(s) 且主機在 JOB_CALLBACK_ALLOWED_HOSTS 中."""
+    parts = urlsplit(url)
+    hosts = JOB_CALLBACK_ALLOWED_HOSTS if allowed_hosts is None else allowed_hosts
+    return parts.scheme in ("http", "https") and (parts.hostname or "").lower() in hosts
+
+
+class JobStore:
+    """以 SQLite 持久化任務狀態，讓佇列中與執行中的任務在服務重啟後可以恢復."""
+
+    def __init__(self, db_path: str = JOB_DB_PATH):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    document_id INTEGER,
+                    payload TEXT NOT NULL,
+                    callback_url TEXT,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    progress TEXT NOT NULL DEFAULT '{}',
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    worker TEXT,
+                    lease_until REAL
+                )
+                """
+            )
+            # 舊版資料庫沒有認領欄位
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (("worker", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["progress"] = json.loads(job["progress"] or "{}")
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def create(self, job_id: str, document_id: Optional[int], payload: Dict[str, Any], callback_url: Optional[str]) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, document_id, payload, callback_url, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, document_id, json.dumps(payload, ensure_ascii=False), callback_url, JOB_QUEUED, now, now),
+            )
+        return self.get(job_id)
+
+    def _set(self, job_id: str, fields: Dict[str, Any], condition: str = "", params: tuple = ()) -> bool:
+        for key in ("progress", "result"):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key], ensure_ascii=False)
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?{condition}", (*fields.values(), job_id, *params))
+        return cursor.rowcount == 1
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        self._set(job_id, fields)
+
+    def finish(self, job_id: str, worker: str, **fields: Any) -> bool:
+        """以認領者身分寫入最終狀態；任務已被其他程序接手 (或已結束) 時不寫入並回傳 False."""
+        return self._set(job_id, fields, " AND worker = ? AND status = ?", (worker, JOB_RUNNING))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        """未完成且目前沒有有效租約 (可被認領) 的任務."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) AND (worker IS NULL OR lease_until IS NULL OR lease_until < ?) ORDER BY created_at",
+                (JOB_QUEUED, JOB_RUNNING, time.time())
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def claim(self, job_id: str, worker: str, lease_seconds: float) -> bool:
+        """
+        原子地認領任務：只有未完成、且未被認領或租約已過期 (或本來就屬於 worker) 時成功。
+        多個程序共用同一個資料庫時，只有認領成功的程序會執行該任務。
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET worker = ?, lease_until = ?, status = ?, error = NULL, updated_at = ? "
+                "WHERE id = ? AND status IN (?, ?) AND (worker IS NULL OR worker = ? OR lease_until IS NULL OR lease_until < ?)",
+                (worker, now + lease_seconds, JOB_RUNNING, now, job_id, JOB_QUEUED, JOB_RUNNING, worker, now),
+            )
+        return cursor.rowcount == 1
+
+    def renew(self, job_id: str, worker: str, lease_seconds: float) -> bool:
+        """延長租約；任務已被其他程序接手時回傳 False."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?",
+                (time.time() + lease_seconds, job_id, worker, JOB_RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    def release(self, worker: str) -> None:
+        """釋放 worker 持有的未完成任務的租約，讓下次啟動 (或其他程序) 立即接手."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = 0 WHERE worker = ? AND status IN (?, ?)", (worker, JOB_QUEUED, JOB_RUNNING)
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class JobQueue:
+    """
+    持久化的背景任務佇列。
+
+    enqueue 只寫入 SQLite 並排入記憶體佇列，立即回傳任務；固定數量的 worker
+    依序取出任務交給 handler 處理，handler 透過 progress 回報各階段進度。
+
+    多個程序 (uvicorn worker) 可共用同一個資料庫：任務執行前先以租約原子地認領，認領失敗就略過，
+    執行中定期續約。啟動時與之後每半個租約，未完成且租約已過期 (原程序已中止) 的任務會重新排入佇列。
+    續約失敗 (租約已被其他程序接手) 時中止處理，最終狀態只由仍持有任務的程序寫入並送出通知。
+    """
+
+    def __init__(self, handler: JobHandler, workers: int = JOB_WORKERS, db_path: str = JOB_DB_PATH,
+                 lease_seconds: float = JOB_LEASE_SECONDS):
+        self._handler = handler
+        self._workers = workers
+        self._db_path = db_path
+        self._lease_seconds = lease_seconds
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}" # 本程序的認領者 ID
+        self._store: Optional[JobStore] = None
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._pending: Set[str] = set() # 已排入本程序記憶體佇列、尚未處理的任務
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """開啟任務資料庫，恢復未完成的任務並啟動 worker."""
+        self._store = await asyncio.to_thread(JobStore, self._db_path)
+        recovered = await self._recover()
+        if recovered:
+            logger.info(f"已恢復 {recovered} 個未完成的任務。")
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self._workers)]
+        self._tasks.append(asyncio.create_task(self._recover_loop()))
+        logger.info(f"任務佇列已啟動，worker 數: {self._workers}。")
+
+    async def stop(self) -> None:
+        """停止 worker；執行中的任務保持 running 狀態並釋放租約，下次啟動 (或其他程序) 時重新處理."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._store is not None:
+            self._store.release(self.worker_id)
+            self._store.close()
+            self._store = None
+
+    def _put(self, job_id: str) -> bool:
+        if job_id in self._pending:
+            return False
+        self._pending.add(job_id)
+        self._queue.put_nowait(job_id)
+        return True
+
+    async def _recover(self) -> int:
+        """將可認領的未完成任務排入佇列 (實際執行前仍需認領)."""
+        jobs = await asyncio.to_thread(self._store.unfinished)
+        return sum(self._put(job["id"]) for job in jobs)
+
+    async def _recover_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._lease_seconds / 2)
+            try:
+                await self._recover()
+            except Exception as e:
+                logger.warning(f"掃描未完成的任務失敗: {e}")
+
+    @property
+    def depth(self) -> int:
+        """等待處理的任務數."""
+        return self._queue.qsize()
+
+    async def enqueue(self, payload: Dict[str, Any], document_id: Optional[int] = None, callback_url: Optional[str] = None) -> Dict[str, Any]:
+        if self._store is None:
+            raise RuntimeError("任務佇列尚未啟動。")
+        if callback_url and not callback_url_allowed(callback_url):
+            raise ValueError(f"不允許的通知網址主機: {callback_url}")
+        job_id = uuid.uuid4().hex
+        job = await asyncio.to_thread(self._store.create, job_id, document_id, payload, callback_url)
+        self._put(job_id)
+        logger.info(f"任務 {job_id} 已排入佇列 (document_id={document_id}，佇列深度 {self.depth})。")
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if self._store is None:
+            raise RuntimeError("任務佇列尚未啟動。")
+        return await asyncio.to_thread(self._store.get, job_id)
+
+    async def _worker(self, worker_no: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            self._pending.discard(job_id)
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                logger.error(f"worker {worker_no} 處理任務 {job_id} 時發生未預期錯誤: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def _renew_lease(self, job_id: str, processing: asyncio.Task) -> None:
+        """定期續約；租約已被其他程序接手時取消處理中的任務."""
+        while True:
+            await asyncio.sleep(self._lease_seconds / 3)
+            try:
+                renewed = await asyncio.to_thread(self._store.renew, job_id, self.worker_id, self._lease_seconds)
+            except Exception as e:
+                logger.warning(f"任務 {job_id} 續約失敗: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"任務 {job_id} 的租約已被其他程序接手，中止處理。")
+                processing.cancel()
+                return
+
+    async def _run_job(self, job_id: str) -> None:
+        if not await asyncio.to_thread(self._store.claim, job_id, self.worker_id, self._lease_seconds):
+            return # 已完成，或正由其他程序處理
+        job = await asyncio.to_thread(self._store.get, job_id)
+        processing = asyncio.create_task(self._process(job))
+        heartbeat = asyncio.create_task(self._renew_lease(job_id, processing))
+        try:
+            await processing
+        except asyncio.CancelledError:
+            if not heartbeat.done(): # 佇列停止 (本身被取消)，而非失去租約
+                processing.cancel()
+                raise
+        finally:
+            heartbeat.cancel()
+
+    async def _process(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+
+        progress_state: Dict[str, Dict[str, int]] = dict(job["progress"])
+
+        async def report_progress(stage: str, completed: int, total: int) -> None:
+            progress_state[stage] = {"completed": completed, "total": total}
+            await asyncio.to_thread(self._store.update, job_id, stage=stage, progress=progress_state)
+
+        logger.info(f"開始處理任務 {job_id} (document_id={job['document_id']})。")
+        try:
+            result = await self._handler(job["payload"], report_progress)
+            fields = {"status": JOB_COMPLETED, "result": result}
+        except Exception as e:
+            logger.error(f"任務 {job_id} 處理失敗: {e}", exc_info=True)
+            fields = {"status": JOB_FAILED, "error": str(e)}
+        if not await asyncio.to_thread(self._store.finish, job_id, self.worker_id, **fields):
+            logger.warning(f"任務 {job_id} 已由其他程序接手，捨棄本次結果且不送出通知。")
+            return
+        if fields["status"] == JOB_COMPLETED:
+            logger.info(f"任務 {job_id} 處理完成。")
+
+        if job["callback_url"]:
+            await self._send_callback(await asyncio.to_thread(self._store.get, job_id))
+
+    async def _send_callback(self, job: Dict[str, Any]) -> None:
+        """以 POST 通知呼叫端任務結果，失敗時以指數退避重試."""
+        if not callback_url_allowed(job["callback_url"]):
+            # 允許清單變更前排入的任務：不把共享密鑰送往未允許的主機
+            logger.error(f"任務 {job['id']} 的通知網址主機不在 JOB_CALLBACK_ALLOWED_HOSTS 中，不送出通知: {job['callback_url']}")
+            return
+        body = {
+            "job_id": job["id"],
+            "document_id": job["document_id"],
+            "status": job["status"],
+            "result": job["result"],
+            "error": job["error"],
+        }
+        headers = {"X-Callback-Token": JOB_CALLBACK_TOKEN} if JOB_CALLBACK_TOKEN else {}
+        async with httpx.AsyncClient(timeout=JOB_CALLBACK_TIMEOUT) as http_client:
+            for attempt in range(1, JOB_CALLBACK_MAX_RETRIES + 1):
+                try:
+                    response = await http_client.post(job["callback_url"], json=body, headers=headers)
+                    response.raise_for_status()
+                    logger.info(f"任務 {job['id']} 完成通知已送出: {job['callback_url']}")
+                    return
+                except Exception as e:
+                    logger.warning(f"任務 {job['id']} 完成通知第 {attempt} 次失敗: {e}")
+                    if attempt < JOB_CALLBACK_MAX_RETRIES:
+                        await asyncio.sleep(2 ** (attempt - 1))
+        logger.error(f"任務 {job['id']} 完成通知最終失敗: {job['callback_url']}")
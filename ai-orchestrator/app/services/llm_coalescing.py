@@ -0,0 +1,121 @@
+from typing import Awaitable, Callable, Dict, Optional
+import asyncio
+import os
+import logging
+
+from .cache_utils import LRUCache
+from .metrics import LLM_CACHE_REQUESTS
+from .summarization import SummaryCache
+
+logger = logging.getLogger(__name__)
+
+# LLM 呼叫的合併 (single-flight) 與回應快取：後端重試或前端重複送出時，相同的 prompt 只呼叫一次 LLM
+LLM_COALESCING_ENABLED = os.getenv("LLM_COALESCING_ENABLED", "true").lower() == "true" # 同時進行的相同呼叫共用一次 LLM 呼叫
+LLM_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("LLM_RESPONSE_CACHE_MAX_ENTRIES", 512)) # 記憶體回應快取的項目上限，0 表示停用
+LLM_RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("LLM_RESPONSE_CACHE_TTL_SECONDS", 300)) # 回應快取的有效秒數
+
+Call = Callable[[], Awaitable[str]]
+
+
+class LLMCallAborted(Exception):
+    """共用的呼叫在完成前被中止 (例如串流的客戶端斷線)，等待者應自行重新呼叫."""
+
+
+class LLMCallCoalescer:
+    """
+    以呼叫鍵 (模型、prompt 與檢索上下文的雜湊) 合併 LLM 呼叫：
+
+    1. 記憶體 LRU 快取 (TTL) 命中時直接回傳；persistent 為 SQLite 磁碟層，只用於確定性的呼叫 (temperature 0)。
+    2. 相同的呼叫正在進行時等待其結果，不另外呼叫 LLM；失敗時所有等待者收到同一個例外，失敗結果不快取。
+    3. 否則由目前的呼叫者執行，完成後寫入快取。
+
+    串流回應無法共用中間的 token，因此以 begin/complete/fail 登記進行中的呼叫，等待者在串流完成後取得完整回應。
+    """
+
+    def __init__(self, purpose: str,
+                 max_entries: int = LLM_RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl: float = LLM_RESPONSE_CACHE_TTL_SECONDS,
+                 persistent: Optional[SummaryCache] = None,
+                 enabled: bool = LLM_COALESCING_ENABLED):
+        self.purpose = purpose
+        self.cache: LRUCache[str] = LRUCache(max_entries if ttl > 0 else 0, ttl)
+        self.persistent = persistent
+        self.enabled = enabled
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def cached(self, key: str, persist: bool = False) -> Optional[str]:
+        """查詢記憶體快取 (persist 時再查磁碟層，命中後回填記憶體)."""
+        result = self.cache.get(key)
+        if result is not None:
+            LLM_CACHE_REQUESTS.inc(purpose=self.purpose, result="hit")
+            return result
+        if persist and self.persistent is not None:
+            result = await asyncio.to_thread(self.persistent.get, key)
+            if result is not None:
+                self.cache.set(key, result)
+                LLM_CACHE_REQUESTS.inc(purpose=self.purpose, result="disk_hit")
+                return result
+        return None
+
+    def in_flight(self, key: str) -> Optional[asyncio.Future]:
+        return self._in_flight.get(key) if self.enabled else None
+
+    def begin(self, key: str) -> asyncio.Future:
+        """登記一個由呼叫者自行執行的呼叫，之後必須以 complete 或 fail 結束."""
+        future = asyncio.get_running_loop().create_future()
+        if self.enabled:
+            self._in_flight[key] = future
+        LLM_CACHE_REQUESTS.inc(purpose=self.purpose, result="miss")
+        return future
+
+    async def complete(self, key: str, future: asyncio.Future, result: str, persist: bool = False) -> None:
+        self.cache.set(key, result)
+        self._finish(key, future)
+        if not future.done():
+            future.set_result(result)
+        if persist and self.persistent is not None:
+            try:
+                await asyncio.to_thread(self.persistent.set, key, result)
+            except Exception as e:
+                logger.warning(f"寫入 LLM 回應磁碟快取失敗: {e}")
+
+    def fail(self, key: str, future: asyncio.Future, error: BaseException) -> None:
+        self._finish(key, future)
+        if not future.done():
+            future.set_exception(error if isinstance(error, Exception) else LLMCallAborted(str(error) or type(error).__name__))
+            future.exception() # 沒有等待者時不記錄「例外未被取得」的警告
+
+    def _finish(self, key: str, future: asyncio.Future) -> None:
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    async def join(self, key: str) -> Optional[str]:
+        """等待進行中的相同呼叫；沒有進行中的呼叫，或該呼叫被中止時回傳 None."""
+        future = self.in_flight(key)
+        if future is None:
+            return None
+        LLM_CACHE_REQUESTS.inc(purpose=self.purpose, result="coalesced")
+        try:
+            # shield：等待者被取消時不影響共用的呼叫
+            return await asyncio.shield(future)
+        except LLMCallAborted:
+            return None
+
+    async def run(self, key: str, call: Call, persist: bool = False) -> str:
+        """執行 (或共用、或從快取取得) 一次 LLM 呼叫."""
+        while True:
+            result = await self.cached(key, persist)
+            if result is None:
+                result = await self.join(key)
+            if result is not None:
+                return result
+            if self.in_flight(key) is None:
+                break
+        future = self.begin(key)
+        try:
+            result = await call()
+        except BaseException as e:
+            self.fail(key, future, e)
+            raise
+        await self.complete(key, future, result, persist)
+        return result
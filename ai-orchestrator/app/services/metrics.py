@@ -0,0 +1,301 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import os
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true" # 提供 /metrics 並記錄 HTTP 請求耗時
+# 回應是否一律附上 Server-Timing 標頭 (各階段耗時)；關閉時客戶端仍可用請求標頭 X-Server-Timing: 1 個別開啟
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "false").lower() == "true"
+METRICS_PREFIX = "ai_orchestrator_"
+SERVER_TIMING_REQUEST_HEADER = b"x-server-timing"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒數型直方圖的預設分桶：涵蓋快取命中 (毫秒) 到長文件摘要 (分鐘)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    """
+    指標的共用部分：以標籤值的 tuple 為鍵保存數值。
+    記錄可能來自 event loop 以外的執行緒 (例如 Whisper 工作池)，因此以鎖保護；
+    每次記錄只是一次字典查詢與加法，可以在正式環境中常駐。
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指標 {self.name} 需要標籤 {self.labelnames}，收到 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    """只增不減的累計值."""
+
+    kind = "counter"
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """目前值；可直接設定，或以 set_function 在輸出時才讀取 (例如佇列深度)."""
+
+    kind = "gauge"
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def set_function(self, function: Callable[[], float], **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def value(self, **labels: Any) -> float:
+        key = self._key(labels)
+        if key in self._functions:
+            return float(self._functions[key]())
+        return self._values.get(key, 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                values[key] = float(function())
+            except Exception as e:
+                logger.warning(f"讀取指標 {self.name} 失敗: {e}")
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    """固定分桶的分佈 (輸出為 Prometheus 的累計分桶、總和與次數)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelValues, List[float]] = {} # 每個分桶的 (非累計) 次數，最後兩項為總和與次數
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 3)
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels: Any) -> int:
+        state = self._values.get(self._key(labels))
+        return int(state[-1]) if state else 0
+
+    def sum(self, **labels: Any) -> float:
+        state = self._values.get(self._key(labels))
+        return state[-2] if state else 0.0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = []
+        for key, state in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(state[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    """程序內的指標集合，render 輸出 Prometheus 文字格式 (多個 uvicorn worker 時每個 worker 各自計算)."""
+
+    def __init__(self, prefix: str = METRICS_PREFIX):
+        self.prefix = prefix
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"指標已註冊: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self.prefix + name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self.prefix + name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self.prefix + name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 全局指標
+registry = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = registry.histogram("http_request_duration_seconds", "HTTP 請求耗時 (串流回應計算到串流結束)", ["handler", "method", "status"])
+STAGE_SECONDS = registry.histogram("stage_duration_seconds", "各處理階段的耗時 (rag: rephrase/retrieve/pack/first_token/generate，ingest: read/split/embed/upsert/summarize，search: embed_query/qdrant)", ["pipeline", "stage"])
+EMBEDDING_REQUESTS = registry.counter("embedding_requests_total", "Embedding 模型呼叫次數 (含重試)", ["backend", "kind", "status"])
+EMBEDDING_INPUTS = registry.counter("embedding_inputs_total", "送入 Embedding 模型的文本數", ["backend"])
+EMBEDDING_TOKENS = registry.counter("embedding_tokens_total", "送入 Embedding 模型的估計 token 數", ["backend"])
+EMBEDDING_SECONDS = registry.histogram("embedding_request_duration_seconds", "單次 Embedding 模型呼叫的耗時", ["backend", "kind"])
+LLM_REQUESTS = registry.counter("llm_requests_total", "Chat LLM 呼叫次數", ["purpose", "status"])
+LLM_TOKENS = registry.counter("llm_tokens_total", "Chat LLM 的估計 token 數 (direction 為 prompt 或 completion)", ["purpose", "direction"])
+LLM_CACHE_REQUESTS = registry.counter("llm_cache_requests_total", "經過呼叫合併層的 LLM 請求數 (result 為 hit、disk_hit、coalesced 或 miss，只有 miss 實際呼叫 LLM)", ["purpose", "result"])
+RAG_CONTEXT_TOKENS = registry.counter("rag_context_tokens_total", "RAG 上下文組裝的估計 token 數 (kind 為 retrieved、packed 或 overlap_removed)", ["kind"])
+RATE_LIMIT_WAIT_SECONDS = registry.histogram("rate_limit_wait_seconds", "在全局限流器前等待額度的時間", ["provider"])
+WHISPER_QUEUE_DEPTH = registry.gauge("whisper_queue_depth", "等待 Whisper 工作執行緒的轉錄數")
+WHISPER_IN_FLIGHT = registry.gauge("whisper_in_flight", "執行中與等待中的轉錄總數")
+WHISPER_AUDIO_SECONDS = registry.counter("whisper_audio_seconds_total", "已轉錄的音訊總長度 (秒)")
+WHISPER_DECODE_SECONDS = registry.histogram("whisper_decode_duration_seconds", "單次 Whisper 轉錄的解碼耗時", ["mode"])
+WHISPER_REALTIME_FACTOR = registry.histogram("whisper_realtime_factor", "Whisper 即時率 (解碼時間 / 音訊長度，越小越快)", ["mode"],
+                                             buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0))
+WHISPER_BATCH_ITEMS = registry.histogram("whisper_batch_size", "每次批次解碼合併的轉錄請求數", buckets=(1, 2, 4, 8, 16, 32))
+WHISPER_BATCH_WAIT_SECONDS = registry.histogram("whisper_batch_wait_seconds", "轉錄請求從排入批次到開始解碼的等待時間",
+                                                buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+JOB_QUEUE_DEPTH = registry.gauge("job_queue_depth", "等待處理的背景任務數", ["queue"])
+
+
+# --- 請求範圍的階段耗時 ---
+
+# 目前 HTTP 請求的各階段耗時 (由 RequestMetricsMiddleware 設定)；背景任務中為 None，只記錄直方圖
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def observe_stage(pipeline: str, stage: str, seconds: float) -> None:
+    """記錄一個階段的耗時；在 HTTP 請求中同時累加到該請求的 Server-Timing."""
+    STAGE_SECONDS.observe(seconds, pipeline=pipeline, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage_timer(pipeline: str, stage: str) -> Iterator[None]:
+    """以 with 區塊計時一個階段 (例外時仍會記錄)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(pipeline, stage, time.perf_counter() - started)
+
+
+def record_llm_call(purpose: str, prompt_tokens: int, completion_tokens: Optional[int] = None) -> None:
+    """記錄一次 Chat LLM 呼叫 (token 數為估計值)；completion_tokens 為 None 表示呼叫失敗."""
+    LLM_REQUESTS.inc(purpose=purpose, status="error" if completion_tokens is None else "ok")
+    LLM_TOKENS.inc(prompt_tokens, purpose=purpose, direction="prompt")
+    if completion_tokens:
+        LLM_TOKENS.inc(completion_tokens, purpose=purpose, direction="completion")
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    """Server-Timing 標頭值 (毫秒)."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI 中介層：記錄每個 HTTP 請求的耗時 (依路由函式名稱分組，避免路徑參數造成標籤爆炸)，
+    並在啟用時於回應附上 Server-Timing 標頭。標頭在回應開始時送出，
+    因此串流回應 (SSE) 只包含開始串流前的階段，完整耗時見其 done 事件。
+    """
+
+    def __init__(self, app: Any, server_timing: bool = METRICS_SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        add_header = self.server_timing or dict(scope.get("headers") or []).get(SERVER_TIMING_REQUEST_HEADER) in (b"1", b"true")
+        status = 500
+
+        async def send_with_timing(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if add_header:
+                    value = format_server_timing({**timings, "total": time.perf_counter() - started})
+                    message = {**message, "headers": list(message.get("headers") or []) + [(b"server-timing", value.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, handler=handler, method=scope["method"], status=status)
@@ -0,0 +1,177 @@
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Union
+import asyncio
+import inspect
+import os
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 模型與外部連線的載入時機：
+# eager 於啟動時載入完成才開始服務 (舊行為)；background 立即開始服務並在背景載入，/health/ready 於完成後回報就緒；
+# lazy 在第一個需要該元件的請求到達時才載入
+MODEL_LOAD_MODE = os.getenv("MODEL_LOAD_MODE", "background").lower()
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true" # 載入後以假資料執行一次推論 (轉錄一秒靜音、向量化一個短字串)
+
+LOAD_MODES = ("eager", "background", "lazy")
+
+LoadFn = Callable[[], Union[Awaitable[Any], Any]]
+
+
+class ModelUnavailableError(RuntimeError):
+    """元件載入失敗，無法處理需要它的請求."""
+
+
+class ModelComponent:
+    """一個需要在服務前載入的元件 (模型、外部服務連線) 與其載入狀態."""
+
+    def __init__(self, name: str, load: LoadFn, warmup: Optional[LoadFn] = None):
+        self.name = name
+        self.load = load
+        self.warmup = warmup
+        self.status = "pending" # pending | loading | warming | ready | failed
+        self.error: Optional[str] = None
+        self.warmup_error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "status": self.status,
+            "error": self.error,
+            "load_seconds": _round(self.load_seconds),
+            "warmup_seconds": _round(self.warmup_seconds),
+            "warmup_error": self.warmup_error,
+        }
+
+
+def _round(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds, 3) if seconds is not None else None
+
+
+async def _call(function: LoadFn) -> None:
+    result = function()
+    if inspect.isawaitable(result):
+        await result
+
+
+class ModelRegistry:
+    """
+    由 lifespan 管理的元件載入器：依 MODEL_LOAD_MODE 決定何時載入，請求以 ensure 等待所需的元件。
+
+    每個元件只載入一次 (同時到達的請求共用同一個載入任務)；載入失敗的元件維持 failed，
+    ensure 拋出 ModelUnavailableError，/health/ready 回報未就緒讓負載平衡器停止導入流量。
+    暖機失敗只記錄警告，不影響元件可用性。
+    """
+
+    def __init__(self, mode: str = MODEL_LOAD_MODE, warmup: bool = MODEL_WARMUP):
+        if mode not in LOAD_MODES:
+            raise ValueError(f"不支援的 MODEL_LOAD_MODE: {mode} (可選 {', '.join(LOAD_MODES)})")
+        self.mode = mode
+        self.warmup_on_load = warmup
+        self._components: Dict[str, ModelComponent] = {}
+        self.started_at = time.monotonic()
+        self.ready_at: Optional[float] = None
+
+    def register(self, name: str, load: LoadFn, warmup: Optional[LoadFn] = None) -> None:
+        """註冊元件；load 與 warmup 可以是同步函式或協程函式."""
+        self._components[name] = ModelComponent(name, load, warmup)
+
+    def component(self, name: str) -> ModelComponent:
+        return self._components[name]
+
+    @property
+    def ready(self) -> bool:
+        """所有元件皆已載入；lazy 模式下只要沒有元件載入失敗即視為就緒."""
+        if self.mode == "lazy":
+            return all(component.status != "failed" for component in self._components.values())
+        return all(component.status == "ready" for component in self._components.values())
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "mode": self.mode,
+            "uptime_seconds": round(time.monotonic() - self.started_at, 3),
+            "cold_start_seconds": _round(self.ready_at - self.started_at if self.ready_at is not None else None),
+            "components": {name: component.describe() for name, component in self._components.items()},
+        }
+
+    async def _run_warmup(self, component: ModelComponent) -> None:
+        started = time.perf_counter()
+        try:
+            await _call(component.warmup)
+            component.warmup_seconds = time.perf_counter() - started
+            component.warmup_error = None
+        except Exception as e:
+            component.warmup_error = str(e)
+            logger.warning(f"元件 {component.name} 暖機失敗: {e}", exc_info=True)
+
+    async def _load(self, component: ModelComponent) -> None:
+        started = time.perf_counter()
+        try:
+            await _call(component.load)
+        except Exception as e:
+            component.status = "failed"
+            component.error = str(e)
+            logger.error(f"載入元件 {component.name} 失敗: {e}", exc_info=True)
+            return
+        component.load_seconds = time.perf_counter() - started
+        if self.warmup_on_load and component.warmup is not None:
+            component.status = "warming"
+            await self._run_warmup(component)
+        component.status = "ready"
+        logger.info(f"元件 {component.name} 已就緒 (載入 {component.load_seconds:.2f} 秒，暖機 {component.warmup_seconds or 0:.2f} 秒)。")
+        if self.ready_at is None and all(c.status == "ready" for c in self._components.values()):
+            self.ready_at = time.monotonic()
+            logger.info(f"所有元件已就緒，自啟動起 {self.ready_at - self.started_at:.2f} 秒。")
+
+    def _start(self, component: ModelComponent) -> asyncio.Task:
+        if component.task is None:
+            component.status = "loading"
+            component.task = asyncio.create_task(self._load(component))
+        return component.task
+
+    async def start(self) -> None:
+        """於 lifespan 啟動時呼叫：eager 等待全部載入完成，background 只建立載入任務，lazy 不做任何事."""
+        self.started_at = time.monotonic()
+        self.ready_at = None
+        if self.mode == "lazy":
+            return
+        tasks = [self._start(component) for component in self._components.values()]
+        if self.mode == "eager":
+            await asyncio.gather(*tasks)
+
+    async def ensure(self, *names: str) -> None:
+        """等待元件載入完成 (尚未開始時立即開始)；載入失敗時拋出 ModelUnavailableError."""
+        for name in names:
+            component = self._components[name]
+            if component.status != "ready":
+                # shield：請求被取消 (客戶端斷線) 時不中斷共用的載入任務
+                await asyncio.shield(self._start(component))
+            if component.status != "ready":
+                raise ModelUnavailableError(f"{name} 載入失敗: {component.error}")
+
+    async def warmup(self, names: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """明確暖機：確保元件已載入後執行其暖機函式，回傳各元件的狀態與耗時."""
+        names = list(names) if names is not None else list(self._components)
+        for name in names:
+            component = self._components[name]
+            try:
+                await self.ensure(name)
+            except ModelUnavailableError:
+                continue
+            if component.warmup is not None:
+                await self._run_warmup(component)
+        return {name: self._components[name].describe() for name in names}
+
+    async def close(self) -> None:
+        """取消仍在進行的載入任務."""
+        tasks = [component.task for component in self._components.values() if component.task is not None and not component.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# 全局元件註冊表，元件由 main.py 註冊
+model_registry = ModelRegistry()
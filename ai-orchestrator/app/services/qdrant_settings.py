@@ -0,0 +1,142 @@
+from typing import Any, Dict, List, Optional, Union
+import os
+import logging
+
+from qdrant_client import models
+
+logger = logging.getLogger(__name__)
+
+# 向量量化：none | scalar (int8，記憶體約為 float32 的 1/4) | binary (1 bit，約 1/32，適合 1536 維等高維向量)
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "none").lower()
+QDRANT_QUANTIZATION_ALWAYS_RAM = os.getenv("QDRANT_QUANTIZATION_ALWAYS_RAM", "true").lower() == "true" # 量化向量常駐記憶體
+QDRANT_SCALAR_QUANTILE = float(os.getenv("QDRANT_SCALAR_QUANTILE", 0.99)) # scalar 量化裁剪極端值的分位數
+QDRANT_QUANTIZATION_RESCORE = os.getenv("QDRANT_QUANTIZATION_RESCORE", "true").lower() == "true" # 以原始向量重新計分候選結果
+QDRANT_QUANTIZATION_OVERSAMPLING = float(os.getenv("QDRANT_QUANTIZATION_OVERSAMPLING", 2.0)) # 重新計分前多取的候選倍數
+# 儲存位置：原始向量/payload 放在磁碟 (mmap)，搭配量化時搜尋只需讀取候選的原始向量
+QDRANT_VECTORS_ON_DISK = os.getenv("QDRANT_VECTORS_ON_DISK", "false").lower() == "true"
+QDRANT_PAYLOAD_ON_DISK = os.getenv("QDRANT_PAYLOAD_ON_DISK", "false").lower() == "true"
+# HNSW 索引：m 與 ef_construct 越大召回率越高，但索引記憶體與建置時間也越多；預設值與 Qdrant 相同
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", 16))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", 100))
+QDRANT_HNSW_ON_DISK = os.getenv("QDRANT_HNSW_ON_DISK", "false").lower() == "true"
+QDRANT_SEARCH_HNSW_EF = int(os.getenv("QDRANT_SEARCH_HNSW_EF", 0)) # 搜尋時的 ef，0 表示使用 Qdrant 預設值
+# 既有 collection 的設定與上述配置不同時，啟動時是否以 update_collection 套用 (Qdrant 會在背景重建索引)
+QDRANT_MIGRATE_ON_STARTUP = os.getenv("QDRANT_MIGRATE_ON_STARTUP", "false").lower() == "true"
+
+QUANTIZATION_MODES = ("none", "scalar", "binary")
+
+QuantizationConfig = Union[models.ScalarQuantization, models.BinaryQuantization, None]
+
+
+class CollectionSettings:
+    """
+    documents_collection 的儲存與索引設定。
+
+    建立 collection 時提供 create 參數；collection 已存在時以 diff 比較目前設定，
+    產生 update_collection 所需的變更 (向量大小與距離無法就地變更，需重建 collection)。
+    """
+
+    def __init__(self, quantization: str = QDRANT_QUANTIZATION,
+                 quantization_always_ram: bool = QDRANT_QUANTIZATION_ALWAYS_RAM,
+                 scalar_quantile: float = QDRANT_SCALAR_QUANTILE,
+                 rescore: bool = QDRANT_QUANTIZATION_RESCORE,
+                 oversampling: float = QDRANT_QUANTIZATION_OVERSAMPLING,
+                 vectors_on_disk: bool = QDRANT_VECTORS_ON_DISK,
+                 payload_on_disk: bool = QDRANT_PAYLOAD_ON_DISK,
+                 hnsw_m: int = QDRANT_HNSW_M,
+                 hnsw_ef_construct: int = QDRANT_HNSW_EF_CONSTRUCT,
+                 hnsw_on_disk: bool = QDRANT_HNSW_ON_DISK,
+                 search_hnsw_ef: int = QDRANT_SEARCH_HNSW_EF):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"不支援的量化方式: {quantization} (可用: {', '.join(QUANTIZATION_MODES)})")
+        self.quantization = quantization
+        self.quantization_always_ram = quantization_always_ram
+        self.scalar_quantile = scalar_quantile
+        self.rescore = rescore
+        self.oversampling = oversampling
+        self.vectors_on_disk = vectors_on_disk
+        self.payload_on_disk = payload_on_disk
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construct = hnsw_ef_construct
+        self.hnsw_on_disk = hnsw_on_disk
+        self.search_hnsw_ef = search_hnsw_ef
+
+    def describe(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+    def vectors_config(self, dim: int) -> models.VectorParams:
+        return models.VectorParams(size=dim, distance=models.Distance.COSINE, on_disk=self.vectors_on_disk)
+
+    def hnsw_config(self) -> models.HnswConfigDiff:
+        return models.HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct, on_disk=self.hnsw_on_disk)
+
+    def quantization_config(self) -> QuantizationConfig:
+        if self.quantization == "scalar":
+            return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8, quantile=self.scalar_quantile, always_ram=self.quantization_always_ram))
+        if self.quantization == "binary":
+            return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=self.quantization_always_ram))
+        return None
+
+    def create_kwargs(self, dim: int) -> Dict[str, Any]:
+        """recreate_collection 的參數."""
+        return {
+            "vectors_config": self.vectors_config(dim),
+            "hnsw_config": self.hnsw_config(),
+            "quantization_config": self.quantization_config(),
+            "on_disk_payload": self.payload_on_disk,
+        }
+
+    def search_params(self) -> Optional[models.SearchParams]:
+        """搜尋參數；全部使用預設值時回傳 None."""
+        quantization = None
+        if self.quantization != "none":
+            quantization = models.QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling)
+        if quantization is None and not self.search_hnsw_ef:
+            return None
+        return models.SearchParams(hnsw_ef=self.search_hnsw_ef or None, quantization=quantization)
+
+    def diff(self, info: models.CollectionInfo, dim: int) -> Dict[str, Any]:
+        """
+        比較既有 collection 的設定，回傳 update_collection 的參數 (沒有差異時為空字典)。
+        向量大小不一致時拋出 RuntimeError：更換 Embedding 模型必須重建 collection 並重新索引。
+        """
+        params = info.config.params
+        vectors = params.vectors
+        if isinstance(vectors, dict): # 具名向量的 collection 不是本服務建立的
+            raise RuntimeError("collection 使用具名向量，無法套用設定。")
+        if vectors.size != dim:
+            raise RuntimeError(f"collection 的向量維度 ({vectors.size}) 與目前 Embedding 模型 ({dim}) 不一致，需重建 collection 並重新索引。")
+
+        changes: Dict[str, Any] = {}
+        if bool(vectors.on_disk) != self.vectors_on_disk:
+            changes["vectors_config"] = {"": models.VectorParamsDiff(on_disk=self.vectors_on_disk)}
+        if bool(params.on_disk_payload) != self.payload_on_disk:
+            changes["collection_params"] = models.CollectionParamsDiff(on_disk_payload=self.payload_on_disk)
+        hnsw = info.config.hnsw_config
+        if (hnsw.m, hnsw.ef_construct, bool(hnsw.on_disk)) != (self.hnsw_m, self.hnsw_ef_construct, self.hnsw_on_disk):
+            changes["hnsw_config"] = self.hnsw_config()
+        if _quantization_key(info.config.quantization_config) != _quantization_key(self.quantization_config()):
+            changes["quantization_config"] = self.quantization_config() or models.Disabled.DISABLED
+        return changes
+
+
+def _quantization_key(config: Any) -> List[Any]:
+    """量化設定中影響索引內容的欄位，用於比較."""
+    if isinstance(config, models.ScalarQuantization):
+        return ["scalar", config.scalar.type, config.scalar.quantile, bool(config.scalar.always_ram)]
+    if isinstance(config, models.BinaryQuantization):
+        return ["binary", bool(config.binary.always_ram)]
+    return ["none"]
+
+
+def estimate_vector_memory(points: int, dim: int, settings: CollectionSettings) -> Dict[str, int]:
+    """估計向量資料的記憶體與磁碟用量 (位元組，不含 HNSW 圖與 payload)."""
+    original = points * dim * 4
+    quantized = {"none": 0, "scalar": points * dim, "binary": points * ((dim + 7) // 8)}[settings.quantization]
+    ram = (0 if settings.vectors_on_disk else original) + (quantized if settings.quantization_always_ram else 0)
+    return {"ram_bytes": ram, "disk_bytes": original + quantized}
+
+
+# 全局設定，由環境變數決定
+collection_settings = CollectionSettings()
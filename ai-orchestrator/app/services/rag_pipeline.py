@@ -1,7 +1,14 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+from .cache_utils import content_hash
+from .context_packing import RAG_CANDIDATE_K, RAG_CONTEXT_PACKING, pack_context
 from .document_service import search_documents_qdrant
+from .llm_coalescing import LLMCallCoalescer
+from .metrics import RAG_CONTEXT_TOKENS, observe_stage, record_llm_call
+from .rate_limiter import estimate_tokens, llm_rate_limiter
+import asyncio
 import os
 import logging
+import time
 from dotenv import load_dotenv
 
 # 確保載入環境變數
@@ -10,47 +17,215 @@ load_dotenv()
 # LangChain OpenAI 導入
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_community.vectorstores import Qdrant # 用於 LangChain 與 Qdrant 的整合
-from langchain_community.embeddings import OpenAIEmbeddings # 用於 LangChain 與 Qdrant 的整合
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage, AIMessage, BaseMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable
+from langchain_core.retrievers import BaseRetriever
 
 logger = logging.getLogger(__name__)
 
-# 初始化 OpenAI Chat LLM 和 Embedding 模型 (如果未在 document_service 中初始化)
+# 初始化 OpenAI Chat LLM
 # 確保 OPENAI_API_KEY 已在環境變數中設定
 try:
     chat_llm = ChatOpenAI(temperature=0.7, openai_api_key=os.getenv("OPENAI_API_KEY"))
-    embeddings_model_for_retriever = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
-    logger.info("OpenAI Chat LLM and Embedding models for RAG initialized.")
+    logger.info("OpenAI Chat LLM for RAG initialized.")
 except Exception as e:
     logger.error(f"初始化 OpenAI 模型失敗: {e}. 請檢查 OPENAI_API_KEY。", exc_info=True)
     chat_llm = None
-    embeddings_model_for_retriever = None
 
-# Qdrant 配置
-QDRANT_HOST = os.getenv("QDRANT_HOST", "qdrant")
-QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
-COLLECTION_NAME = "documents_collection" # 需與 document_service 中的一致
+CHAT_MODEL_NAME = getattr(chat_llm, "model_name", "") # LLM 呼叫合併鍵的一部分
+
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", 3)) # 停用上下文打包 (RAG_CONTEXT_PACKING=false) 時每次檢索的文件塊數
+RAG_RETRIEVE_LIMIT = RAG_CANDIDATE_K if RAG_CONTEXT_PACKING else RAG_TOP_K
+
+# 歷史感知的問題改寫 Prompt (用於處理多輪對話中的上下文)
+REPHRASE_PROMPT = ChatPromptTemplate.from_messages([
+    MessagesPlaceholder("chat_history"),
+    ("user", "{input}"),
+    ("user", "根據以上對話和我的問題，請總結出一個獨立的問題，以便從文件中檢索相關信息。")
+])
+
+# 回答 Prompt (將檢索到的文檔與用戶問題結合)
+ANSWER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "您是一個智慧助手，請根據提供的上下文和對話歷史，簡潔、專業地回答用戶的問題。\n\n上下文:\n{context}"),
+    MessagesPlaceholder("chat_history"),
+    ("user", "{input}"),
+])
+
+# 對話歷史壓縮 Prompt (伺服器端工作階段的滾動摘要)
+COMPACTION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "您負責維護一段對話的滾動摘要。請將既有摘要與新的對話內容整合為一段精簡的摘要，"
+               "保留用戶的目標、已確認的事實、提到的文件與尚未解決的問題，不超過 {max_words} 字。只輸出摘要本身。"),
+    ("user", "既有摘要：\n{summary}\n\n新的對話內容：\n{transcript}"),
+])
+
+NO_CONTEXT_RESPONSE = "很抱歉，我目前沒有找到相關的內部資料來回答您的問題。請嘗試換個問題或提供更多細節。"
+
+# 問題改寫與回答的呼叫合併層：相同的問題、對話歷史與檢索上下文共用一次 LLM 呼叫 (回答非確定性，只快取在記憶體)
+rephrase_calls = LLMCallCoalescer("rephrase")
+answer_calls = LLMCallCoalescer("generate")
+
+
+class DocumentServiceRetriever(BaseRetriever):
+    """
+    透過 document_service.search_documents_qdrant 檢索文件塊的 LangChain Retriever。
+    共用 document_service 的非同步 Qdrant 連線、Embedding 快取與搜尋快取。
+    """
+
+    limit: int = RAG_RETRIEVE_LIMIT
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        """同步呼叫 (invoke) 時在新的事件迴圈中執行非同步檢索；事件迴圈中請改用 ainvoke."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._search(query))
+        raise RuntimeError("DocumentServiceRetriever 在事件迴圈中須以 ainvoke 呼叫。")
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        return await self._search(query)
+
+    async def _search(self, query: str) -> List[Document]:
+        results = await search_documents_qdrant(query, limit=self.limit)
+        return [
+            Document(
+                page_content=result["text_chunk"] or "",
+                metadata={**result["metadata"], "document_id": result["document_id"], "chunk_index": result.get("chunk_index"), "score": result["score"]}
+            )
+            for result in results
+        ]
+
 
 async def get_qdrant_retriever():
     """獲取 Qdrant 向量儲存的 LangChain Retriever."""
-    if embeddings_model_for_retriever is None:
-        raise RuntimeError("OpenAI Embedding 模型未載入，無法初始化 Retriever。")
-    # 確保 Qdrant 集合已存在 (由 document_service.py 負責)
-    vector_store = Qdrant(
-        client=document_service.client, # 使用 document_service 中已初始化的 Qdrant 客戶端
-        collection_name=COLLECTION_NAME,
-        embeddings=embeddings_model_for_retriever,
+    return DocumentServiceRetriever(limit=RAG_RETRIEVE_LIMIT)
+
+
+class RagComponents:
+    """RAG 流程中可在請求之間共用的元件，只在啟動時建立一次."""
+
+    def __init__(self, retriever: BaseRetriever, rephrase_chain: Runnable, document_chain: Runnable):
+        self.retriever = retriever
+        self.rephrase_chain = rephrase_chain # 將多輪對話改寫為獨立問題
+        self.document_chain = document_chain # 將檢索到的文件塊填入 Prompt 並生成回答
+
+
+_rag_components: Optional[RagComponents] = None
+
+def init_rag_pipeline() -> RagComponents:
+    """建立 Retriever、改寫鏈與回答鏈並快取於模組中，應在應用啟動時呼叫一次."""
+    global _rag_components
+    if chat_llm is None:
+        raise RuntimeError("OpenAI Chat LLM 模型未載入，無法初始化 RAG 流程。")
+    _rag_components = RagComponents(
+        retriever=DocumentServiceRetriever(limit=RAG_RETRIEVE_LIMIT),
+        rephrase_chain=REPHRASE_PROMPT | chat_llm | StrOutputParser(),
+        document_chain=create_stuff_documents_chain(chat_llm, ANSWER_PROMPT),
     )
-    return vector_store.as_retriever()
+    logger.info("RAG 流程元件已建立。")
+    return _rag_components
+
+def _get_rag_components() -> RagComponents:
+    return _rag_components if _rag_components is not None else init_rag_pipeline()
+
+def _call_key(purpose: str, prompt: str, chat_history_messages: List[BaseMessage], documents: Optional[List[Document]] = None) -> str:
+    """LLM 呼叫合併的鍵：模型、用途、對話歷史、問題與檢索上下文的雜湊."""
+    history = "\n".join(f"{message.type}: {message.content}" for message in chat_history_messages)
+    context = content_hash(*(doc.page_content for doc in documents or []))
+    return content_hash(CHAT_MODEL_NAME, purpose, history, prompt, context)
+
+def _to_chat_history_messages(conversation_history: List[Dict[str, str]]) -> List[BaseMessage]:
+    """將歷史轉換為 LangChain 訊息格式."""
+    chat_history_messages: List[BaseMessage] = []
+    for msg in conversation_history:
+        if msg['role'] == 'user':
+            chat_history_messages.append(HumanMessage(content=msg['content']))
+        elif msg['role'] == 'assistant':
+            chat_history_messages.append(AIMessage(content=msg['content']))
+        elif msg['role'] == 'system': # 伺服器端工作階段的滾動摘要
+            chat_history_messages.append(SystemMessage(content=msg['content']))
+    return chat_history_messages
+
+async def _retrieve_context(components: RagComponents, prompt: str, chat_history_messages: List[BaseMessage], timings: Dict[str, float]) -> Tuple[List[Document], Dict[str, int]]:
+    """
+    檢索相關文件塊。有對話歷史時先由 LLM 改寫為獨立問題；
+    單輪請求直接以原始問題檢索，省下一次完整的 LLM 往返。
+    啟用上下文打包時，候選文件塊經合併、MMR 挑選後依 token 預算打包，回傳 (段落, 打包統計)。
+    """
+    query = prompt
+    if chat_history_messages:
+        started = time.perf_counter()
+        query = await rephrase_calls.run(_call_key("rephrase", prompt, chat_history_messages), lambda: _invoke_rephrase(components, prompt, chat_history_messages))
+        _record_stage(timings, "rephrase", started)
+        logger.info(f"改寫後的檢索問題: '{query}'")
+
+    started = time.perf_counter()
+    documents = await components.retriever.ainvoke(query)
+    _record_stage(timings, "retrieve", started)
+    if not RAG_CONTEXT_PACKING or not documents:
+        return documents, {}
+
+    started = time.perf_counter()
+    documents, stats = pack_context(documents)
+    _record_stage(timings, "pack", started)
+    RAG_CONTEXT_TOKENS.inc(stats["retrieved_tokens"], kind="retrieved")
+    RAG_CONTEXT_TOKENS.inc(stats["context_tokens"], kind="packed")
+    RAG_CONTEXT_TOKENS.inc(stats["overlap_tokens_removed"], kind="overlap_removed")
+    logger.info(f"上下文打包: {stats['retrieved_chunks']} 個文件塊 -> {stats['passages']} 個段落，"
+                f"{stats['retrieved_tokens']} -> {stats['context_tokens']} tokens (省下 {stats['tokens_saved']})。")
+    return documents, stats
+
+async def _invoke_rephrase(components: RagComponents, prompt: str, chat_history_messages: List[BaseMessage]) -> str:
+    prompt_tokens = await _throttle_llm(prompt, chat_history_messages)
+    try:
+        query = await components.rephrase_chain.ainvoke({"chat_history": chat_history_messages, "input": prompt})
+    except Exception:
+        record_llm_call("rephrase", prompt_tokens)
+        raise
+    record_llm_call("rephrase", prompt_tokens, estimate_tokens(query))
+    return query
+
+async def _invoke_answer(components: RagComponents, prompt: str, chat_history_messages: List[BaseMessage], documents: List[Document]) -> str:
+    prompt_tokens = await _throttle_llm(prompt, chat_history_messages, documents)
+    try:
+        response_text = await components.document_chain.ainvoke({
+            "context": documents,
+            "chat_history": chat_history_messages,
+            "input": prompt
+        })
+    except Exception:
+        record_llm_call("generate", prompt_tokens)
+        raise
+    record_llm_call("generate", prompt_tokens, estimate_tokens(response_text))
+    return response_text
+
+async def _throttle_llm(prompt: str, chat_history_messages: List[BaseMessage], documents: Optional[List[Document]] = None) -> int:
+    """依估計的輸入 token 數向全局 LLM 限流器取得額度，回傳估計的 token 數."""
+    parts = [prompt] + [str(message.content) for message in chat_history_messages] + [doc.page_content for doc in documents or []]
+    tokens = sum(estimate_tokens(part) for part in parts)
+    await llm_rate_limiter.acquire(tokens)
+    return tokens
+
+def _record_stage(timings: Dict[str, float], stage: str, started: float) -> None:
+    """記錄階段耗時到本次請求的 timings 與 /metrics 的直方圖."""
+    timings[stage] = time.perf_counter() - started
+    observe_stage("rag", stage, timings[stage])
+
+def _format_timings(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in timings.items())
+
+def _source_document_ids(documents: List[Document]) -> List[Any]:
+    """檢索結果中的文件 ID (去重並保留相關度順序)."""
+    return list(dict.fromkeys(doc.metadata.get("document_id") for doc in documents))
 
 
 async def generate_response_from_rag(user_id: str, prompt: str, conversation_history: List[Dict[str, str]]) -> str:
     """
     基於 RAG (Retrieval-Augmented Generation) 流程生成回應。
-    1. 檢索相關文件塊。
+    1. 檢索相關文件塊 (有對話歷史時先改寫問題)。
     2. 將檢索到的內容與用戶問題結合，送入 LLM 生成回答。
     """
     logger.info(f"用戶 {user_id} 請求 RAG 回應，問題: '{prompt}'")
@@ -58,45 +233,119 @@ async def generate_response_from_rag(user_id: str, prompt: str, conversation_his
     if chat_llm is None:
         raise RuntimeError("OpenAI Chat LLM 模型未載入，無法生成 RAG 回應。")
 
-    # 將歷史轉換為 LangChain 訊息格式
-    chat_history_messages = []
-    for msg in conversation_history:
-        if msg['role'] == 'user':
-            chat_history_messages.append(HumanMessage(content=msg['content']))
-        elif msg['role'] == 'assistant':
-            chat_history_messages.append(AIMessage(content=msg['content']))
+    components = _get_rag_components()
+    chat_history_messages = _to_chat_history_messages(conversation_history)
+    timings: Dict[str, float] = {}
 
-    # 步驟 1: 歷史感知檢索器 (用於處理多輪對話中的上下文)
     try:
-        retriever = await get_qdrant_retriever()
-        history_aware_retriever = create_history_aware_retriever(chat_llm, retriever, ChatPromptTemplate.from_messages([
-            MessagesPlaceholder("chat_history"),
-            ("user", "{input}"),
-            ("user", "根據以上對話和我的問題，請總結出一個獨立的問題，以便從文件中檢索相關信息。")
-        ]))
+        documents, _ = await _retrieve_context(components, prompt, chat_history_messages, timings)
     except Exception as e:
-        logger.error(f"創建歷史感知檢索器失敗: {e}", exc_info=True)
+        logger.error(f"檢索相關文件失敗: {e}", exc_info=True)
         return "很抱歉，初始化檢索服務時發生問題。"
 
+    if not documents:
+        logger.info(f"未檢索到相關文件，略過 LLM 生成 ({_format_timings(timings)})。")
+        return NO_CONTEXT_RESPONSE
 
-    # 步驟 2: 文件組合鏈 (將檢索到的文檔與用戶問題結合)
-    document_chain = create_stuff_documents_chain(chat_llm, ChatPromptTemplate.from_messages([
-        ("system", "您是一個智慧助手，請根據提供的上下文和對話歷史，簡潔、專業地回答用戶的問題。\n\n上下文:\n{context}"),
-        MessagesPlaceholder("chat_history"),
-        ("user", "{input}"),
-    ]))
-
-    # 步驟 3: RAG 鏈
-    retrieval_chain = create_retrieval_chain(history_aware_retriever, document_chain)
-    
     try:
-        response = await retrieval_chain.ainvoke({
-            "chat_history": chat_history_messages,
-            "input": prompt
-        })
-        response_text = response["answer"]
-        logger.info(f"RAG 回應生成完成，回應: '{response_text[:50]}...'")
+        started = time.perf_counter()
+        key = _call_key("answer", prompt, chat_history_messages, documents)
+        response_text = await answer_calls.run(key, lambda: _invoke_answer(components, prompt, chat_history_messages, documents))
+        _record_stage(timings, "generate", started)
+        logger.info(f"RAG 回應生成完成 ({_format_timings(timings)})，回應: '{response_text[:50]}...'")
         return response_text
     except Exception as e:
         logger.error(f"RAG 回應生成失敗 (LLM 或檢索錯誤): {e}", exc_info=True)
         return "很抱歉，我無法生成基於內部資料的回應。請嘗試換個問題或稍後再試。"
+
+
+def stream_response_from_rag(user_id: str, prompt: str, conversation_history: List[Dict[str, str]]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    generate_response_from_rag 的串流版本，回傳產出 (事件名稱, 資料) 的非同步迭代器：
+    1. sources：檢索完成後立即送出相關文件 ID。
+    2. token：LLM 每產生一段文字即送出 (相同的問題剛回答過或正在回答時，為單一段完整回應)。
+    3. done：完整回應、各階段耗時與上下文打包統計。
+
+    模型未載入的錯誤在呼叫時即拋出，因此可在開始串流回應之前處理；
+    串流過程中的錯誤則由迭代器拋出。
+    """
+    logger.info(f"用戶 {user_id} 請求串流 RAG 回應，問題: '{prompt}'")
+
+    if chat_llm is None:
+        raise RuntimeError("OpenAI Chat LLM 模型未載入，無法生成 RAG 回應。")
+
+    components = _get_rag_components()
+    chat_history_messages = _to_chat_history_messages(conversation_history)
+
+    async def iterate() -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        timings: Dict[str, float] = {}
+        request_started = time.perf_counter()
+        documents, context_stats = await _retrieve_context(components, prompt, chat_history_messages, timings)
+        yield "sources", {"document_ids": _source_document_ids(documents)}
+
+        if not documents:
+            logger.info(f"未檢索到相關文件，略過 LLM 生成 ({_format_timings(timings)})。")
+            yield "token", {"text": NO_CONTEXT_RESPONSE}
+            yield "done", {"response_text": NO_CONTEXT_RESPONSE, "timings": timings}
+            return
+
+        started = time.perf_counter()
+        key = _call_key("answer", prompt, chat_history_messages, documents)
+        shared = await answer_calls.cached(key) or await answer_calls.join(key)
+        if shared is not None:
+            # 相同的問題剛回答過或正在回答：以完整回應作為單一 token 送出
+            _record_stage(timings, "first_token", request_started)
+            yield "token", {"text": shared}
+            _record_stage(timings, "generate", started)
+            logger.info(f"串流 RAG 回應取自相同問題的快取或進行中的呼叫 ({_format_timings(timings)})。")
+            yield "done", {"response_text": shared, "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()}, "context": context_stats}
+            return
+
+        future = answer_calls.begin(key)
+        prompt_tokens = 0
+        tokens: List[str] = []
+        try:
+            prompt_tokens = await _throttle_llm(prompt, chat_history_messages, documents)
+            async for token in components.document_chain.astream({
+                "context": documents,
+                "chat_history": chat_history_messages,
+                "input": prompt
+            }):
+                if not token:
+                    continue
+                if not tokens:
+                    _record_stage(timings, "first_token", request_started)
+                tokens.append(token)
+                yield "token", {"text": token}
+        except BaseException as e: # 包含客戶端斷線 (GeneratorExit)，等待中的相同請求改為自行呼叫
+            answer_calls.fail(key, future, e)
+            if isinstance(e, Exception):
+                record_llm_call("generate", prompt_tokens)
+            raise
+        _record_stage(timings, "generate", started)
+
+        response_text = "".join(tokens)
+        record_llm_call("generate", prompt_tokens, estimate_tokens(response_text))
+        await answer_calls.complete(key, future, response_text)
+        logger.info(f"串流 RAG 回應生成完成 ({_format_timings(timings)})，回應: '{response_text[:50]}...'")
+        yield "done", {"response_text": response_text, "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()}, "context": context_stats}
+
+    return iterate()
+
+
+async def summarize_conversation(summary: str, messages: List[Dict[str, str]], max_words: int) -> str:
+    """將既有摘要與較舊的對話合併為新的滾動摘要 (conversation_sessions 的壓縮函式)."""
+    if chat_llm is None:
+        raise RuntimeError("OpenAI Chat LLM 模型未載入，無法壓縮對話歷史。")
+    transcript = "\n".join(f"{'用戶' if message['role'] == 'user' else '助手'}: {message['content']}" for message in messages)
+    prompt_tokens = estimate_tokens(summary or "") + estimate_tokens(transcript)
+    await llm_rate_limiter.acquire(prompt_tokens)
+    started = time.perf_counter()
+    try:
+        text = await (COMPACTION_PROMPT | chat_llm | StrOutputParser()).ainvoke({"summary": summary or "(無)", "transcript": transcript, "max_words": max_words})
+    except Exception:
+        record_llm_call("compact", prompt_tokens)
+        raise
+    record_llm_call("compact", prompt_tokens, estimate_tokens(text))
+    observe_stage("rag", "compact", time.perf_counter() - started)
+    return text.strip()
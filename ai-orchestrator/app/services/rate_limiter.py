@@ -0,0 +1,99 @@
+from typing import Dict, Optional
+import asyncio
+import os
+import logging
+import time
+
+from .metrics import RATE_LIMIT_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# 每分鐘的請求數與 token 數上限，0 表示不限制；預設值應依帳號的供應商配額調整
+EMBEDDING_RPM = int(os.getenv("EMBEDDING_RPM", 0))
+EMBEDDING_TPM = int(os.getenv("EMBEDDING_TPM", 0))
+LLM_RPM = int(os.getenv("LLM_RPM", 0))
+LLM_TPM = int(os.getenv("LLM_TPM", 0))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗估文本的 token 數，用於限流而非計費：
+    ASCII 約 4 個字元一個 token，中文等非 ASCII 字元約一個字元一個 token。
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return max(1, non_ascii + (len(text) - non_ascii + 3) // 4)
+
+
+class TokenBucket:
+    """
+    非同步 token bucket：容量為每分鐘上限，以 per_minute / 60 的速率持續補充。
+
+    acquire 在取得足夠額度前以鎖排隊等待，因此先到的請求先取得額度，
+    大請求不會被源源不絕的小請求餓死。單次需求超過容量時以容量計，避免永遠等待。
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited_seconds = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, amount: float = 1) -> float:
+        """取得 amount 的額度，回傳等待的秒數."""
+        amount = min(float(amount), self.capacity)
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    waited = time.monotonic() - started
+                    self.waited_seconds += waited
+                    return waited
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+
+class ProviderRateLimiter:
+    """
+    同一供應商的請求數 (RPM) 與 token 數 (TPM) 限制，整個程序共用一個實例，
+    因此單筆上傳、批次上傳與 RAG 問答會一起受到配額約束。
+    """
+
+    def __init__(self, name: str, rpm: int = 0, tpm: int = 0):
+        self.name = name
+        self._requests: Optional[TokenBucket] = TokenBucket(rpm) if rpm > 0 else None
+        self._tokens: Optional[TokenBucket] = TokenBucket(tpm) if tpm > 0 else None
+
+    @property
+    def enabled(self) -> bool:
+        return self._requests is not None or self._tokens is not None
+
+    async def acquire(self, tokens: int) -> None:
+        """在送出一個估計使用 tokens 個 token 的請求之前呼叫."""
+        waited = 0.0
+        if self._requests is not None:
+            waited += await self._requests.acquire(1)
+        if self._tokens is not None:
+            waited += await self._tokens.acquire(tokens)
+        if self.enabled:
+            RATE_LIMIT_WAIT_SECONDS.observe(waited, provider=self.name)
+        if waited > 1.0:
+            logger.info(f"{self.name} 限流: 等待 {waited:.1f} 秒 (估計 {tokens} tokens)。")
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "requests_waited_seconds": self._requests.waited_seconds if self._requests else 0.0,
+            "tokens_waited_seconds": self._tokens.waited_seconds if self._tokens else 0.0,
+        }
+
+
+# 全局限流器：Embedding 與 Chat LLM 的配額在供應商端是分開計算的
+embedding_rate_limiter = ProviderRateLimiter("Embedding", EMBEDDING_RPM, EMBEDDING_TPM)
+llm_rate_limiter = ProviderRateLimiter("LLM", LLM_RPM, LLM_TPM)
@@ -0,0 +1,200 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import fcntl
+import os
+import logging
+import threading
+import time
+
+import numpy as np
+
+from .cache_utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 1024)) # 精確比對層的項目上限
+SEARCH_CACHE_SEMANTIC_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_SEMANTIC_MAX_ENTRIES", 256)) # 語意層的項目上限 (每次查詢需線性掃描)
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", 300))
+SEARCH_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("SEARCH_CACHE_SEMANTIC_THRESHOLD", 0.97)) # 視為同一查詢的最低 cosine 相似度
+SEARCH_CACHE_VERSION_PATH = os.getenv("SEARCH_CACHE_VERSION_PATH", "./data/search_cache.version") # 各程序共用的失效版本號檔案
+
+SearchResults = List[Dict[str, Any]]
+
+
+class SearchCache:
+    """
+    /documents/search 的兩層結果快取。
+
+    - 精確層：以正規化後的查詢文字、limit 與過濾條件 (scope) 為鍵，命中時連 Embedding 都不需要計算。
+    - 語意層：新查詢的 Embedding 與同一 scope 下已快取查詢的 cosine 相似度超過門檻時，重用其結果。
+
+    兩層都有 TTL 與 LRU 淘汰；collection 有寫入時呼叫 invalidate() 清空並遞增版本號。
+    快取存在各程序的記憶體中，因此 version_path 指定時失效版本號另存於共用檔案：
+    任一程序 (uvicorn worker) 失效時遞增檔案中的版本號，其他程序在下一次查詢時發現版本改變並清空自己的快取。
+    查詢時只比對版本檔的 stat，檔案變更後才重新讀取。
+    """
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_MAX_ENTRIES,
+                 semantic_max_entries: int = SEARCH_CACHE_SEMANTIC_MAX_ENTRIES,
+                 ttl: float = SEARCH_CACHE_TTL_SECONDS,
+                 semantic_threshold: float = SEARCH_CACHE_SEMANTIC_THRESHOLD,
+                 version_path: Optional[str] = None):
+        self._exact: LRUCache[SearchResults] = LRUCache(max_entries, ttl)
+        self._semantic: "OrderedDict[Tuple[str, int, str], Tuple[np.ndarray, SearchResults, float]]" = OrderedDict()
+        self._semantic_max_entries = semantic_max_entries
+        self._ttl = ttl
+        self._threshold = semantic_threshold
+        self._lock = threading.Lock()
+        self.version = 0
+        self._version_path = version_path
+        if version_path:
+            os.makedirs(os.path.dirname(version_path) or ".", exist_ok=True)
+        self._file_seen = self._file_state() if version_path else None
+        self._shared_version = self._read_shared_version()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def _exact_key(self, query: str, limit: int, scope: str = "") -> Tuple[str, int, str]:
+        return self.normalize_query(query), limit, scope
+
+    def _file_state(self) -> Optional[Tuple[int, int, int]]:
+        """版本檔的 (inode, mtime, 大小)；檔案以原子替換寫入，內容改變時 inode 與 mtime 都會改變."""
+        try:
+            stat = os.stat(self._version_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read_shared_version(self) -> Optional[int]:
+        """讀取共用的失效版本號 (檔案不存在時為 0)；未設定共用檔案或讀取失敗時回傳 None."""
+        if not self._version_path:
+            return None
+        try:
+            with open(self._version_path, "r") as f:
+                content = f.read().strip()
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            logger.warning(f"讀取搜尋快取版本檔失敗: {e}")
+            return None
+        return int(content) if content.isdigit() else 0
+
+    def _sync(self) -> None:
+        """其他程序已使快取失效 (共用版本號改變) 時清空本程序的快取；版本檔未變更時只需一次 stat，不讀檔也不上鎖."""
+        if not self._version_path:
+            return
+        state = self._file_state()
+        if state == self._file_seen:
+            return
+        shared = self._read_shared_version()
+        if shared is None:
+            return
+        self._file_seen = state
+        if shared == self._shared_version:
+            return
+        self._exact.clear()
+        with self._lock:
+            self._semantic.clear()
+            self._shared_version = shared
+            self.version += 1
+
+    def current_version(self) -> int:
+        """同步共用版本號後回傳目前的版本號，搜尋開始時記錄，寫入結果時傳給 set()."""
+        self._sync()
+        return self.version
+
+    def get_exact(self, query: str, limit: int, scope: str = "") -> Optional[SearchResults]:
+        self._sync()
+        results = self._exact.get(self._exact_key(query, limit, scope))
+        if results is not None:
+            self.exact_hits += 1
+            return list(results)
+        return None
+
+    def get_semantic(self, query: str, embedding: Sequence[float], limit: int, scope: str = "") -> Optional[SearchResults]:
+        """在語意層中尋找相似度最高且超過門檻的查詢；命中時一併寫入精確層."""
+        self._sync()
+        vector = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, (_, _, expires_at) in self._semantic.items() if expires_at < now]:
+                del self._semantic[key]
+            candidates = [(key, entry) for key, entry in self._semantic.items() if key[1] >= limit and key[2] == scope]
+            if not candidates:
+                self.misses += 1
+                return None
+            matrix = np.stack([entry[0] for _, entry in candidates])
+            similarities = matrix @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self._threshold:
+                self.misses += 1
+                return None
+            key, (_, results, _) = candidates[best]
+            self._semantic.move_to_end(key)
+
+        self.semantic_hits += 1
+        results = list(results[:limit])
+        self._exact.set(self._exact_key(query, limit, scope), results)
+        logger.info(f"搜尋快取語意命中: '{query}' ≈ '{key[0]}' (相似度 {similarities[best]:.4f})")
+        return results
+
+    def set(self, query: str, embedding: Sequence[float], limit: int, results: SearchResults, version: Optional[int] = None, scope: str = "") -> None:
+        """寫入兩層快取；version 為搜尋開始時的版本號，若期間快取已失效則捨棄這筆可能過期的結果."""
+        key = self._exact_key(query, limit, scope)
+        self._sync()
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._exact.set(key, list(results))
+            self._semantic[key] = (self._normalize(embedding), list(results), time.monotonic() + self._ttl)
+            self._semantic.move_to_end(key)
+            while len(self._semantic) > self._semantic_max_entries:
+                self._semantic.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """collection 內容變更後清空快取並遞增版本號 (包括共用檔案中的版本號)."""
+        shared = self._bump_shared_version()
+        self._exact.clear()
+        with self._lock:
+            self._semantic.clear()
+            self._shared_version = shared
+            self.version += 1
+        logger.info(f"搜尋快取已失效 (版本 {self.version})。")
+
+    def _bump_shared_version(self) -> Optional[int]:
+        """在鎖檔的排他鎖下遞增版本號；以暫存檔原子替換寫入，讀取的一方不需上鎖."""
+        if not self._version_path:
+            return None
+        try:
+            with open(self._version_path + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                shared = (self._read_shared_version() or 0) + 1
+                temp_path = f"{self._version_path}.{os.getpid()}.tmp"
+                with open(temp_path, "w") as f:
+                    f.write(str(shared))
+                os.replace(temp_path, self._version_path)
+            self._file_seen = self._file_state()
+            return shared
+        except OSError as e:
+            logger.error(f"更新搜尋快取版本檔失敗: {e}，其他程序的快取不會失效。", exc_info=True)
+            return None
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "version": self.version,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "entries": len(self._exact),
+        }
@@ -0,0 +1,119 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple, Union
+import json
+import os
+import logging
+
+from qdrant_client import models
+
+logger = logging.getLogger(__name__)
+
+# 可用於搜尋過濾的 metadata 欄位與型別 (keyword | integer | float | bool | datetime)，格式為 "欄位:型別,..."
+# 啟動時會為每個欄位建立 payload index；未宣告的欄位不能用於過濾，避免無索引的全表掃描
+# 預設為後端 DocumentController::upload 實際寫入的 metadata 欄位
+SEARCH_FILTER_FIELDS = os.getenv("SEARCH_FILTER_FIELDS", "category:keyword,uploaded_by:integer")
+TIMESTAMP_SUFFIX = "_ts" # datetime 欄位另存為 epoch 秒的整數欄位，以整數 index 支援範圍查詢
+
+FilterValue = Union[str, int, float, bool, List[Any], Dict[str, Any]]
+SearchFilters = Dict[str, FilterValue]
+
+_SCHEMA_TYPES = {
+    "keyword": models.PayloadSchemaType.KEYWORD,
+    "integer": models.PayloadSchemaType.INTEGER,
+    "float": models.PayloadSchemaType.FLOAT,
+    "bool": models.PayloadSchemaType.BOOL,
+    "datetime": models.PayloadSchemaType.INTEGER,
+}
+_RANGE_OPERATORS = ("gt", "gte", "lt", "lte")
+
+
+def parse_filter_fields(spec: str) -> Dict[str, str]:
+    """解析 SEARCH_FILTER_FIELDS；document_id 一律可過濾."""
+    fields = {"document_id": "integer"}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, field_type = item.partition(":")
+        field_type = (field_type or "keyword").strip().lower()
+        if field_type not in _SCHEMA_TYPES:
+            raise ValueError(f"不支援的過濾欄位型別: {item}")
+        fields[name.strip()] = field_type
+    return fields
+
+
+FILTER_FIELDS = parse_filter_fields(SEARCH_FILTER_FIELDS)
+
+# 由 datetime 欄位衍生、不屬於使用者 metadata 的 payload 欄位
+TIMESTAMP_PAYLOAD_KEYS = [name + TIMESTAMP_SUFFIX for name, field_type in FILTER_FIELDS.items() if field_type == "datetime"]
+
+
+def payload_index_specs(fields: Optional[Dict[str, str]] = None) -> List[Tuple[str, models.PayloadSchemaType]]:
+    """需要建立的 payload index: (payload 欄位名稱, 型別)."""
+    fields = FILTER_FIELDS if fields is None else fields
+    return [(name + TIMESTAMP_SUFFIX if field_type == "datetime" else name, _SCHEMA_TYPES[field_type]) for name, field_type in fields.items()]
+
+
+def to_timestamp(value: Any) -> int:
+    """將 datetime、ISO 8601 字串或 epoch 秒數轉為 epoch 秒；無時區的時間視為 UTC."""
+    if isinstance(value, bool):
+        raise ValueError(f"無法解析的時間: {value!r}")
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    raise ValueError(f"無法解析的時間: {value!r}")
+
+
+def indexed_payload_values(metadata: Dict[str, Any]) -> Dict[str, int]:
+    """寫入 payload 前為 metadata 中的 datetime 欄位衍生可索引的 epoch 秒欄位；無法解析的值略過."""
+    values = {}
+    for name, field_type in FILTER_FIELDS.items():
+        if field_type != "datetime" or metadata.get(name) is None:
+            continue
+        try:
+            values[name + TIMESTAMP_SUFFIX] = to_timestamp(metadata[name])
+        except (TypeError, ValueError):
+            logger.warning(f"metadata 欄位 {name} 的值 {metadata[name]!r} 不是有效的時間，無法用於範圍過濾。")
+    return values
+
+
+def _condition(name: str, field_type: str, value: FilterValue) -> models.FieldCondition:
+    if isinstance(value, dict):
+        unknown = set(value) - set(_RANGE_OPERATORS)
+        if unknown or not value:
+            raise ValueError(f"過濾欄位 {name} 的範圍條件只支援 {', '.join(_RANGE_OPERATORS)}")
+        if field_type == "datetime":
+            bounds = {op: to_timestamp(bound) for op, bound in value.items() if bound is not None}
+            return models.FieldCondition(key=name + TIMESTAMP_SUFFIX, range=models.Range(**bounds))
+        if field_type not in ("integer", "float"):
+            raise ValueError(f"過濾欄位 {name} ({field_type}) 不支援範圍條件")
+        return models.FieldCondition(key=name, range=models.Range(**value))
+    if field_type == "datetime":
+        raise ValueError(f"時間欄位 {name} 只支援範圍條件 (gt/gte/lt/lte)")
+    if isinstance(value, list):
+        if not value:
+            raise ValueError(f"過濾欄位 {name} 的候選值不可為空")
+        return models.FieldCondition(key=name, match=models.MatchAny(any=value))
+    return models.FieldCondition(key=name, match=models.MatchValue(value=value))
+
+
+def build_search_filter(filters: Optional[SearchFilters]) -> Optional[models.Filter]:
+    """
+    將結構化過濾條件轉為 Qdrant Filter，所有條件以 AND 結合並在 Qdrant 端執行：
+    單一值為精確比對，列表為任一符合，{"gte": ..., "lt": ...} 為範圍 (datetime 欄位可使用 ISO 8601 字串)。
+    """
+    if not filters:
+        return None
+    conditions = []
+    for name, value in filters.items():
+        if name not in FILTER_FIELDS:
+            raise ValueError(f"不支援的過濾欄位: {name} (可用欄位: {', '.join(FILTER_FIELDS)})")
+        conditions.append(_condition(name, FILTER_FIELDS[name], value))
+    return models.Filter(must=conditions)
+
+
+def filter_cache_key(filters: Optional[SearchFilters]) -> str:
+    """過濾條件的正規化字串，作為搜尋快取鍵的一部分."""
+    return json.dumps(filters, sort_keys=True, ensure_ascii=False, default=str) if filters else ""
@@ -0,0 +1,240 @@
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+import asyncio
+import functools
+import os
+import logging
+import sqlite3
+import threading
+import time
+
+from .cache_utils import content_hash
+from .job_queue import ProgressCallback
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "map_reduce").lower() # map_reduce | truncate (只摘要文件開頭)
+SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", 8)) # 整個程序同時進行的部分摘要 LLM 呼叫數
+SUMMARY_REDUCE_FANOUT = int(os.getenv("SUMMARY_REDUCE_FANOUT", 8)) # 每次合併的部分摘要數
+SUMMARY_CACHE_ENABLED = os.getenv("SUMMARY_CACHE_ENABLED", "true").lower() == "true"
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", "./data/summary_cache.db")
+SUMMARY_PROMPT_VERSION = "v1" # 修改 prompt 時遞增，使舊的快取失效
+
+MAP_PROMPT = "請摘要以下文件片段的重點，保留關鍵名詞、數字與結論：\n\n{text}"
+REDUCE_PROMPT = "以下是同一份文件中連續幾個部分的摘要，請整合為一份簡潔、清晰且不重複的摘要：\n\n{text}"
+
+Completion = Callable[[str], Awaitable[str]]
+
+
+class SummaryCache:
+    """以 SQLite 持久化的部分摘要快取，鍵為 (模型, prompt 版本, 階段, 輸入內容) 的雜湊."""
+
+    def __init__(self, db_path: str = SUMMARY_CACHE_PATH):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS partial_summaries (key TEXT PRIMARY KEY, summary TEXT NOT NULL, created_at REAL NOT NULL)")
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM partial_summaries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, key: str, summary: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO partial_summaries (key, summary, created_at) VALUES (?, ?, ?)", (key, summary, time.time()))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class MapReduceSummarizer:
+    """
+    階層式 (map-reduce) 文件摘要。
+
+    map：每個塊各自摘要，整個程序共用 concurrency 個 LLM 呼叫名額；
+    reduce：每 fanout 個相鄰的部分摘要合併為一個，逐層進行直到剩下一個。
+    同一層的呼叫彼此平行，因此總耗時約與 log(文件大小) 成正比。
+    所有部分摘要都以輸入內容的雜湊快取，重新處理文件時只有變更的段落 (及其上層) 需要重新摘要。
+    """
+
+    def __init__(self, complete: Completion, model_name: str = "",
+                 cache: Optional[SummaryCache] = None,
+                 concurrency: int = SUMMARY_MAP_CONCURRENCY,
+                 fanout: int = SUMMARY_REDUCE_FANOUT):
+        self._complete = complete
+        self._model_name = model_name
+        self.cache = cache
+        self._slots = asyncio.Semaphore(concurrency)
+        self._fanout = max(2, fanout)
+
+    async def _summarize(self, stage: str, prompt_template: str, text: str) -> str:
+        """執行一次 (可快取的) 摘要呼叫；呼叫者需先取得名額."""
+        key = content_hash(self._model_name, SUMMARY_PROMPT_VERSION, stage, text)
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return cached
+        summary = await self._complete(prompt_template.format(text=text))
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.set, key, summary)
+        return summary
+
+    async def _bounded(self, stage: str, prompt_template: str, text: str) -> str:
+        async with self._slots:
+            return await self._summarize(stage, prompt_template, text)
+
+    def start(self, document_id: int, min_chars: int = 0, progress: Optional[ProgressCallback] = None) -> "SummarySession":
+        return SummarySession(self, document_id, min_chars, progress)
+
+    async def summarize_chunks(self, document_id: int, chunks: List[str], progress: Optional[ProgressCallback] = None) -> str:
+        """摘要已在記憶體中的塊列表."""
+        session = self.start(document_id, progress=progress)
+        for chunk in chunks:
+            await session.add(chunk)
+        return await session.result()
+
+
+class SummarySession:
+    """
+    單一文件的摘要工作階段：add 只把塊排入本工作階段的佇列，不等待 LLM 名額，
+    由工作階段自己的 consumer 依序取得整個程序共用的名額後執行 map。
+    因此文件的向量化與寫入不受摘要並行數影響 (大型文件的摘要不會拖慢其他文件的索引)；
+    代價是尚未 map 的塊暫存在記憶體中。result 等待所有 map 完成後逐層 reduce。
+
+    累積的塊不超過 min_chars 個字元前不會開始 map；若整份文件都沒有超過，
+    mapped 為 False，呼叫者應改以單次呼叫摘要全文 (map-reduce 對短文件只會增加呼叫次數)。
+    """
+
+    def __init__(self, summarizer: MapReduceSummarizer, document_id: int, min_chars: int = 0, progress: Optional[ProgressCallback] = None):
+        self._summarizer = summarizer
+        self.document_id = document_id
+        self._min_chars = min_chars
+        self._progress = progress
+        self._pending: List[str] = [] # 尚未達到 min_chars 前暫存的塊
+        self._pending_chars = 0
+        self._queue: "asyncio.Queue[Tuple[str, asyncio.Future]]" = asyncio.Queue() # 等待名額的塊
+        self._consumer: Optional[asyncio.Task] = None
+        self._partials: List[asyncio.Future] = [] # 依塊順序排列的部分摘要
+        self._tasks: List[asyncio.Task] = []
+        self._completed = 0
+        self._total = 0
+
+    @property
+    def mapped(self) -> bool:
+        return bool(self._partials)
+
+    async def _report(self) -> None:
+        if self._progress is not None:
+            await self._progress("summarize", self._completed, self._total)
+
+    async def _mapped(self, chunk: str) -> str:
+        try:
+            return await self._summarizer._summarize("map", MAP_PROMPT, chunk)
+        finally:
+            self._completed += 1
+
+    def _mapped_done(self, partial: asyncio.Future, task: asyncio.Task) -> None:
+        # 在 done callback 中歸還名額：任務在開始執行前就被取消時 _mapped 的 finally 不會執行
+        self._summarizer._slots.release()
+        if task.cancelled():
+            partial.cancel()
+        elif partial.done():
+            task.exception() # 取消後不再等待的任務不產生未取得例外的警告
+        elif task.exception() is not None:
+            partial.set_exception(task.exception())
+        else:
+            partial.set_result(task.result())
+
+    async def _consume(self) -> None:
+        """依序為佇列中的塊取得名額並開始 map；名額用完時只有這裡等待，add 不受影響."""
+        while True:
+            chunk, partial = await self._queue.get()
+            if partial.done(): # 工作階段已取消
+                continue
+            await self._summarizer._slots.acquire()
+            task = asyncio.create_task(self._mapped(chunk))
+            task.add_done_callback(functools.partial(self._mapped_done, partial))
+            self._tasks.append(task)
+
+    def _schedule(self, chunk: str) -> None:
+        partial = asyncio.get_running_loop().create_future()
+        self._partials.append(partial)
+        self._queue.put_nowait((chunk, partial))
+        self._total += 1
+        if self._consumer is None:
+            self._consumer = asyncio.create_task(self._consume())
+
+    async def add(self, chunk: str) -> None:
+        if not chunk.strip():
+            return
+        if self._partials:
+            self._schedule(chunk)
+            return
+        self._pending.append(chunk)
+        self._pending_chars += len(chunk)
+        if self._pending_chars > self._min_chars:
+            pending, self._pending = self._pending, []
+            for text in pending:
+                self._schedule(text)
+
+    async def tee(self, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """將塊串流交給 map 摘要，同時原樣傳給下游 (例如向量化)."""
+        async for chunk in chunks:
+            await self.add(chunk)
+            yield chunk
+
+    def _stop_consumer(self) -> None:
+        if self._consumer is not None:
+            self._consumer.cancel()
+
+    def cancel(self) -> None:
+        self._stop_consumer()
+        for task in self._tasks:
+            task.cancel()
+        for partial in self._partials:
+            partial.cancel()
+
+    async def result(self) -> str:
+        """等待 map 完成並逐層 reduce，回傳整份文件的摘要."""
+        for text in self._pending: # 文件未超過 min_chars 但呼叫者仍要求 map-reduce
+            self._schedule(text)
+        self._pending = []
+        if not self._partials:
+            raise ValueError("沒有可摘要的內容")
+
+        started = time.perf_counter()
+        try:
+            partials = list(await asyncio.gather(*self._partials))
+        except BaseException:
+            self.cancel()
+            await asyncio.gather(*self._tasks, *self._partials, return_exceptions=True)
+            raise
+        finally:
+            self._stop_consumer()
+        fanout = self._summarizer._fanout
+        levels = 0
+        while len(partials) > 1:
+            groups = [partials[i:i + fanout] for i in range(0, len(partials), fanout)]
+            self._total += len(groups)
+            await self._report()
+            partials = list(await asyncio.gather(*(
+                self._summarizer._bounded("reduce", REDUCE_PROMPT, "\n\n".join(group)) if len(group) > 1 else self._passthrough(group[0])
+                for group in groups
+            )))
+            self._completed += len(groups)
+            levels += 1
+        await self._report()
+        logger.info(f"文件 {self.document_id} map-reduce 摘要完成: {len(self._partials)} 個塊，{levels} 層 reduce，reduce 耗時 {time.perf_counter() - started:.2f} 秒。")
+        return partials[0]
+
+    @staticmethod
+    async def _passthrough(summary: str) -> str:
+        return summary
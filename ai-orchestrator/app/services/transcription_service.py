@@ -0,0 +1,397 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+import asyncio
+import os
+import logging
+import threading
+import time
+
+import numpy as np
+
+# Faster-Whisper 導入
+from faster_whisper import WhisperModel
+
+from . import whisper_batching
+from .metrics import (
+    WHISPER_AUDIO_SECONDS, WHISPER_BATCH_ITEMS, WHISPER_BATCH_WAIT_SECONDS, WHISPER_DECODE_SECONDS, WHISPER_REALTIME_FACTOR
+)
+
+logger = logging.getLogger(__name__)
+
+# 從環境變數讀取模型配置
+WHISPER_MODEL_NAME = os.getenv("WHISPER_MODEL", "tiny")
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "cpu") # 'cpu' or 'cuda'
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8") # 'int8' for CPU, 'float16' for GPU
+WHISPER_DOWNLOAD_ROOT = "./data/whisper_models" # 模型下載路徑
+
+# 轉錄執行器配置
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", 2)) # 同時進行的轉錄數 (執行緒數 / CTranslate2 num_workers)
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", 0)) # 每個轉錄使用的 CPU 執行緒數，0 表示使用 CTranslate2 預設值
+WHISPER_MAX_QUEUE = int(os.getenv("WHISPER_MAX_QUEUE", 8)) # 等待中的轉錄請求上限，超過即拒絕
+WHISPER_BEAM_SIZE = int(os.getenv("WHISPER_BEAM_SIZE", 5))
+WHISPER_RETRY_AFTER_SECONDS = int(os.getenv("WHISPER_RETRY_AFTER_SECONDS", 5)) # 佇列已滿時建議客戶端的重試間隔
+
+# 動態批次：同時到達的轉錄請求在 WINDOW 毫秒內 (或湊滿 SIZE 個時) 合併為一次批次解碼，SIZE 為 1 時停用
+WHISPER_BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", 1))
+WHISPER_BATCH_WINDOW_MS = float(os.getenv("WHISPER_BATCH_WINDOW_MS", 20))
+
+# 即時 (WebSocket) 轉錄配置
+WHISPER_STREAM_STEP_SECONDS = float(os.getenv("WHISPER_STREAM_STEP_SECONDS", 1.0)) # 每累積多少秒新音訊就重新解碼一次
+WHISPER_STREAM_HOLDBACK_SECONDS = float(os.getenv("WHISPER_STREAM_HOLDBACK_SECONDS", 1.5)) # 結尾多少秒內的 segment 視為暫定結果
+WHISPER_STREAM_MAX_BUFFER_SECONDS = float(os.getenv("WHISPER_STREAM_MAX_BUFFER_SECONDS", 20)) # 未確認音訊的上限，超過時強制確認，每次解碼的長度不隨錄音增長
+WHISPER_STREAM_OVERLAP_SECONDS = float(os.getenv("WHISPER_STREAM_OVERLAP_SECONDS", 0.3)) # 確認點之前保留的音訊，作為下一次解碼的上下文
+SAMPLE_RATE = 16000 # Whisper 輸入取樣率，WebSocket 音訊需為 16kHz 單聲道 PCM16
+
+AudioInput = Union[BinaryIO, np.ndarray]
+
+_STREAM_END = object() # 串流轉錄結束標記
+
+
+class TranscriptionUnavailableError(RuntimeError):
+    """Whisper 模型未載入，無法執行轉錄."""
+
+
+class TranscriptionQueueFullError(RuntimeError):
+    """轉錄佇列已滿，請求被拒絕."""
+
+    def __init__(self, queue_depth: int, max_queue: int):
+        super().__init__(f"轉錄佇列已滿 ({queue_depth}/{max_queue})")
+        self.queue_depth = queue_depth
+        self.max_queue = max_queue
+
+
+class TranscriptionExecutor:
+    """
+    擁有 WhisperModel 的專用轉錄工作池。
+
+    CPU 密集的解碼在獨立的執行緒池中執行 (CTranslate2 會釋放 GIL)，
+    event loop 只負責排隊與等待結果，因此其他 API 路由在轉錄期間仍可回應。
+    同時執行數為 workers，另有 max_queue 個等待位置，超過時立即拒絕。
+
+    batch_size 大於 1 時，不帶選項的 transcribe / transcribe_segments 請求先進入批次：
+    第一個請求到達後等待 batch_window 秒 (或湊滿 batch_size 個)，再以一次批次解碼處理整批，
+    每個請求各自取得自己的 segments。名額仍以請求計算，因此佇列上限的語意不變。
+    串流轉錄需要逐段回傳，不參與批次。
+    """
+
+    def __init__(self, workers: int = WHISPER_WORKERS, max_queue: int = WHISPER_MAX_QUEUE,
+                 batch_size: int = WHISPER_BATCH_SIZE, batch_window: float = WHISPER_BATCH_WINDOW_MS / 1000):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._batch: List[Tuple[AudioInput, asyncio.Future, float]] = [] # 尚未送出的批次 (音訊, 結果, 排入時間)
+        self._batch_timer: Optional[asyncio.TimerHandle] = None
+        self.model: Optional[WhisperModel] = None
+        self.remote: Optional[Any] = None # 共用其他 worker 的模型時的轉送客戶端 (見 whisper_sharing)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whisper")
+        self._pending = 0 # 執行中 + 等待中的請求數，只在 event loop 執行緒中修改
+
+    def load_model(self) -> None:
+        """載入 Faster-Whisper 模型，num_workers 與工作池大小一致以允許並行轉錄."""
+        try:
+            logger.info(f"嘗試載入 Faster-Whisper 模型: {WHISPER_MODEL_NAME} (Device: {WHISPER_DEVICE}, Compute Type: {WHISPER_COMPUTE_TYPE}, Workers: {self.workers})")
+            self.model = WhisperModel(
+                WHISPER_MODEL_NAME,
+                device=WHISPER_DEVICE,
+                compute_type=WHISPER_COMPUTE_TYPE,
+                cpu_threads=WHISPER_CPU_THREADS,
+                num_workers=self.workers,
+                download_root=WHISPER_DOWNLOAD_ROOT
+            )
+            logger.info(f"Faster-Whisper model '{WHISPER_MODEL_NAME}' loaded successfully.")
+        except Exception as e:
+            logger.error(f"載入 Faster-Whisper 模型失敗: {e}", exc_info=True)
+            self.model = None
+
+    async def load(self) -> None:
+        """在執行緒中載入模型，不阻塞 event loop；載入失敗時拋出 TranscriptionUnavailableError."""
+        await asyncio.to_thread(self.load_model)
+        if self.model is None:
+            raise TranscriptionUnavailableError("Whisper 模型載入失敗。")
+
+    async def warmup(self) -> None:
+        """以一秒靜音執行一次轉錄，讓首個真實請求不必承擔模型的首次推論開銷."""
+        await self.transcribe_segments(np.zeros(SAMPLE_RATE, dtype=np.float32))
+
+    def attach_remote(self, remote: Any) -> None:
+        """改為把轉錄轉送給持有模型的 worker (remote 需提供 stream 與 transcribe_segments)；傳入 None 時恢復本地轉錄."""
+        self.remote = remote
+
+    @property
+    def is_available(self) -> bool:
+        return self.model is not None or self.remote is not None
+
+    @property
+    def in_flight(self) -> int:
+        """執行中與等待中的轉錄總數."""
+        return self._pending
+
+    @property
+    def queue_depth(self) -> int:
+        """尚未開始執行、仍在等待工作執行緒的轉錄數."""
+        return max(0, self._pending - self.workers)
+
+    def _reserve(self) -> None:
+        if self.model is None:
+            raise TranscriptionUnavailableError("Whisper 模型未載入。")
+        if self._pending >= self.workers + self.max_queue:
+            raise TranscriptionQueueFullError(self.queue_depth, self.max_queue)
+        self._pending += 1
+
+    def _release(self) -> None:
+        self._pending -= 1
+
+    def _submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        """保留名額並提交工作；名額於工作真正結束時才釋放 (即使客戶端中途斷線)，確保佇列深度反映實際 CPU 負載."""
+        self._reserve()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        return future
+
+    @staticmethod
+    def _segment_to_dict(segment: Any) -> Dict[str, Any]:
+        return {"start": round(segment.start, 2), "end": round(segment.end, 2), "text": segment.text.strip()}
+
+    @staticmethod
+    def _observe_decode(mode: str, started: float, info: Any) -> None:
+        """記錄解碼耗時與即時率 (解碼時間 / 音訊長度)."""
+        elapsed = time.perf_counter() - started
+        WHISPER_DECODE_SECONDS.observe(elapsed, mode=mode)
+        duration = getattr(info, "duration", None)
+        if isinstance(duration, (int, float)) and duration > 0:
+            WHISPER_AUDIO_SECONDS.inc(duration)
+            WHISPER_REALTIME_FACTOR.observe(elapsed / duration, mode=mode)
+
+    def _transcribe_sync(self, audio: AudioInput, options: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Any]:
+        """在工作執行緒中執行轉錄；segments 是惰性產生器，必須在此處完整迭代."""
+        started = time.perf_counter()
+        segments, info = self.model.transcribe(audio, beam_size=WHISPER_BEAM_SIZE, **options)
+        result = [self._segment_to_dict(segment) for segment in segments]
+        self._observe_decode("batch", started, info)
+        return result, info
+
+    def _transcribe_batch_sync(self, audios: List[AudioInput], enqueued: List[float]) -> List[List[Dict[str, Any]]]:
+        """在工作執行緒中批次解碼；等待時間量到真正開始解碼為止，包含等待工作執行緒的時間."""
+        started = time.perf_counter()
+        for queued_at in enqueued:
+            WHISPER_BATCH_WAIT_SECONDS.observe(started - queued_at)
+        WHISPER_BATCH_ITEMS.observe(len(audios))
+        results = whisper_batching.decode_batch(self.model, audios, WHISPER_BEAM_SIZE)
+        self._observe_decode("microbatch", started, SimpleNamespace(duration=sum(duration for _, duration in results)))
+        return [segments for segments, _ in results]
+
+    def _flush_batch(self) -> None:
+        """把目前累積的請求作為一個批次送進工作池."""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        loop = asyncio.get_running_loop()
+
+        def finish(job: Future) -> None:
+            for index, (_, waiter, _) in enumerate(batch):
+                self._release()
+                if waiter.done(): # 呼叫方已取消
+                    continue
+                if job.cancelled():
+                    waiter.cancel()
+                elif job.exception() is not None:
+                    waiter.set_exception(job.exception())
+                else:
+                    waiter.set_result(job.result()[index])
+
+        try:
+            job = self._executor.submit(self._transcribe_batch_sync, [audio for audio, _, _ in batch], [queued_at for _, _, queued_at in batch])
+        except Exception as e:
+            for _, waiter, _ in batch:
+                self._release()
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+        job.add_done_callback(lambda job: loop.call_soon_threadsafe(finish, job))
+
+    async def _transcribe_batched(self, audio: AudioInput) -> List[Dict[str, Any]]:
+        """排入批次並等待結果；呼叫者需已保留名額，名額於批次解碼結束時釋放."""
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._batch.append((audio, waiter, time.perf_counter()))
+        if len(self._batch) >= self.batch_size:
+            self._flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = loop.call_later(self.batch_window, self._flush_batch)
+        return await waiter
+
+    def _stream_sync(self, audio: AudioInput, options: Dict[str, Any], emit: Callable[[Dict[str, Any]], None], cancelled: threading.Event) -> Any:
+        """在工作執行緒中逐段解碼，每解出一個 segment 就立即送回 event loop."""
+        started = time.perf_counter()
+        segments, info = self.model.transcribe(audio, beam_size=WHISPER_BEAM_SIZE, **options)
+        for segment in segments:
+            if cancelled.is_set():
+                return info
+            emit(self._segment_to_dict(segment))
+        self._observe_decode("stream", started, info)
+        return info
+
+    async def transcribe_segments(self, audio: AudioInput, **options: Any) -> List[Dict[str, Any]]:
+        """轉錄並回傳含時間戳的 segment 列表."""
+        if self.model is None and self.remote is not None:
+            return await self.remote.transcribe_segments(audio, **options)
+        if self.batch_size > 1 and not options:
+            # 排入批次前先解碼以取得長度：超過一個視窗的音訊需要逐窗解碼，改走一般路徑，避免同批的短音訊等待它
+            # 解碼前先保留名額，佇列已滿時立即拒絕，而不是讓解碼工作無限制地堆積
+            self._reserve()
+            try:
+                audio = await asyncio.to_thread(whisper_batching.load_audio, audio, SAMPLE_RATE)
+            except BaseException:
+                self._release()
+                raise
+            if len(audio) <= whisper_batching.WINDOW_SECONDS * SAMPLE_RATE:
+                return await self._transcribe_batched(audio)
+            self._release() # 改由 _submit 重新保留
+        segments, _ = await asyncio.wrap_future(self._submit(self._transcribe_sync, audio, options))
+        return segments
+
+    async def transcribe(self, audio: AudioInput, **options: Any) -> str:
+        """
+        將轉錄工作提交至工作池並等待結果。
+
+        佇列已滿時拋出 TranscriptionQueueFullError，模型未載入時拋出 TranscriptionUnavailableError。
+        """
+        segments = await self.transcribe_segments(audio, **options)
+        return " ".join(segment["text"] for segment in segments).strip()
+
+    def stream(self, audio: AudioInput, **options: Any) -> AsyncIterator[Dict[str, Any]]:
+        """
+        串流轉錄：回傳非同步迭代器，每個 segment 解碼完成即產出。
+
+        名額在呼叫時即保留，因此佇列已滿的錯誤會在開始串流回應之前拋出。
+        迭代器關閉時 (例如客戶端斷線) 會通知工作執行緒停止解碼。
+        轉送給其他 worker 時，佇列已滿的錯誤改由迭代器拋出。
+        """
+        if self.model is None and self.remote is not None:
+            return self.remote.stream(audio, **options)
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def emit(item: Dict[str, Any]) -> None:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        future = self._submit(self._stream_sync, audio, options, emit, cancelled)
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(queue.put_nowait, _STREAM_END))
+
+        async def iterate() -> AsyncIterator[Dict[str, Any]]:
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is _STREAM_END:
+                        break
+                    yield item
+                await asyncio.wrap_future(future) # 重新拋出工作執行緒中的例外
+            finally:
+                cancelled.set()
+
+        return iterate()
+
+    def shutdown(self) -> None:
+        """停止工作池，取消尚未開始的轉錄."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class StreamingTranscriptionSession:
+    """
+    邊錄邊轉的即時轉錄工作階段。
+
+    持續累積 16kHz PCM16 音訊，每累積 step 秒就從確認點開始重新解碼尚未確認的尾段：
+    結束時間早於 (目前長度 - holdback) 的 segment 視為最終結果，其音訊從緩衝區移除 (只保留 overlap 秒作為上下文)，
+    其餘作為暫定結果回傳，因此首段文字的延遲約為一個 step 加上一次短片段解碼。
+    未確認的音訊超過 max_buffer 秒 (例如長時間沒有停頓) 時強制確認最後一個 segment 之前的內容，
+    因此每次解碼的長度有上限，長時間串流的總成本與錄音長度成線性關係。
+    """
+
+    def __init__(self, executor: TranscriptionExecutor,
+                 step_seconds: float = WHISPER_STREAM_STEP_SECONDS,
+                 holdback_seconds: float = WHISPER_STREAM_HOLDBACK_SECONDS,
+                 max_buffer_seconds: float = WHISPER_STREAM_MAX_BUFFER_SECONDS,
+                 overlap_seconds: float = WHISPER_STREAM_OVERLAP_SECONDS):
+        self._executor = executor
+        self._step_samples = int(step_seconds * SAMPLE_RATE)
+        self._holdback_seconds = holdback_seconds
+        self._max_buffer_seconds = max_buffer_seconds
+        self._overlap_samples = int(overlap_seconds * SAMPLE_RATE)
+        self._audio = np.zeros(0, dtype=np.float32) # 確認點之前的重疊部分 + 尚未確認的音訊
+        self._chunks: List[np.ndarray] = [] # 上次解碼後收到的音訊，解碼時才合併，避免每次 append 都複製整個緩衝區
+        self._committed_samples = 0 # 緩衝區開頭已確認 (重疊) 的樣本數
+        self._offset_seconds = 0.0 # 緩衝區起點在整段錄音中的時間
+        self._undecoded_samples = 0
+        self.final_segments: List[Dict[str, Any]] = []
+
+    def append(self, pcm16: bytes) -> None:
+        """加入一段 16-bit little-endian 單聲道 PCM 音訊."""
+        samples = np.frombuffer(pcm16, dtype="<i2").astype(np.float32) / 32768.0
+        self._chunks.append(samples)
+        self._undecoded_samples += len(samples)
+
+    @property
+    def ready(self) -> bool:
+        return self._undecoded_samples >= self._step_samples
+
+    async def decode(self, final: bool = False) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """解碼目前緩衝區，回傳 (新確認的 segments, 暫定 segments)，時間戳相對於錄音起點."""
+        if self._chunks:
+            self._audio = np.concatenate([self._audio, *self._chunks])
+            self._chunks = []
+        self._undecoded_samples = 0
+        if len(self._audio) <= self._committed_samples:
+            return [], []
+
+        buffered_seconds = len(self._audio) / SAMPLE_RATE
+        overlap_seconds = self._committed_samples / SAMPLE_RATE
+        segments = await self._executor.transcribe_segments(self._audio)
+        # 中點落在重疊部分的 segment 在上一次已確認
+        segments = [s for s in segments if (s["start"] + s["end"]) / 2 > overlap_seconds]
+        cutoff = buffered_seconds if final else buffered_seconds - self._holdback_seconds
+        if not final and buffered_seconds - overlap_seconds > self._max_buffer_seconds and segments:
+            cutoff = segments[-2]["end"] if len(segments) > 1 else max(buffered_seconds, segments[-1]["end"])
+
+        committed = [s for s in segments if s["end"] <= cutoff]
+        pending = [s for s in segments if s["end"] > cutoff]
+
+        # 確認的音訊從緩衝區移除；若整段都沒有語音，也只保留 holdback 長度避免緩衝區無限增長
+        if committed:
+            commit_seconds = committed[-1]["end"]
+        elif not segments:
+            commit_seconds = max(0.0, cutoff)
+        else:
+            commit_seconds = 0.0
+        commit_samples = min(int(commit_seconds * SAMPLE_RATE), len(self._audio))
+        keep_from = max(0, commit_samples - self._overlap_samples) if commit_samples > self._committed_samples else 0
+
+        def shift(segment: Dict[str, Any]) -> Dict[str, Any]:
+            return {**segment, "start": round(segment["start"] + self._offset_seconds, 2), "end": round(segment["end"] + self._offset_seconds, 2)}
+
+        committed = [shift(s) for s in committed]
+        pending = [shift(s) for s in pending]
+        if keep_from:
+            self._audio = self._audio[keep_from:]
+            self._committed_samples = commit_samples - keep_from
+            self._offset_seconds += keep_from / SAMPLE_RATE
+        self.final_segments.extend(committed)
+        return committed, pending
+
+    @property
+    def transcribed_text(self) -> str:
+        return " ".join(segment["text"] for segment in self.final_segments).strip()
+
+
+# 全局轉錄執行器，Whisper 模型由它持有
+transcription_executor = TranscriptionExecutor()
@@ -0,0 +1,108 @@
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# 與 faster-whisper 的 transcribe 預設值相同的判斷門檻
+NO_SPEECH_THRESHOLD = 0.6 # no_speech 機率高於此值且平均 log 機率低於 LOG_PROB_THRESHOLD 時視為無語音
+LOG_PROB_THRESHOLD = -1.0
+TIME_PRECISION = 0.02 # 時間戳 token 的間隔 (秒)
+MAX_LENGTH = 448 # 解碼器輸出 token 上限
+WINDOW_SECONDS = 30 # 批次解碼只處理能放進單一視窗的音訊
+
+Segments = List[Dict[str, Any]]
+
+
+def load_audio(audio: Any, sampling_rate: int) -> np.ndarray:
+    """把上傳的音訊檔解碼為 float32 波形 (已是波形時直接回傳)."""
+    if isinstance(audio, np.ndarray):
+        return audio.astype(np.float32, copy=False)
+    from faster_whisper.audio import decode_audio
+    return decode_audio(audio, sampling_rate=sampling_rate)
+
+
+def _parse_segments(tokens: Sequence[int], tokenizer: Any, duration: float) -> Segments:
+    """依時間戳 token 切分輸出：兩個時間戳之間的文字為一個 segment，最後沒有結束時間戳的文字延伸到音訊結尾."""
+    segments: Segments = []
+    start = 0.0
+    text_tokens: List[int] = []
+
+    def flush(end: float) -> None:
+        text = tokenizer.decode(text_tokens).strip()
+        if text:
+            segments.append({"start": round(start, 2), "end": round(min(end, duration), 2), "text": text})
+        text_tokens.clear()
+
+    for token in tokens:
+        if token == tokenizer.eot:
+            break
+        if token >= tokenizer.timestamp_begin:
+            timestamp = (token - tokenizer.timestamp_begin) * TIME_PRECISION
+            if text_tokens:
+                flush(timestamp)
+            start = timestamp
+        else:
+            text_tokens.append(token)
+    if text_tokens:
+        flush(duration)
+    return segments
+
+
+def _suppressed_tokens(tokenizer: Any) -> List[int]:
+    """
+    展開 transcribe 預設的 suppress_tokens=[-1] (與 faster-whisper 的 get_suppressed_tokens 相同)：
+    非語音符號 token 加上任務與 sot 相關的特殊 token。直接呼叫 CTranslate2 的 generate 時需自行展開。
+    """
+    special = [tokenizer.transcribe, tokenizer.translate, tokenizer.sot, tokenizer.sot_prev, tokenizer.sot_lm]
+    return sorted(set(tokenizer.non_speech_tokens) | set(special))
+
+
+def decode_batch(model: Any, audios: Sequence[Any], beam_size: int) -> List[Tuple[Segments, float]]:
+    """
+    以一次編碼器與一次解碼器呼叫轉錄多段音訊，回傳每段的 (segments, 音訊秒數)。
+
+    faster-whisper 0.11 的 transcribe 一次只處理一段音訊，這裡直接使用其底層的 CTranslate2 模型：
+    每段音訊補齊為一個 30 秒視窗後疊成一個批次，語言各自偵測，以時間戳 token 切分 segment。
+    超過 30 秒的音訊需要逐窗解碼，呼叫方應在排入批次前改走一般的 transcribe，傳入時拋出 ValueError。
+    與 transcribe 不同，批次解碼不做溫度回退 (temperature fallback)。
+    """
+    import ctranslate2
+    from faster_whisper.tokenizer import Tokenizer
+
+    extractor = model.feature_extractor
+    waveforms = [load_audio(audio, extractor.sampling_rate) for audio in audios]
+    if any(len(waveform) > extractor.n_samples for waveform in waveforms):
+        raise ValueError("批次解碼不支援超過 30 秒的音訊。")
+    results: List[Tuple[Segments, float]] = [([], len(waveform) / extractor.sampling_rate) for waveform in waveforms]
+    if not waveforms:
+        return results
+
+    # feature extractor 預設在音訊後補 30 秒靜音，取前 nb_max_frames 幀即為補齊後的 30 秒視窗
+    features = np.stack([extractor(waveform)[:, :extractor.nb_max_frames] for waveform in waveforms]).astype(np.float32)
+    encoder_output = model.model.encode(ctranslate2.StorageView.from_array(np.ascontiguousarray(features)))
+
+    tokenizers = []
+    if model.model.is_multilingual:
+        for candidates in model.model.detect_language(encoder_output):
+            language = candidates[0][0][2:-2] # "<|zh|>" -> "zh"
+            tokenizers.append(Tokenizer(model.hf_tokenizer, True, task="transcribe", language=language))
+    else:
+        tokenizers = [Tokenizer(model.hf_tokenizer, False, task="transcribe", language="en")] * len(waveforms)
+
+    # 非語音符號與特殊 token 只取決於詞表，與語言無關，整個批次共用一份
+    outputs = model.model.generate(
+        encoder_output,
+        [list(tokenizer.sot_sequence) for tokenizer in tokenizers],
+        beam_size=beam_size,
+        max_length=MAX_LENGTH,
+        return_scores=True,
+        return_no_speech_prob=True,
+        suppress_blank=True,
+        suppress_tokens=_suppressed_tokens(tokenizers[0]),
+    )
+    for i, (tokenizer, output) in enumerate(zip(tokenizers, outputs)):
+        tokens = output.sequences_ids[0]
+        avg_logprob = output.scores[0] * len(tokens) / (len(tokens) + 1)
+        if output.no_speech_prob > NO_SPEECH_THRESHOLD and avg_logprob < LOG_PROB_THRESHOLD:
+            continue
+        results[i] = (_parse_segments(tokens, tokenizer, results[i][1]), results[i][1])
+    return results
@@ -0,0 +1,221 @@
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import fcntl
+import io
+import json
+import os
+import logging
+import time
+
+import numpy as np
+
+from .transcription_service import (
+    AudioInput, TranscriptionExecutor, TranscriptionQueueFullError, TranscriptionUnavailableError
+)
+
+logger = logging.getLogger(__name__)
+
+# 多個 uvicorn worker 共用一個 Whisper 模型：以檔案鎖選出一個 worker 載入模型並在 unix socket 上提供轉錄，
+# 其餘 worker 不載入模型，只把音訊轉送給它，因此記憶體中只有一份模型，轉錄佇列上限也變成全服務共用
+WHISPER_SHARED = os.getenv("WHISPER_SHARED", "false").lower() == "true"
+WHISPER_SHARED_SOCKET = os.getenv("WHISPER_SHARED_SOCKET", "./data/whisper.sock")
+WHISPER_SHARED_WAIT_SECONDS = float(os.getenv("WHISPER_SHARED_WAIT_SECONDS", 600)) # 等待持有模型的 worker 載入完成的上限
+
+_STREAM_LIMIT = 1024 * 1024 # 單一 segment 訊息的長度上限
+
+
+def _encode_audio(audio: AudioInput) -> Tuple[str, bytes]:
+    """numpy 音訊以 float32 原始資料傳送，檔案類物件傳送其內容 (由持有模型的一方以 ffmpeg 解碼)."""
+    if isinstance(audio, np.ndarray):
+        return "pcm_f32", np.ascontiguousarray(audio, dtype=np.float32).tobytes()
+    if isinstance(audio, io.BytesIO):
+        return "bytes", audio.getvalue()
+    return "bytes", audio.read()
+
+
+def _decode_audio(audio_format: str, payload: bytes) -> AudioInput:
+    if audio_format == "pcm_f32":
+        return np.frombuffer(payload, dtype=np.float32)
+    return io.BytesIO(payload)
+
+
+class RemoteTranscriptionClient:
+    """
+    把轉錄請求轉送給持有模型的 worker；每個請求一條 unix socket 連線，segment 逐行以 JSON 回傳。
+    連線失敗 (擁有者已結束) 時先呼叫 failover 重新連線或接手模型，再重試一次。
+    """
+
+    def __init__(self, socket_path: str = WHISPER_SHARED_SOCKET, failover: Optional[Callable[[], Awaitable[None]]] = None):
+        self.socket_path = socket_path
+        self._failover = failover
+
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        try:
+            return await asyncio.open_unix_connection(self.socket_path, limit=_STREAM_LIMIT)
+        except OSError as e:
+            if self._failover is None:
+                raise TranscriptionUnavailableError(f"無法連線到共用的 Whisper 模型: {e}")
+        await self._failover()
+        try:
+            return await asyncio.open_unix_connection(self.socket_path, limit=_STREAM_LIMIT)
+        except OSError as e:
+            raise TranscriptionUnavailableError(f"無法連線到共用的 Whisper 模型: {e}")
+
+    async def transcribe_segments(self, audio: AudioInput, **options: Any) -> List[Dict[str, Any]]:
+        """一次取得所有 segment；擁有者以 transcribe_segments 處理，因此不帶選項的請求會加入其微批次."""
+        return [segment async for segment in self.stream(audio, _mode="segments", **options)]
+
+    async def stream(self, audio: AudioInput, _mode: str = "stream", **options: Any) -> AsyncIterator[Dict[str, Any]]:
+        audio_format, payload = _encode_audio(audio)
+        reader, writer = await self._connect()
+        try:
+            header = {"format": audio_format, "size": len(payload), "mode": _mode, "options": options}
+            writer.write(json.dumps(header).encode("utf-8") + b"\n")
+            writer.write(payload)
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise TranscriptionUnavailableError("與共用 Whisper 模型的連線中斷。")
+                message = json.loads(line)
+                event = message.pop("event")
+                if event == "segment":
+                    yield message
+                elif event == "done":
+                    return
+                elif message.get("code") == "queue_full":
+                    raise TranscriptionQueueFullError(message["queue_depth"], message["max_queue"])
+                elif message.get("code") == "unavailable":
+                    raise TranscriptionUnavailableError(message["detail"])
+                else:
+                    raise RuntimeError(message["detail"])
+        finally:
+            writer.close()
+
+
+class WhisperModelShare:
+    """
+    以檔案鎖協調多個 worker 共用一個 Whisper 模型。
+
+    取得鎖的 worker 成為擁有者：載入模型並在 unix socket 上提供轉錄，轉錄仍由它的工作池執行，
+    因此 WHISPER_WORKERS 與 WHISPER_MAX_QUEUE 是整個服務的上限。其他 worker 等到 socket 可連線後，
+    把執行器切換為轉送模式。鎖隨程序結束釋放；等待中的 worker 發現鎖被釋放時會接手成為擁有者，
+    已切換為轉送模式的 worker 則在連線失敗時重新競爭鎖：取得者載入模型成為新的擁有者，其餘連上新的擁有者。
+    """
+
+    def __init__(self, executor: TranscriptionExecutor, socket_path: str = WHISPER_SHARED_SOCKET,
+                 wait_seconds: float = WHISPER_SHARED_WAIT_SECONDS):
+        self._executor = executor
+        self.socket_path = socket_path
+        self.lock_path = socket_path + ".lock"
+        self.wait_seconds = wait_seconds
+        self.role: Optional[str] = None # owner | client
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._failover_lock = asyncio.Lock()
+
+    def _try_lock(self) -> bool:
+        os.makedirs(os.path.dirname(os.path.abspath(self.lock_path)), exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _owner_ready(self) -> bool:
+        try:
+            _, writer = await asyncio.open_unix_connection(self.socket_path)
+        except OSError:
+            return False
+        writer.close()
+        return True
+
+    async def load(self) -> None:
+        """載入 (擁有者) 或連上 (其他 worker) 共用模型，作為 model_registry 的 whisper 載入函式."""
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            if self._try_lock():
+                await self._serve()
+                return
+            if await self._owner_ready():
+                self.role = "client"
+                self._executor.attach_remote(RemoteTranscriptionClient(self.socket_path, failover=self.failover))
+                logger.info(f"使用其他 worker 持有的 Whisper 模型 ({self.socket_path})。")
+                return
+            if time.monotonic() > deadline:
+                raise TranscriptionUnavailableError(f"等待共用的 Whisper 模型超過 {self.wait_seconds:.0f} 秒。")
+            await asyncio.sleep(0.5)
+
+    async def failover(self) -> None:
+        """轉送模式下連線失敗時呼叫：擁有者仍可連線就不處理，否則重新選出擁有者 (可能是本 worker)."""
+        async with self._failover_lock: # 同時失敗的多個請求只處理一次
+            if self.role == "owner" or await self._owner_ready():
+                return
+            logger.warning("持有 Whisper 模型的 worker 已無法連線，重新連線或接手模型。")
+            await self.load()
+
+    async def _serve(self) -> None:
+        try:
+            await self._executor.load()
+        except BaseException:
+            os.close(self._lock_fd) # 載入失敗時釋放鎖，讓其他 worker 有機會接手
+            self._lock_fd = None
+            raise
+        self.role = "owner"
+        self._executor.attach_remote(None) # 接手前的轉送客戶端不再使用
+        if os.path.exists(self.socket_path): # 前一個擁有者遺留的 socket (持有鎖即代表它已結束)
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.socket_path, limit=_STREAM_LIMIT)
+        logger.info(f"此 worker 持有 Whisper 模型，在 {self.socket_path} 為其他 worker 提供轉錄。")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        def send(message: Dict[str, Any]) -> None:
+            writer.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+
+        try:
+            line = await reader.readline()
+            if not line: # 連線檢查
+                return
+            header = json.loads(line)
+            audio = _decode_audio(header["format"], await reader.readexactly(header["size"]))
+            options = header.get("options", {})
+            try:
+                if header.get("mode") == "segments":
+                    # 與本地請求走相同路徑，不帶選項的請求加入微批次
+                    for segment in await self._executor.transcribe_segments(audio, **options):
+                        send({"event": "segment", **segment})
+                else:
+                    async with aclosing(self._executor.stream(audio, **options)) as segments:
+                        async for segment in segments:
+                            send({"event": "segment", **segment})
+                            await writer.drain()
+                send({"event": "done"})
+            except (ConnectionError, asyncio.IncompleteReadError):
+                raise
+            except TranscriptionQueueFullError as e:
+                send({"event": "error", "code": "queue_full", "queue_depth": e.queue_depth, "max_queue": e.max_queue})
+            except TranscriptionUnavailableError as e:
+                send({"event": "error", "code": "unavailable", "detail": str(e)})
+            except Exception as e:
+                logger.error(f"為其他 worker 轉錄失敗: {e}", exc_info=True)
+                send({"event": "error", "code": "failed", "detail": str(e)})
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass # 轉送的一方已斷線，stream 迭代器關閉時會停止解碼
+        finally:
+            writer.close()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
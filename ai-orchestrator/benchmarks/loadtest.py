@@ -0,0 +1,477 @@
+"""
+orchestrator 端點的離線負載測試。
+
+以子程序啟動假的 OpenAI 伺服器與 orchestrator (Whisper 替身 + 記憶體中的 Qdrant，見 standins.py)，
+以設定的並發數對各端點送出請求，輸出每個情境的 RPS、p50/p95/p99 延遲與 orchestrator 的 RSS (JSON)。
+
+用法 (於 ai-orchestrator 目錄下執行)：
+    python benchmarks/loadtest.py --concurrency 8 --requests 200 --output loadtest.json
+    python benchmarks/loadtest.py --scenarios search,respond --baseline loadtest_main.json --max-regression 0.2
+
+情境：
+    upload          POST /documents/upload，另記錄任務完成的端到端延遲 (job_latency_ms)
+    search          GET /documents/search
+    transcribe      POST /voice/transcribe (WAV，長度由 --audio-seconds 決定)
+    respond         POST /voice/respond
+    respond_stream  POST /voice/respond/stream，另記錄首個 token 的延遲 (ttft_ms)
+
+--whisper-batch-size 大於 1 時，transcribe 情境另外記錄由 /metrics 取得的平均批次大小與批次等待時間。
+
+server.cold_start 記錄自啟動 orchestrator 子程序起，/health/live 與 /health/ready 回應成功、
+以及第一個搜尋與轉錄請求成功的秒數 (這兩個請求在存活後立即送出，會等待所需的元件載入)。
+
+--baseline 指定先前的結果時，會比較每個情境的 RPS 與 p95，退步超過 --max-regression 時以非零狀態結束。
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import httpx
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ORCHESTRATOR_ROOT = os.path.dirname(BENCHMARK_DIR)
+SCENARIOS = ["upload", "search", "transcribe", "respond", "respond_stream"]
+TOPICS = ["請假", "報銷", "採購", "出差", "資安", "招募", "績效", "加班", "設備", "合約"]
+
+RequestFn = Callable[[httpx.AsyncClient, int], Awaitable[Dict[str, float]]]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def read_rss_mb(pid: int) -> Dict[str, Optional[float]]:
+    """由 /proc 讀取目前 RSS 與峰值 RSS (VmHWM)；非 Linux 環境回傳 None."""
+    values: Dict[str, Optional[float]] = {"rss_mb": None, "peak_rss_mb": None}
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    values["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith("VmHWM:"):
+                    values["peak_rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return values
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    values = np.asarray(samples) * 1000
+    return {
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p95": round(float(np.percentile(values, 95)), 2),
+        "p99": round(float(np.percentile(values, 99)), 2),
+        "mean": round(float(values.mean()), 2),
+        "max": round(float(values.max()), 2),
+    }
+
+
+def make_document(path: str, index: int, kilobytes: int) -> None:
+    """產生主題可辨識的中文測試文件."""
+    rng = random.Random(index)
+    topic = TOPICS[index % len(TOPICS)]
+    paragraphs, size = [], 0
+    while size < kilobytes * 1024:
+        paragraph = f"{topic}規定第 {len(paragraphs) + 1} 條：" + "".join(rng.choice(["申請人應於", "三個工作天內", "提交", "主管核准後", "由人資部門", "系統自動", "歸檔", "通知財務"]) for _ in range(30)) + "。"
+        paragraphs.append(paragraph)
+        size += len(paragraph.encode("utf-8"))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(paragraphs))
+
+
+def make_wav(seconds: float, seed: int = 0) -> bytes:
+    """16kHz 單聲道 PCM16 的測試音訊 (低音量雜訊，沒有可由 VAD 移除的靜音)."""
+    samples = (np.random.default_rng(seed).standard_normal(int(seconds * 16000)) * 500).astype(np.int16)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+class Stack:
+    """以子程序啟動的假 OpenAI 伺服器與 orchestrator."""
+
+    def __init__(self, args: argparse.Namespace, workdir: str):
+        self.args = args
+        self.workdir = workdir
+        self.openai_port = free_port()
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.processes: List[subprocess.Popen] = []
+        self.orchestrator: Optional[subprocess.Popen] = None
+        self.startup_seconds = 0.0
+        self.cold_start: Dict[str, float] = {}
+
+    def _spawn(self, command: List[str], env: Dict[str, str]) -> subprocess.Popen:
+        log = open(os.path.join(self.workdir, f"{command[0]}.log"), "ab")
+        process = subprocess.Popen([sys.executable, os.path.join(BENCHMARK_DIR, "standins.py"), *command],
+                                   cwd=self.workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(process)
+        return process
+
+    async def _wait_ready(self, url: str, process: subprocess.Popen, timeout: float = 120) -> None:
+        started = time.monotonic()
+        async with httpx.AsyncClient() as client:
+            while time.monotonic() - started < timeout:
+                if process.poll() is not None:
+                    raise RuntimeError(f"子程序已結束 (exit {process.returncode})，詳見 {self.workdir} 下的日誌")
+                try:
+                    if (await client.get(url, timeout=2)).status_code < 500:
+                        return
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise TimeoutError(f"{url} 在 {timeout} 秒內未就緒")
+
+    async def _first_success(self, started: float, send: Callable[[httpx.AsyncClient], Awaitable[httpx.Response]], timeout: float = 300) -> float:
+        """重試直到請求成功，回傳自 started 起的秒數."""
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=timeout) as client:
+            while time.monotonic() - started < timeout:
+                try:
+                    if (await send(client)).status_code == 200:
+                        return time.monotonic() - started
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise TimeoutError(f"{timeout} 秒內沒有成功的請求")
+
+    async def _measure_cold_start(self, started: float) -> None:
+        await self._wait_ready(self.base_url + "/health/live", self.orchestrator)
+        self.cold_start["live_seconds"] = time.monotonic() - started
+        audio = make_wav(1.0)
+
+        async def ready() -> float:
+            await self._wait_ready(self.base_url + "/health/ready", self.orchestrator, timeout=300)
+            return time.monotonic() - started
+
+        ready_seconds, search_seconds, transcribe_seconds = await asyncio.gather(
+            ready(),
+            self._first_success(started, lambda client: client.get("/documents/search", params={"query": "冷啟動"})),
+            self._first_success(started, lambda client: client.post("/voice/transcribe", files={"audio_file": ("cold.wav", audio, "audio/wav")})),
+        )
+        self.cold_start.update(ready_seconds=ready_seconds, first_search_seconds=search_seconds, first_transcription_seconds=transcribe_seconds)
+        self.startup_seconds = ready_seconds
+
+    async def start(self) -> None:
+        args = self.args
+        env = dict(os.environ)
+        fake = self._spawn(["fake-openai", "--port", str(self.openai_port), "--latency-ms", str(args.llm_latency_ms),
+                            "--token-delay-ms", str(args.token_delay_ms), "--completion-tokens", str(args.completion_tokens),
+                            "--embedding-latency-ms", str(args.embedding_latency_ms)], env)
+        await self._wait_ready(f"http://127.0.0.1:{self.openai_port}/stats", fake)
+
+        openai_url = f"http://127.0.0.1:{self.openai_port}/v1"
+        env.update({
+            "OPENAI_API_KEY": "sk-loadtest",
+            "OPENAI_BASE_URL": openai_url, # openai 客戶端
+            "OPENAI_API_BASE": openai_url, # LangChain
+            "EMBEDDING_BACKEND": args.embedding_backend,
+            "MODEL_LOAD_MODE": args.model_load_mode,
+            "WHISPER_BATCH_SIZE": str(args.whisper_batch_size),
+            "WHISPER_BATCH_WINDOW_MS": str(args.whisper_batch_window_ms),
+            "PYTHONUNBUFFERED": "1",
+        })
+        if args.no_caches:
+            env.update({"EMBEDDING_CACHE_ENABLED": "false", "SEARCH_CACHE_ENABLED": "false", "SUMMARY_CACHE_ENABLED": "false", "TRANSCRIPT_CACHE_ENABLED": "false"})
+        started = time.monotonic()
+        self.orchestrator = self._spawn(["orchestrator", "--port", str(self.port), "--whisper", args.whisper,
+                                         "--whisper-rtf", str(args.whisper_rtf), "--whisper-load-seconds", str(args.whisper_load_seconds),
+                                         "--qdrant", args.qdrant], env)
+        await self._measure_cold_start(started)
+
+    def rss(self) -> Dict[str, Optional[float]]:
+        return read_rss_mb(self.orchestrator.pid) if self.orchestrator else {}
+
+    def stop(self) -> None:
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+async def run_load(name: str, request: RequestFn, total: int, concurrency: int, stack: Stack) -> Dict[str, Any]:
+    """以 concurrency 個 worker 送出 total 個請求；同時每 100ms 取樣 orchestrator 的 RSS."""
+    latencies: List[float] = []
+    extras: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    next_index = 0
+    rss_samples: List[float] = []
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        nonlocal next_index
+        while next_index < total:
+            index = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                metrics = await request(client, index)
+            except Exception as e:
+                key = getattr(getattr(e, "response", None), "status_code", None) or type(e).__name__
+                errors[str(key)] = errors.get(str(key), 0) + 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            for metric, value in metrics.items():
+                extras.setdefault(metric, []).append(value)
+
+    async def sample_rss() -> None:
+        while True:
+            rss = stack.rss().get("rss_mb")
+            if rss is not None:
+                rss_samples.append(rss)
+            await asyncio.sleep(0.1)
+
+    sampler = asyncio.create_task(sample_rss())
+    started = time.perf_counter()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=stack.base_url, timeout=300, limits=limits) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+
+    report: Dict[str, Any] = {
+        "requests": total,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "concurrency": concurrency,
+        "duration_seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": percentiles(latencies),
+        "max_rss_mb": max(rss_samples) if rss_samples else None,
+    }
+    for metric, values in extras.items():
+        report[f"{metric}_ms"] = percentiles(values)
+    print(f"{name}: {report['rps']} req/s, p50={report['latency_ms'].get('p50')}ms, p95={report['latency_ms'].get('p95')}ms, 錯誤 {sum(errors.values())}", file=sys.stderr)
+    return report
+
+
+def build_scenarios(args: argparse.Namespace, workdir: str) -> Dict[str, Tuple[RequestFn, int]]:
+    documents_dir = os.path.join(workdir, "documents")
+    os.makedirs(documents_dir, exist_ok=True)
+    upload_offset = 10_000 # 與預先索引的文件 ID 錯開
+
+    async def poll_job(client: httpx.AsyncClient, status_url: str) -> None:
+        while True:
+            job = (await client.get(status_url)).raise_for_status().json()
+            if job["status"] == "completed":
+                return
+            if job["status"] == "failed":
+                raise RuntimeError(f"任務失敗: {job['error']}")
+            await asyncio.sleep(0.05)
+
+    async def upload(client: httpx.AsyncClient, index: int) -> Dict[str, float]:
+        path = os.path.join(documents_dir, f"upload_{index}.txt")
+        make_document(path, index, args.document_kb)
+        started = time.perf_counter()
+        response = (await client.post("/documents/upload", json={"document_id": upload_offset + index, "file_path": path, "metadata": {"category": "policy", "uploaded_by": 1, "original_name": f"loadtest_{index}.txt"}})).raise_for_status()
+        accepted = time.perf_counter()
+        await poll_job(client, response.json()["status_url"])
+        return {"accept_latency": accepted - started, "job_latency": time.perf_counter() - started}
+
+    async def search(client: httpx.AsyncClient, index: int) -> Dict[str, float]:
+        query = f"{TOPICS[index % len(TOPICS)]}的申請流程是什麼？ ({index})" # 每個查詢不同，避免只量到搜尋快取
+        (await client.get("/documents/search", params={"query": query})).raise_for_status()
+        return {}
+
+    async def transcribe(client: httpx.AsyncClient, index: int) -> Dict[str, float]:
+        audio = make_wav(args.audio_seconds, seed=index) # 每段音訊內容不同，避免只量到轉錄快取
+        files = {"audio_file": (f"sample_{index}.wav", audio, "audio/wav")}
+        (await client.post("/voice/transcribe", files=files)).raise_for_status()
+        return {}
+
+    def respond_payload(index: int) -> Dict[str, Any]:
+        return {"user_id": f"user-{index % 50}", "prompt": f"{TOPICS[index % len(TOPICS)]}需要誰核准？ ({index})", "conversation_history": []}
+
+    async def respond(client: httpx.AsyncClient, index: int) -> Dict[str, float]:
+        (await client.post("/voice/respond", json=respond_payload(index))).raise_for_status()
+        return {}
+
+    async def respond_stream(client: httpx.AsyncClient, index: int) -> Dict[str, float]:
+        started = time.perf_counter()
+        first_token = None
+        async with client.stream("POST", "/voice/respond/stream", json=respond_payload(index)) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if first_token is None and line == "event: token":
+                    first_token = time.perf_counter() - started
+                if line == "event: error":
+                    raise RuntimeError("串流回應錯誤")
+        return {"ttft": first_token} if first_token is not None else {}
+
+    requests = {"upload": args.upload_requests or max(1, args.requests // 10), "transcribe": args.transcribe_requests or max(1, args.requests // 4)}
+    functions = {"upload": upload, "search": search, "transcribe": transcribe, "respond": respond, "respond_stream": respond_stream}
+    return {name: (functions[name], requests.get(name, args.requests)) for name in functions}
+
+
+async def seed_corpus(stack: Stack, workdir: str, count: int, kilobytes: int) -> float:
+    """以批次上傳預先索引文件，讓搜尋與問答情境有資料可檢索；回傳耗時."""
+    documents = []
+    os.makedirs(os.path.join(workdir, "documents"), exist_ok=True)
+    for index in range(count):
+        path = os.path.join(workdir, "documents", f"seed_{index}.txt")
+        make_document(path, index, kilobytes)
+        documents.append({"document_id": index + 1, "file_path": path, "metadata": {"category": "policy", "uploaded_by": 1, "original_name": f"seed_{index}.txt"}})
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=stack.base_url, timeout=600) as client:
+        response = (await client.post("/documents/upload-batch", json={"documents": documents})).raise_for_status()
+        while True:
+            job = (await client.get(response.json()["status_url"])).raise_for_status().json()
+            if job["status"] in ("completed", "failed"):
+                break
+            await asyncio.sleep(0.2)
+    if job["status"] != "completed":
+        raise RuntimeError(f"預先索引失敗: {job['error']}")
+    return time.perf_counter() - started
+
+
+async def whisper_batch_stats(stack: Stack) -> Dict[str, Optional[float]]:
+    """由 /metrics 計算 Whisper 的平均批次大小與平均批次等待時間 (含冷啟動量測與暖機的請求)."""
+    async with httpx.AsyncClient(base_url=stack.base_url, timeout=30) as client:
+        text = (await client.get("/metrics")).raise_for_status().text
+    values = {}
+    for line in text.splitlines():
+        name, _, value = line.partition(" ")
+        if name.startswith("ai_orchestrator_whisper_batch_") and name.endswith(("_sum", "_count")):
+            values[name[len("ai_orchestrator_whisper_batch_"):]] = float(value)
+    batches = values.get("size_count")
+    requests = values.get("wait_seconds_count")
+    return {
+        "batches": batches,
+        "avg_batch_size": round(values["size_sum"] / batches, 2) if batches else None,
+        "avg_wait_ms": round(values["wait_seconds_sum"] / requests * 1000, 2) if requests else None,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """比較每個情境的 RPS 與 p95 延遲，回傳超過門檻的退步項目."""
+    regressions = []
+    for name, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        if previous["rps"] and current["rps"] < previous["rps"] * (1 - max_regression):
+            regressions.append(f"{name}: RPS {previous['rps']} -> {current['rps']}")
+        before, after = previous["latency_ms"].get("p95"), current["latency_ms"].get("p95")
+        if before and after and after > before * (1 + max_regression):
+            regressions.append(f"{name}: p95 {before}ms -> {after}ms")
+    return regressions
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ORCHESTRATOR_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    scenarios = args.scenarios.split(",")
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"未知的情境: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory(prefix="orchestrator-loadtest-") as workdir:
+        stack = Stack(args, workdir)
+        try:
+            await stack.start()
+            idle = stack.rss()
+            seed_seconds = await seed_corpus(stack, workdir, args.seed_documents, args.document_kb) if args.seed_documents else 0.0
+            available = build_scenarios(args, workdir)
+            results = {}
+            for name in scenarios:
+                request, total = available[name]
+                results[name] = await run_load(name, request, total, args.concurrency, stack)
+            if "transcribe" in results and args.whisper_batch_size > 1:
+                results["transcribe"]["whisper_batching"] = await whisper_batch_stats(stack)
+            final = stack.rss()
+        finally:
+            stack.stop()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "cpu_count": os.cpu_count(),
+            "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        },
+        "server": {
+            "startup_seconds": round(stack.startup_seconds, 3),
+            "cold_start": {key: round(seconds, 3) for key, seconds in stack.cold_start.items()},
+            "idle_rss_mb": idle.get("rss_mb"),
+            "seed_seconds": round(seed_seconds, 3),
+            "final_rss_mb": final.get("rss_mb"),
+            "peak_rss_mb": final.get("peak_rss_mb"),
+        },
+        "scenarios": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="以逗號分隔，依序執行")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="search/respond 情境的請求數")
+    parser.add_argument("--upload-requests", type=int, default=0, help="upload 情境的請求數，0 表示 --requests / 10")
+    parser.add_argument("--transcribe-requests", type=int, default=0, help="transcribe 情境的請求數，0 表示 --requests / 4")
+    parser.add_argument("--seed-documents", type=int, default=20, help="測試前以批次上傳預先索引的文件數")
+    parser.add_argument("--document-kb", type=int, default=16, help="每份測試文件的大小 (KB)")
+    parser.add_argument("--audio-seconds", type=float, default=10.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="假 OpenAI 的首個 token 延遲")
+    parser.add_argument("--token-delay-ms", type=float, default=20, help="假 OpenAI 每個輸出 token 的延遲")
+    parser.add_argument("--completion-tokens", type=int, default=40)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50, help="假 OpenAI Embedding 請求的延遲 (--embedding-backend openai)")
+    parser.add_argument("--embedding-backend", default="hashing", choices=["hashing", "local", "openai"],
+                        help="openai 會送到假伺服器，但 LangChain 需要 tiktoken 的編碼檔 (離線時請預先設定 TIKTOKEN_CACHE_DIR)")
+    parser.add_argument("--whisper", choices=["stub", "model"], default="stub")
+    parser.add_argument("--whisper-rtf", type=float, default=0.1, help="Whisper 替身的解碼時間 / 音訊長度")
+    parser.add_argument("--whisper-load-seconds", type=float, default=0.0, help="Whisper 替身的模型載入時間 (模擬大型模型的冷啟動)")
+    parser.add_argument("--whisper-batch-size", type=int, default=1, help="orchestrator 的 WHISPER_BATCH_SIZE (1 為不批次)")
+    parser.add_argument("--whisper-batch-window-ms", type=float, default=20, help="orchestrator 的 WHISPER_BATCH_WINDOW_MS")
+    parser.add_argument("--model-load-mode", default="background", choices=["eager", "background", "lazy"], help="orchestrator 的 MODEL_LOAD_MODE")
+    parser.add_argument("--qdrant", default=":memory:", help="':memory:' 或 'server' (使用 QDRANT_HOST/QDRANT_PORT)")
+    parser.add_argument("--no-caches", action="store_true", help="停用 Embedding、搜尋、摘要與轉錄快取")
+    parser.add_argument("--output", help="JSON 結果的輸出檔案 (預設輸出到 stdout)")
+    parser.add_argument("--baseline", help="先前的結果 JSON，用於比較退步")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="允許的 RPS 下降 / p95 上升比例")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"效能退步: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+比較不同 collection 設定 (量化、磁碟儲存、HNSW 參數) 的召回率與搜尋延遲。
+
+對本地 Qdrant 為每組設定建立暫時的 collection，寫入相同的向量，
+以暴力搜尋的結果為基準計算 recall@k，並記錄逐筆查詢的 p50/p99 延遲，結果以 JSON 輸出。
+
+用法 (於 ai-orchestrator 目錄下執行)：
+    python benchmarks/qdrant_collection_settings.py --url http://localhost:6333 --points 50000 --dim 1536 \\
+        --settings baseline,scalar,scalar-disk,binary --ef 64,128 --output qdrant_settings.json
+
+--vectors 可指定 .npy 檔 (例如從正式 collection 匯出的 Embedding)，否則產生具叢集結構的合成向量。
+注意：向量數量太少時 Qdrant 不建立 HNSW 索引，這裡以 indexing_threshold 強制建立索引。
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.services.qdrant_settings import CollectionSettings, estimate_vector_memory # noqa: E402
+
+PRESETS: Dict[str, Dict[str, Any]] = {
+    "baseline": {},
+    "scalar": {"quantization": "scalar"},
+    "scalar-disk": {"quantization": "scalar", "vectors_on_disk": True},
+    "scalar-norescore": {"quantization": "scalar", "rescore": False},
+    "binary": {"quantization": "binary", "oversampling": 2.0},
+    "binary-disk": {"quantization": "binary", "oversampling": 3.0, "vectors_on_disk": True},
+    "hnsw-m32": {"hnsw_m": 32, "hnsw_ef_construct": 200},
+    "hnsw-m8": {"hnsw_m": 8, "hnsw_ef_construct": 64},
+}
+
+
+def make_vectors(points: int, queries: int, dim: int, clusters: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """產生具叢集結構的單位向量 (比均勻分佈更接近實際 Embedding 的分佈)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    def sample(n: int) -> np.ndarray:
+        vectors = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return sample(points), sample(queries)
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int, block: int = 256) -> np.ndarray:
+    """暴力 cosine 搜尋作為召回率基準 (向量已正規化)."""
+    results = []
+    for start in range(0, len(queries), block):
+        scores = queries[start:start + block] @ vectors.T
+        top = np.argpartition(-scores, k, axis=1)[:, :k]
+        order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+        results.append(np.take_along_axis(top, order, axis=1))
+    return np.vstack(results)
+
+
+def wait_until_indexed(client: QdrantClient, name: str, points: int, timeout: float) -> float:
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        info = client.get_collection(name)
+        if info.status == models.CollectionStatus.GREEN and (info.points_count or 0) >= points:
+            return time.perf_counter() - started
+        time.sleep(0.5)
+    raise TimeoutError(f"collection {name} 在 {timeout} 秒內未完成索引")
+
+
+def run_setting(client: QdrantClient, name: str, settings: CollectionSettings, vectors: np.ndarray, queries: np.ndarray,
+                truth: np.ndarray, k: int, ef_values: List[int], timeout: float, keep: bool) -> List[Dict[str, Any]]:
+    collection = f"bench_{name}"
+    client.recreate_collection(collection_name=collection, optimizers_config=models.OptimizersConfigDiff(indexing_threshold=1),
+                               **settings.create_kwargs(vectors.shape[1]))
+    started = time.perf_counter()
+    client.upload_collection(collection_name=collection, vectors=vectors, ids=range(len(vectors)), batch_size=256)
+    upload_seconds = time.perf_counter() - started
+    index_seconds = wait_until_indexed(client, collection, len(vectors), timeout)
+
+    reports = []
+    for ef in ef_values:
+        settings.search_hnsw_ef = ef
+        search_params = settings.search_params()
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            result = client.search(collection_name=collection, query_vector=query.tolist(), limit=k, search_params=search_params)
+            latencies.append(time.perf_counter() - started)
+            hits += len({point.id for point in result} & set(expected.tolist()))
+        reports.append({
+            "setting": name,
+            "search_hnsw_ef": ef or None,
+            "recall_at_k": round(hits / (k * len(queries)), 4),
+            "latency_ms": {
+                "p50": round(float(np.percentile(latencies, 50)) * 1000, 3),
+                "p99": round(float(np.percentile(latencies, 99)) * 1000, 3),
+                "mean": round(float(np.mean(latencies)) * 1000, 3),
+            },
+            "upload_seconds": round(upload_seconds, 2),
+            "index_seconds": round(index_seconds, 2),
+            "estimated_vector_memory": estimate_vector_memory(len(vectors), vectors.shape[1], settings),
+            "config": settings.describe(),
+        })
+        print(f"{name} (ef={ef or 'default'}): recall@{k}={reports[-1]['recall_at_k']}, p50={reports[-1]['latency_ms']['p50']}ms, p99={reports[-1]['latency_ms']['p99']}ms", file=sys.stderr)
+    if not keep:
+        client.delete_collection(collection)
+    return reports
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("QDRANT_URL", "http://localhost:6333"), help="Qdrant 位址；':memory:' 只適合驗證腳本 (本地模式不支援量化與 HNSW)")
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("--vectors", help="以 .npy 檔的向量取代合成向量 (最後 --queries 筆作為查詢)")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--settings", default="baseline,scalar,scalar-disk,binary", help=f"以逗號分隔的設定: {', '.join(PRESETS)}")
+    parser.add_argument("--ef", default="0", help="以逗號分隔的搜尋 ef，0 表示 Qdrant 預設值")
+    parser.add_argument("--timeout", type=float, default=600, help="等待索引完成的秒數上限")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="保留 benchmark collection")
+    parser.add_argument("--output", help="JSON 結果的輸出檔案 (預設輸出到 stdout)")
+    args = parser.parse_args(argv)
+
+    if args.vectors:
+        data = np.load(args.vectors).astype(np.float32)
+        data /= np.linalg.norm(data, axis=1, keepdims=True)
+        vectors, queries = data[:-args.queries], data[-args.queries:]
+    else:
+        vectors, queries = make_vectors(args.points, args.queries, args.dim, args.clusters, args.seed)
+    truth = exact_top_k(vectors, queries, args.k)
+
+    client = QdrantClient(location=args.url) if args.url == ":memory:" else QdrantClient(url=args.url, timeout=60)
+    ef_values = [int(ef) for ef in args.ef.split(",")]
+    results = []
+    for name in args.settings.split(","):
+        if name not in PRESETS:
+            parser.error(f"未知的設定: {name}")
+        results.extend(run_setting(client, name, CollectionSettings(**PRESETS[name]), vectors, queries, truth, args.k, ef_values, args.timeout, args.keep))
+
+    report = {"points": len(vectors), "dim": vectors.shape[1], "queries": len(queries), "k": args.k, "results": results}
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+負載測試用的本地替身，讓 orchestrator 在沒有網路與 GPU 的環境中完整運行：
+
+- fake-openai：相容 OpenAI 的 /v1/chat/completions (含串流) 與 /v1/embeddings，延遲可設定。
+- orchestrator：啟動 FastAPI 應用，Whisper 以依音訊長度 sleep 的替身取代 (或使用真正的 tiny 模型)，
+  Qdrant 使用記憶體中的本地模式 (或指定的 Qdrant 伺服器)。
+
+由 benchmarks/loadtest.py 以子程序啟動，也可以單獨執行：
+    python benchmarks/standins.py fake-openai --port 8900 --latency-ms 200 --token-delay-ms 20
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 python benchmarks/standins.py orchestrator --port 8901
+"""
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+import types
+import uuid
+import wave
+
+import numpy as np
+
+ORCHESTRATOR_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FAKE_WORDS = ["根據", "內部", "文件", "資料", "顯示", "流程", "需要", "主管", "核准", "系統", "會", "自動", "通知", "相關", "人員", "。"]
+
+
+# --- 假的 OpenAI API ---
+
+def _fake_embedding(text: str, dim: int) -> List[float]:
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def _completion_words(prompt: str, tokens: int) -> List[str]:
+    offset = len(prompt) % len(FAKE_WORDS)
+    return [FAKE_WORDS[(offset + i) % len(FAKE_WORDS)] for i in range(tokens)]
+
+
+def create_fake_openai_app(latency_ms: float = 200, token_delay_ms: float = 20, completion_tokens: int = 40,
+                           embedding_latency_ms: float = 50, embedding_dim: int = 1536):
+    """建立模擬 OpenAI 的 FastAPI 應用：回應內容固定，延遲 = 首個 token 延遲 + 每個 token 的延遲."""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    app = FastAPI(title="Fake OpenAI")
+    stats = {"chat_completions": 0, "embeddings": 0, "embedded_inputs": 0}
+
+    @app.get("/stats")
+    async def get_stats() -> Dict[str, int]:
+        return stats
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        stats["embeddings"] += 1
+        stats["embedded_inputs"] += len(inputs)
+        await asyncio.sleep(embedding_latency_ms / 1000)
+        dim = body.get("dimensions") or embedding_dim
+        data = [{"object": "embedding", "index": i, "embedding": _fake_embedding(json.dumps(item, ensure_ascii=False), dim)} for i, item in enumerate(inputs)]
+        return JSONResponse({"object": "list", "data": data, "model": body.get("model", "text-embedding-ada-002"),
+                             "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}})
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["chat_completions"] += 1
+        prompt = "".join(str(message.get("content", "")) for message in body.get("messages", []))
+        words = _completion_words(prompt, completion_tokens)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = body.get("model", "gpt-3.5-turbo")
+        usage = {"prompt_tokens": len(prompt) // 2, "completion_tokens": len(words), "total_tokens": len(prompt) // 2 + len(words)}
+
+        if not body.get("stream"):
+            await asyncio.sleep((latency_ms + token_delay_ms * len(words)) / 1000)
+            return JSONResponse({
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        async def stream() -> AsyncIterator[str]:
+            def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+                payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                           "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+                return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+            await asyncio.sleep(latency_ms / 1000)
+            yield chunk({"role": "assistant", "content": ""})
+            for word in words:
+                yield chunk({"content": word})
+                await asyncio.sleep(token_delay_ms / 1000)
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+# --- Whisper 替身 ---
+
+def _audio_seconds(audio: Any) -> float:
+    """估計音訊長度：numpy 陣列以 16kHz 取樣計，WAV 讀取標頭，其他格式以 16kHz PCM16 的位元組數估計."""
+    if isinstance(audio, np.ndarray):
+        return len(audio) / 16000
+    if isinstance(audio, io.BytesIO):
+        data = audio.getvalue()
+    elif isinstance(audio, str):
+        with open(audio, "rb") as f:
+            data = f.read()
+    else:
+        data = bytes(audio)
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError):
+        return len(data) / 32000
+
+
+class StubWhisperModel:
+    """
+    與 faster_whisper.WhisperModel 介面相同的替身：每段音訊依 rtf (解碼時間 / 音訊長度) sleep，
+    佔用工作執行緒的方式與真正的解碼相同，每 5 秒音訊產生一個 segment。
+    """
+
+    rtf = float(os.getenv("WHISPER_STUB_RTF", 0.1))
+    load_seconds = float(os.getenv("WHISPER_STUB_LOAD_SECONDS", 0)) # 模擬模型載入時間，用於量測冷啟動
+    batch_overhead = float(os.getenv("WHISPER_STUB_BATCH_OVERHEAD", 0.25)) # 批次中每多一段音訊增加的解碼時間比例
+
+    def __init__(self, model_size_or_path: str, **kwargs: Any):
+        self.model_size_or_path = model_size_or_path
+        time.sleep(self.load_seconds)
+
+    def transcribe(self, audio: Any, **options: Any) -> Tuple[Iterator[SimpleNamespace], SimpleNamespace]:
+        duration = _audio_seconds(audio)
+        info = SimpleNamespace(language="zh", language_probability=1.0, duration=duration)
+
+        def segments() -> Iterator[SimpleNamespace]:
+            start = 0.0
+            while start < duration:
+                end = min(duration, start + 5.0)
+                time.sleep((end - start) * self.rtf)
+                yield SimpleNamespace(start=start, end=end, text=f"測試語音第 {int(start // 5) + 1} 段")
+                start = end
+
+        return segments(), info
+
+
+def stub_decode_batch(model: StubWhisperModel, audios: List[Any], beam_size: int) -> List[Tuple[List[Dict[str, Any]], float]]:
+    """
+    whisper_batching.decode_batch 的替身：一批的耗時為最長一段的解碼時間，每多一段再加 batch_overhead 倍，
+    模擬批次編碼共用矩陣運算、但解碼步數隨批次變長的成本。
+    """
+    durations = [_audio_seconds(audio) for audio in audios]
+    time.sleep(max(durations) * model.rtf * (1 + model.batch_overhead * (len(audios) - 1)))
+    return [([{"start": 0.0, "end": round(duration, 2), "text": "測試語音第 1 段"}], duration) for duration in durations]
+
+
+def stub_decode_audio(input_file: Any, sampling_rate: int = 16000) -> np.ndarray:
+    """faster_whisper.decode_audio 的替身：讀取 WAV (需為 sampling_rate 單聲道 PCM16)，其他格式視為原始 PCM16."""
+    data = input_file.read() if hasattr(input_file, "read") else open(input_file, "rb").read()
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            data = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        pass
+    return np.frombuffer(data[:len(data) // 2 * 2], dtype="<i2").astype(np.float32) / 32768.0
+
+
+def install_whisper_stub(rtf: float, load_seconds: float = 0.0) -> None:
+    """在匯入 app 之前以替身取代 faster_whisper 模組."""
+    StubWhisperModel.rtf = rtf
+    StubWhisperModel.load_seconds = load_seconds
+    module = types.ModuleType("faster_whisper")
+    module.WhisperModel = StubWhisperModel
+    module.decode_audio = stub_decode_audio
+    sys.modules["faster_whisper"] = module
+
+
+# --- 啟動 ---
+
+def run_orchestrator(port: int, whisper: str, whisper_rtf: float, qdrant: str, whisper_load_seconds: float = 0.0) -> None:
+    import uvicorn
+
+    if whisper == "stub":
+        install_whisper_stub(whisper_rtf, whisper_load_seconds)
+    sys.path.insert(0, ORCHESTRATOR_ROOT)
+    from app.main import app
+    if whisper == "stub":
+        from app.services import whisper_batching
+        whisper_batching.decode_batch = stub_decode_batch
+    if qdrant == ":memory:":
+        from qdrant_client import AsyncQdrantClient
+        from app.services import document_service
+        document_service.client = AsyncQdrantClient(location=":memory:")
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fake = commands.add_parser("fake-openai")
+    fake.add_argument("--port", type=int, default=8900)
+    fake.add_argument("--latency-ms", type=float, default=200, help="chat completion 的首個 token 延遲")
+    fake.add_argument("--token-delay-ms", type=float, default=20, help="每個輸出 token 的延遲")
+    fake.add_argument("--completion-tokens", type=int, default=40)
+    fake.add_argument("--embedding-latency-ms", type=float, default=50)
+    fake.add_argument("--embedding-dim", type=int, default=1536)
+
+    orchestrator = commands.add_parser("orchestrator")
+    orchestrator.add_argument("--port", type=int, default=8901)
+    orchestrator.add_argument("--whisper", choices=["stub", "model"], default="stub", help="model 使用 WHISPER_MODEL 指定的真正模型 (需要 faster-whisper 與已下載的模型)")
+    orchestrator.add_argument("--whisper-rtf", type=float, default=0.1, help="Whisper 替身的解碼時間 / 音訊長度")
+    orchestrator.add_argument("--whisper-load-seconds", type=float, default=0.0, help="Whisper 替身的模型載入時間")
+    orchestrator.add_argument("--qdrant", default=":memory:", help="':memory:' 使用本地模式，'server' 使用 QDRANT_HOST/QDRANT_PORT")
+
+    args = parser.parse_args(argv)
+    if args.command == "fake-openai":
+        import uvicorn
+        app = create_fake_openai_app(args.latency_ms, args.token_delay_ms, args.completion_tokens, args.embedding_latency_ms, args.embedding_dim)
+        uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+    else:
+        run_orchestrator(args.port, args.whisper, args.whisper_rtf, args.qdrant, args.whisper_load_seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+比較 VAD 移除靜音前後的 Whisper 即時率 (RTF = 處理時間 / 原始音訊長度，越小越快)。
+
+每段音訊只解碼一次，分別以完整音訊與移除靜音後的音訊轉錄；trimmed 的處理時間包含 VAD 本身。
+預設使用 Whisper 替身 (依音訊長度 sleep，見 standins.py) 與合成音訊 (語音般的調變雜訊，前後與中間夾有靜音)，
+--whisper model 使用 WHISPER_MODEL 指定的真正模型，此時請以 --audio 提供實際錄音 (可用 --pad-seconds 在前後補靜音)。
+
+用法 (於 ai-orchestrator 目錄下執行)：
+    python benchmarks/transcription_rtf.py --clips 20 --silence-ratio 0.4 --output rtf.json
+    python benchmarks/transcription_rtf.py --whisper model --audio sample1.wav sample2.webm --pad-seconds 2
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+SAMPLE_RATE = 16000
+
+
+def make_clip(rng: np.random.Generator, speech_seconds: float, silence_ratio: float) -> np.ndarray:
+    """合成一段音訊：約 4Hz 音節調變的雜訊 (-20 dBFS) 切成數句，句子之間與前後夾著 -60 dBFS 的底噪."""
+    total_seconds = speech_seconds / (1 - silence_ratio)
+    sentences = max(1, int(speech_seconds // 3))
+    gaps = rng.dirichlet(np.ones(sentences + 1)) * (total_seconds - speech_seconds) # 開頭、句間與結尾的靜音
+    parts = []
+    for i in range(sentences + 1):
+        parts.append(rng.standard_normal(int(gaps[i] * SAMPLE_RATE)) * 0.001)
+        if i < sentences:
+            n = int(speech_seconds / sentences * SAMPLE_RATE)
+            envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 4 * np.arange(n) / SAMPLE_RATE + rng.uniform(0, np.pi))
+            parts.append(rng.standard_normal(n) * 0.1 * envelope)
+    return np.concatenate(parts).astype(np.float32)
+
+
+def load_clips(args: argparse.Namespace) -> List[Tuple[str, np.ndarray]]:
+    if not args.audio:
+        rng = np.random.default_rng(args.seed)
+        return [(f"synthetic_{i}", make_clip(rng, args.speech_seconds, args.silence_ratio)) for i in range(args.clips)]
+    from faster_whisper import decode_audio
+    pad = np.zeros(int(args.pad_seconds * SAMPLE_RATE), dtype=np.float32)
+    return [(os.path.basename(path), np.concatenate([pad, decode_audio(path, sampling_rate=SAMPLE_RATE), pad])) for path in args.audio]
+
+
+async def measure(executor: Any, clips: List[Tuple[str, np.ndarray]], repeats: int) -> Dict[str, Any]:
+    from app.services.audio_intake import trim_silence
+
+    rows = []
+    for name, samples in clips:
+        seconds = len(samples) / SAMPLE_RATE
+        full_times, trimmed_times, vad_times = [], [], []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            full = await executor.transcribe_segments(samples)
+            full_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            audio = trim_silence(samples)
+            vad_times.append(time.perf_counter() - started)
+            trimmed = [audio.restore(segment) for segment in await executor.transcribe_segments(audio.samples)] if len(audio.samples) else []
+            trimmed_times.append(time.perf_counter() - started)
+        rows.append({
+            "clip": name,
+            "audio_seconds": round(seconds, 2),
+            "trimmed_seconds": round(audio.seconds, 2),
+            "rtf_full": round(min(full_times) / seconds, 4),
+            "rtf_trimmed": round(min(trimmed_times) / seconds, 4),
+            "vad_ms": round(min(vad_times) * 1000, 2),
+            "same_text": " ".join(s["text"] for s in full).strip() == " ".join(s["text"] for s in trimmed).strip(),
+        })
+
+    audio_seconds = sum(row["audio_seconds"] for row in rows)
+    def weighted(key: str) -> float:
+        return round(sum(row[key] * row["audio_seconds"] for row in rows) / audio_seconds, 4)
+
+    return {
+        "clips": len(rows),
+        "audio_seconds": round(audio_seconds, 2),
+        "trimmed_seconds": round(sum(row["trimmed_seconds"] for row in rows), 2),
+        "rtf_full": weighted("rtf_full"),
+        "rtf_trimmed": weighted("rtf_trimmed"),
+        "vad_ms_per_clip": round(sum(row["vad_ms"] for row in rows) / len(rows), 2),
+        "same_text_ratio": round(sum(row["same_text"] for row in rows) / len(rows), 3),
+        "per_clip": rows,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--whisper", choices=["stub", "model"], default="stub", help="model 使用 WHISPER_MODEL 指定的真正模型")
+    parser.add_argument("--whisper-rtf", type=float, default=0.1, help="Whisper 替身的解碼時間 / 音訊長度")
+    parser.add_argument("--audio", nargs="*", help="以實際錄音取代合成音訊")
+    parser.add_argument("--pad-seconds", type=float, default=0.0, help="在 --audio 的前後各補上的靜音秒數")
+    parser.add_argument("--clips", type=int, default=10, help="合成音訊的段數")
+    parser.add_argument("--speech-seconds", type=float, default=6.0, help="每段合成音訊中的語音秒數")
+    parser.add_argument("--silence-ratio", type=float, default=0.4, help="每段合成音訊中靜音所佔的比例")
+    parser.add_argument("--repeats", type=int, default=1, help="每段音訊的重複次數，取最快的一次")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON 結果的輸出檔案 (預設輸出到 stdout)")
+    args = parser.parse_args(argv)
+
+    if args.whisper == "stub":
+        from standins import install_whisper_stub
+        install_whisper_stub(args.whisper_rtf)
+    from app.services.transcription_service import TranscriptionExecutor
+
+    executor = TranscriptionExecutor(workers=1, max_queue=0, batch_size=1)
+    executor.load_model()
+    if executor.model is None:
+        raise SystemExit("Whisper 模型載入失敗。")
+    try:
+        report = {"whisper": args.whisper, **asyncio.run(measure(executor, load_clips(args), args.repeats))}
+    finally:
+        executor.shutdown()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    return report
+
+
+if __name__ == "__main__":
+    main()
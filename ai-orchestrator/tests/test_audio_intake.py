@@ -0,0 +1,63 @@
+import io
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from ..app.services.audio_intake import PreparedAudio, SAMPLE_RATE, speech_regions, transcribe_file, trim_silence
+from ..app.services.cache_utils import LRUCache
+import numpy as np
+
+# --- Mock 設置 ---
+
+def _clip(*parts):
+    """依 (秒數, 是否為語音) 組出音訊：語音為 -20 dBFS 雜訊，靜音為 -70 dBFS 底噪."""
+    rng = np.random.default_rng(0)
+    return np.concatenate([
+        rng.standard_normal(int(seconds * SAMPLE_RATE)).astype(np.float32) * (0.1 if speech else 0.0003)
+        for seconds, speech in parts
+    ])
+
+# --- 測試案例 ---
+
+def test_trim_silence_removes_long_silence_only():
+    """測試移除開頭、結尾與過長的中間靜音，短停頓保留，並保留每段語音前後的 pad."""
+    samples = _clip((2.0, False), (1.0, True), (0.3, False), (1.0, True), (2.0, False), (1.0, True), (1.5, False))
+
+    regions = speech_regions(samples, min_silence_ms=500, pad_ms=200)
+    audio = trim_silence(samples, min_silence_ms=500, pad_ms=200)
+
+    assert len(regions) == 2 # 0.3 秒的停頓不切開
+    assert regions[0][0] == pytest.approx(1.8 * SAMPLE_RATE, abs=0.03 * SAMPLE_RATE)
+    assert regions[1][1] == pytest.approx(7.5 * SAMPLE_RATE, abs=0.05 * SAMPLE_RATE)
+    assert audio.seconds == pytest.approx(2.7 + 1.4, abs=0.1)
+    assert audio.original_seconds == pytest.approx(8.8)
+
+def test_trim_silence_keeps_speech_only_clip_without_copy():
+    """測試沒有可移除的靜音時直接使用原陣列；全為靜音時不留下任何音訊."""
+    speech = _clip((2.0, True))
+    silence = np.zeros(SAMPLE_RATE, dtype=np.float32)
+
+    assert trim_silence(speech).samples is speech
+    assert len(trim_silence(silence).samples) == 0
+
+def test_prepared_audio_restores_original_timestamps():
+    """測試裁剪後音訊的時間戳換算回原始音訊，交界處的結束時間歸屬前一段."""
+    audio = PreparedAudio(np.zeros(3 * SAMPLE_RATE, dtype=np.float32), 10 * SAMPLE_RATE, [(2 * SAMPLE_RATE, 4 * SAMPLE_RATE), (7 * SAMPLE_RATE, 8 * SAMPLE_RATE)])
+
+    assert audio.restore({"start": 0.5, "end": 2.0, "text": "a"}) == {"start": 2.5, "end": 4.0, "text": "a"}
+    assert audio.restore({"start": 2.0, "end": 2.5, "text": "b"}) == {"start": 7.0, "end": 7.5, "text": "b"}
+
+@pytest.mark.asyncio
+async def test_transcribe_file_serves_repeated_clip_from_cache():
+    """測試相同內容的上傳第二次由快取回應，不再解碼與轉錄."""
+    samples = _clip((1.0, False), (1.0, True), (1.0, False))
+    executor = MagicMock()
+    executor.transcribe_segments = AsyncMock(return_value=[{"start": 0.1, "end": 1.0, "text": "你好"}])
+
+    with patch('ai-orchestrator.app.services.audio_intake.transcript_cache', LRUCache(8)), \
+         patch('ai-orchestrator.app.services.audio_intake.decode_audio', return_value=samples) as mock_decode:
+        first = await transcribe_file(io.BytesIO(b"same clip"), executor)
+        second = await transcribe_file(io.BytesIO(b"same clip"), executor)
+
+    assert first == second
+    assert first[0]["start"] == pytest.approx(0.9, abs=0.05) # 開頭的靜音移除後換算回原始時間
+    mock_decode.assert_called_once()
+    executor.transcribe_segments.assert_awaited_once()
@@ -0,0 +1,59 @@
+from langchain_core.documents import Document
+from ..app.services.context_packing import merge_adjacent, pack_context, strip_overlap
+from ..app.services.rate_limiter import estimate_tokens
+
+# --- Mock 設置 ---
+OVERLAP = "賈伯斯於1976年與沃茲尼亞克在車庫中創立了蘋果公司。"
+CHUNK_0 = "蘋果公司是一家美國科技公司，總部位於加州庫比蒂諾。" + OVERLAP
+CHUNK_1 = OVERLAP + "公司的第一款產品是Apple I個人電腦，隨後推出了Apple II。"
+
+def make_chunk(text, document_id, chunk_index, score):
+    return Document(page_content=text, metadata={"document_id": document_id, "chunk_index": chunk_index, "score": score})
+
+# --- 測試案例 ---
+def test_strip_overlap_removes_repeated_prefix():
+    """測試移除後一個文件塊開頭與前一個文件塊結尾重複的部分."""
+    remainder, removed = strip_overlap(CHUNK_0, CHUNK_1)
+
+    assert removed == len(OVERLAP)
+    assert remainder == "公司的第一款產品是Apple I個人電腦，隨後推出了Apple II。"
+    assert strip_overlap("完全不同的前一段文字內容，沒有任何重複的部分喔。", CHUNK_1) == (CHUNK_1, 0)
+
+def test_merge_adjacent_joins_consecutive_chunks_of_same_document():
+    """測試同一文件中 chunk_index 連續的文件塊合併為一個段落，不連續或不同文件的文件塊各自成段."""
+    documents = [
+        make_chunk(CHUNK_1, 1, 5, 0.8),
+        make_chunk("另一份文件的內容。", 2, 6, 0.85),
+        make_chunk(CHUNK_0, 1, 4, 0.9),
+        make_chunk("同一份文件較後面的段落。", 1, 9, 0.7),
+    ]
+
+    passages, removed_tokens = merge_adjacent(documents)
+
+    assert [(p.metadata["document_id"], p.metadata["chunk_index"], p.metadata["chunk_end"]) for p in passages] == [(1, 4, 5), (2, 6, 6), (1, 9, 9)]
+    assert passages[0].page_content.count(OVERLAP) == 1
+    assert passages[0].metadata["score"] == 0.9
+    assert removed_tokens == estimate_tokens(OVERLAP)
+
+def test_pack_context_prefers_diverse_passages_within_budget():
+    """測試 MMR 略過與已選段落幾乎相同的候選，並且打包結果不超過 token 預算."""
+    apple = "蘋果公司成立於1976年，由賈伯斯、沃茲尼亞克和韋恩共同創立，總部位於加州。"
+    documents = [
+        make_chunk(apple, 1, 0, 0.95),
+        make_chunk(apple.replace("總部位於加州", "總部在加州"), 2, 0, 0.94), # 另一份文件中幾乎相同的內容
+        make_chunk("皮克斯動畫工作室於1986年成立，賈伯斯是主要投資人。", 3, 0, 0.80),
+    ]
+    budget = estimate_tokens(apple) + 40
+
+    packed, stats = pack_context(documents, token_budget=budget, mmr_lambda=0.7)
+
+    assert [p.metadata["document_id"] for p in packed] == [1, 3]
+    assert stats["context_tokens"] <= budget
+    assert stats["tokens_saved"] == stats["retrieved_tokens"] - stats["context_tokens"] > 0
+
+def test_pack_context_truncates_oversized_first_passage():
+    """測試單一段落超過預算時截斷，而不是回傳空的上下文."""
+    packed, stats = pack_context([make_chunk("長" * 500, 1, 0, 0.9)], token_budget=100, mmr_lambda=0.7)
+
+    assert len(packed) == 1 and packed[0].metadata["truncated"]
+    assert stats["context_tokens"] <= 100
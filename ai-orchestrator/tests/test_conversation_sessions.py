@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+from ..app.services.conversation_sessions import SessionStore
+
+# --- Mock 設置 ---
+
+async def _store(compact, tmp_path, **kwargs):
+    options = {"max_sessions": 10, "ttl": 60, "token_budget": 50, "keep_recent": 2, "db_path": str(tmp_path / "sessions.db")}
+    options.update(kwargs)
+    store = SessionStore(compact, **options)
+    await store.start()
+    return store
+
+async def _settle(session):
+    """等待背景壓縮完成."""
+    if session.compaction is not None:
+        await asyncio.gather(session.compaction, return_exceptions=True)
+
+# --- 測試案例 ---
+
+@pytest.mark.asyncio
+async def test_history_is_compacted_into_rolling_summary(tmp_path):
+    """測試歷史超過預算時較舊的訊息在背景壓縮為摘要，每個回合的歷史大小維持固定."""
+    compact = AsyncMock(side_effect=lambda summary, messages, max_words: f"摘要({len(messages)})")
+    store = await _store(compact, tmp_path)
+    session = await store.get_or_create("alice", "s1")
+
+    sizes = []
+    for turn in range(10):
+        await store.record_turn(session, f"第 {turn} 個問題" + "內容" * 10, "回答" * 10)
+        await _settle(session)
+        sizes.append(session.history_tokens)
+
+    assert compact.await_count >= 3
+    assert session.turns == 10
+    assert len(session.messages) <= 4
+    assert session.history()[0]["role"] == "system"
+    assert session.history()[-1] == {"role": "assistant", "content": "回答" * 10}
+    assert max(sizes[3:]) <= 2 * store.token_budget # 不隨回合數線性增長
+    stored = await store.get("alice", "s1")
+    assert stored.describe() == session.describe()
+    await store.close()
+
+@pytest.mark.asyncio
+async def test_failed_compaction_bounds_history(tmp_path):
+    """測試壓縮失敗時保留訊息，但超過兩倍預算後捨棄最舊的回合."""
+    store = await _store(AsyncMock(side_effect=RuntimeError("LLM 失敗")), tmp_path)
+    session = await store.get_or_create("alice", "s1")
+
+    for turn in range(10):
+        await store.record_turn(session, "問題" * 10, "回答" * 10)
+        await _settle(session)
+
+    assert session.summary == ""
+    assert session.history_tokens <= 2 * store.token_budget
+    await store.close()
+
+@pytest.mark.asyncio
+async def test_sessions_are_scoped_per_user_and_bounded(tmp_path):
+    """測試工作階段以 user_id 區分，且數量超過上限時淘汰最久未使用的."""
+    store = await _store(AsyncMock(), tmp_path, max_sessions=2)
+    alice = await store.create("alice", "shared-id")
+    await store.record_turn(alice, "問題", "回答")
+
+    assert await store.get("bob", "shared-id") is None
+    assert (await store.get_or_create("bob", "shared-id")).turns == 0
+
+    await store.create("carol")
+    assert await store.get("alice", "shared-id") is None
+    assert await store.count() == 2
+    assert await store.delete("bob", "shared-id")
+    await store.close()
+
+@pytest.mark.asyncio
+async def test_sessions_are_shared_across_workers(tmp_path):
+    """測試共用資料庫的兩個程序 (worker) 都能接續同一個工作階段，回合不會互相覆蓋."""
+    first = await _store(AsyncMock(), tmp_path)
+    second = await _store(AsyncMock(), tmp_path)
+
+    session = await first.create("alice", "s1")
+    stale = await second.get("alice", "s1")
+    assert stale is not None
+
+    await first.record_turn(session, "第一個問題", "第一個回答")
+    await second.record_turn(stale, "第二個問題", "第二個回答") # 以舊的快照寫入也接在前一個回合之後
+
+    resumed = await first.get("alice", "s1")
+    assert resumed.turns == 2
+    assert [message["content"] for message in resumed.messages] == ["第一個問題", "第一個回答", "第二個問題", "第二個回答"]
+
+    assert await second.delete("alice", "s1")
+    assert await first.get("alice", "s1") is None
+    await first.close()
+    await second.close()
@@ -1,6 +1,9 @@
 import pytest
 from unittest.mock import AsyncMock, patch, MagicMock
-from ..app.services.document_service import process_document_embedding, search_documents_qdrant, summarize_document, initialize_qdrant_collection
+from ..app.services.document_service import process_document_embedding, process_documents_batch, search_documents_qdrant, summarize_document, initialize_qdrant_collection, get_embeddings_batched, index_document_chunks, chunk_fingerprint, chunk_point_id, upsert_points_batched
+from ..app.services.embedding_provider import OpenAIEmbeddingProvider
+from ..app.services.llm_coalescing import LLMCallCoalescer
+from qdrant_client import models
 import os
 
 # --- Mock 設置 ---
@@ -10,24 +13,39 @@ def mock_env_vars():
     with patch.dict(os.environ, {"OPENAI_API_KEY": "sk-test12345", "QDRANT_HOST": "localhost", "QDRANT_PORT": "6333"}):
         yield
 
+@pytest.fixture(autouse=True)
+def disable_caches():
+    """停用 Embedding、搜尋、摘要與 LLM 回應快取，避免測試之間互相影響."""
+    with patch('ai-orchestrator.app.services.document_service.embedding_cache', None), \
+         patch('ai-orchestrator.app.services.document_service.search_cache', None), \
+         patch('ai-orchestrator.app.services.document_service.summarizer.cache', None), \
+         patch('ai-orchestrator.app.services.document_service.summary_calls', LLMCallCoalescer("summarize", max_entries=0)):
+        yield
+
 @pytest.fixture
 def mock_qdrant_client():
-    """模擬 QdrantClient."""
-    with patch('ai-orchestrator.app.services.document_service.QdrantClient') as MockClient:
-        mock_client_instance = MockClient.return_value
+    """模擬共用的 AsyncQdrantClient."""
+    with patch('ai-orchestrator.app.services.document_service.client', new_callable=AsyncMock) as mock_client_instance:
         mock_client_instance.get_collections.return_value.collections = []
-        mock_client_instance.recreate_collection = AsyncMock()
-        mock_client_instance.upsert = AsyncMock()
-        mock_client_instance.search = AsyncMock(return_value=[])
+        mock_client_instance.search.return_value = []
+        mock_client_instance.scroll.return_value = ([], None) # 預設文件尚未被索引
         yield mock_client_instance
 
 @pytest.fixture
-def mock_openai_embedding():
+def openai_embedding_provider():
+    """以模擬的 OpenAIEmbeddings 建立 Embedding 提供者，並替換 document_service 共用的實例."""
+    with patch('ai-orchestrator.app.services.embedding_provider.OpenAIEmbeddings'):
+        provider = OpenAIEmbeddingProvider("text-embedding-ada-002")
+    with patch('ai-orchestrator.app.services.document_service.embedding_provider', provider):
+        yield provider
+
+@pytest.fixture
+def mock_openai_embedding(openai_embedding_provider):
     """模擬 OpenAIEmbeddings."""
-    with patch('ai-orchestrator.app.services.document_service.OpenAIEmbeddings') as MockEmbeddings:
-        mock_embeddings_instance = MockEmbeddings.return_value
-        mock_embeddings_instance.embed_query = MagicMock(return_value=[0.1] * 1536) # 固定返回一個向量
-        yield mock_embeddings_instance
+    mock_embeddings_instance = openai_embedding_provider._client
+    mock_embeddings_instance.embed_query = MagicMock(return_value=[0.1] * 1536) # 固定返回一個向量
+    mock_embeddings_instance.embed_documents = MagicMock(side_effect=lambda texts: [[0.1] * 1536 for _ in texts]) # 每個輸入返回一個向量
+    yield mock_embeddings_instance
 
 @pytest.fixture
 def mock_chat_llm():
@@ -46,6 +64,19 @@ async def test_initialize_qdrant_collection_creates_new(mock_qdrant_client):
     await initialize_qdrant_collection()
     mock_qdrant_client.recreate_collection.assert_called_once()
 
+@pytest.mark.asyncio
+async def test_initialize_qdrant_collection_creates_missing_payload_indexes(mock_qdrant_client, mock_openai_embedding):
+    """測試啟動時為 document_id 與宣告的過濾欄位建立 payload index，已存在的 index 不重建."""
+    mock_qdrant_client.get_collections.return_value.collections = []
+    mock_qdrant_client.get_collection.return_value.payload_schema = {"document_id": MagicMock()}
+
+    await initialize_qdrant_collection()
+
+    created = {call.kwargs["field_name"]: call.kwargs["field_schema"] for call in mock_qdrant_client.create_payload_index.call_args_list}
+    assert "document_id" not in created
+    assert created["category"] == models.PayloadSchemaType.KEYWORD
+    assert created["uploaded_by"] == models.PayloadSchemaType.INTEGER
+
 @pytest.mark.asyncio
 async def test_initialize_qdrant_collection_exists(mock_qdrant_client):
     """測試 Qdrant collection 已存在時，不會被重新創建."""
@@ -75,12 +106,149 @@ async def test_process_document_embedding_success(tmp_path, mock_qdrant_client,
 
     summary = await process_document_embedding(document_id, str(test_file), metadata)
 
-    mock_qdrant_client.recreate_collection.assert_called_once() # 第一次運行可能會創建
-    mock_openai_embedding.embed_query.assert_called() # 應該為每個 chunk 調用
+    mock_qdrant_client.recreate_collection.assert_not_called() # collection 只在應用啟動時初始化一次
+    mock_qdrant_client.get_collections.assert_not_called()
+    mock_openai_embedding.embed_documents.assert_called() # 以批次方式向量化所有 chunk
+    mock_openai_embedding.embed_query.assert_not_called()
     mock_qdrant_client.upsert.assert_called_once()
     mock_chat_llm.ainvoke.assert_called_once()
     assert summary == "這是一個模擬的 LLM 回應。"
 
+@pytest.mark.asyncio
+async def test_get_embeddings_batched_splits_into_batches(openai_embedding_provider, mock_openai_embedding):
+    """測試批次 Embedding 依批次大小分組，且保持輸入順序."""
+    texts = [f"chunk-{i}" for i in range(5)]
+    with patch.object(openai_embedding_provider, 'batch_size', 2):
+        embeddings = await get_embeddings_batched(texts)
+
+    assert mock_openai_embedding.embed_documents.call_count == 3 # 2 + 2 + 1
+    assert len(embeddings) == len(texts)
+
+@pytest.mark.asyncio
+async def test_get_embeddings_batched_retries_failed_batch(openai_embedding_provider, mock_openai_embedding):
+    """測試單一批次失敗時會退避重試，而不是整份文件失敗."""
+    mock_openai_embedding.embed_documents.side_effect = [RuntimeError("rate limited"), [[0.2] * 1536]]
+    with patch.object(openai_embedding_provider, 'retry_base_delay', 0):
+        embeddings = await get_embeddings_batched(["唯一的塊"])
+
+    assert mock_openai_embedding.embed_documents.call_count == 2
+    assert embeddings == [[0.2] * 1536]
+
+@pytest.mark.asyncio
+async def test_get_embeddings_batched_deduplicates_chunks(mock_openai_embedding):
+    """測試同一次上傳中重複的塊只送出一次 Embedding 請求，且結果對應回原位置."""
+    texts = ["重複的頁首", "內容 A", "重複的頁首"]
+
+    embeddings = await get_embeddings_batched(texts)
+
+    mock_openai_embedding.embed_documents.assert_called_once_with(["重複的頁首", "內容 A"])
+    assert len(embeddings) == 3
+
+@pytest.mark.asyncio
+async def test_index_document_chunks_incremental_only_embeds_changed(mock_qdrant_client, mock_openai_embedding):
+    """測試增量索引只向量化變更的塊，並批次刪除舊版本遺留的塊."""
+    document_id = 3
+    unchanged_id = chunk_point_id(document_id, chunk_fingerprint("不變的段落"), 0)
+    stale_id = chunk_point_id(document_id, chunk_fingerprint("已刪除的段落"), 0)
+    mock_qdrant_client.scroll.return_value = ([
+        MagicMock(id=unchanged_id, payload={"document_id": document_id, "chunk_index": 0, "chunk_hash": chunk_fingerprint("不變的段落")}),
+        MagicMock(id=stale_id, payload={"document_id": document_id, "chunk_index": 1, "chunk_hash": chunk_fingerprint("已刪除的段落")}),
+    ], None)
+
+    stats = await index_document_chunks(document_id, ["不變的段落", "修改後的段落"], {}, incremental=True)
+
+    mock_openai_embedding.embed_documents.assert_called_once_with(["修改後的段落"])
+    mock_qdrant_client.delete.assert_called_once()
+    assert mock_qdrant_client.delete.call_args.kwargs["points_selector"].points == [stale_id]
+    assert stats == {"total": 2, "embedded": 1, "payload_updated": 0, "deleted": 1}
+
+@pytest.mark.asyncio
+async def test_index_document_chunks_overwrites_payload_of_unchanged_chunks(mock_qdrant_client, mock_openai_embedding):
+    """測試內容未變但 metadata 改變的塊以覆寫更新 payload：已移除的 metadata 欄位不殘留，文本保留."""
+    document_id = 6
+    point_id = chunk_point_id(document_id, chunk_fingerprint("不變的段落"), 0)
+    mock_qdrant_client.scroll.return_value = ([
+        MagicMock(id=point_id, payload={"document_id": document_id, "chunk_index": 0, "chunk_hash": chunk_fingerprint("不變的段落"), "owner": "alice"}),
+    ], None)
+
+    stats = await index_document_chunks(document_id, ["不變的段落"], {}, incremental=True)
+
+    mock_openai_embedding.embed_documents.assert_not_called()
+    [operation] = mock_qdrant_client.batch_update_points.call_args.kwargs["update_operations"]
+    assert isinstance(operation, models.OverwritePayloadOperation)
+    assert operation.overwrite_payload.payload == {"document_id": document_id, "chunk_index": 0, "chunk_hash": chunk_fingerprint("不變的段落"), "text": "不變的段落"}
+    assert stats["payload_updated"] == 1
+
+@pytest.mark.asyncio
+async def test_index_document_chunks_full_mode_writes_before_deleting(mock_qdrant_client, mock_openai_embedding):
+    """測試完整索引重新向量化所有塊，先寫入新的 point，最後才刪除舊版本遺留的塊 (不先刪除整份文件)."""
+    document_id = 4
+    unchanged_id = chunk_point_id(document_id, chunk_fingerprint("不變的段落"), 0)
+    stale_id = chunk_point_id(document_id, chunk_fingerprint("已刪除的段落"), 0)
+    mock_qdrant_client.scroll.return_value = ([
+        MagicMock(id=unchanged_id, payload={"document_id": document_id, "chunk_index": 0, "chunk_hash": chunk_fingerprint("不變的段落")}),
+        MagicMock(id=stale_id, payload={"document_id": document_id, "chunk_index": 1, "chunk_hash": chunk_fingerprint("已刪除的段落")}),
+    ], None)
+    calls = []
+    mock_qdrant_client.upsert.side_effect = lambda **kwargs: calls.append("upsert")
+    mock_qdrant_client.delete.side_effect = lambda **kwargs: calls.append("delete")
+
+    stats = await index_document_chunks(document_id, ["不變的段落", "新的段落"], {}, incremental=False)
+
+    mock_openai_embedding.embed_documents.assert_called_once_with(["不變的段落", "新的段落"])
+    assert calls == ["upsert", "delete"]
+    assert mock_qdrant_client.delete.call_args.kwargs["points_selector"].points == [stale_id]
+    assert stats == {"total": 2, "embedded": 2, "payload_updated": 0, "deleted": 1}
+
+@pytest.mark.asyncio
+async def test_process_document_embedding_streams_batches(tmp_path, mock_qdrant_client, mock_openai_embedding):
+    """測試大型文件以串流方式處理：分多個 Embedding 批次與 upsert 批次寫入，而非一次全部寫入."""
+    test_file = tmp_path / "large_doc.txt"
+    test_file.write_text("\n\n".join(f"第 {i} 段：" + "這是一段用於測試串流索引的內容。" * 20 for i in range(40)))
+    progress = AsyncMock()
+
+    with patch('ai-orchestrator.app.services.document_service.INGEST_EMBED_BATCH_CHUNKS', 10), \
+         patch('ai-orchestrator.app.services.ingestion_pipeline.INGEST_READ_BLOCK_BYTES', 4096), \
+         patch('ai-orchestrator.app.services.document_service.chat_llm') as chat_llm:
+        chat_llm.ainvoke = AsyncMock(return_value=MagicMock(content="部分摘要"))
+        summary = await process_document_embedding(5, str(test_file), {}, incremental=False)
+
+    upserted = [point for call in mock_qdrant_client.upsert.call_args_list for point in call.kwargs["points"]]
+    assert mock_openai_embedding.embed_documents.call_count > 1
+    assert mock_qdrant_client.upsert.await_count > 1
+    assert [point.payload["chunk_index"] for point in upserted] == list(range(len(upserted)))
+    assert chat_llm.ainvoke.await_count > len(upserted) # 長文件逐塊 map 摘要後再 reduce
+    assert summary == "部分摘要"
+
+@pytest.mark.asyncio
+async def test_process_documents_batch_shares_batches_across_documents(tmp_path, mock_qdrant_client, mock_openai_embedding):
+    """測試批次上傳時不同文件的塊共用同一個 Embedding 與 upsert 批次，且單一文件失敗不影響其他文件."""
+    documents = []
+    for document_id in (11, 12, 13):
+        path = tmp_path / f"doc_{document_id}.txt"
+        path.write_text(f"文件 {document_id} 的內容。")
+        documents.append({"document_id": document_id, "file_path": str(path), "metadata": {"source": "backfill"}})
+    documents.append({"document_id": 14, "file_path": str(tmp_path / "missing.txt"), "metadata": {}})
+
+    with patch('ai-orchestrator.app.services.document_service.summarize_document', new=AsyncMock(return_value="摘要")):
+        results = await process_documents_batch(documents, incremental=False)
+
+    mock_openai_embedding.embed_documents.assert_called_once_with(["文件 11 的內容。", "文件 12 的內容。", "文件 13 的內容。"])
+    mock_qdrant_client.upsert.assert_called_once()
+    assert [r["status"] for r in results] == ["processed", "processed", "processed", "failed"]
+    assert results[0]["stats"]["embedded"] == 1
+    assert "文件未找到" in results[3]["error"]
+
+@pytest.mark.asyncio
+async def test_upsert_points_batched_splits_large_upserts(mock_qdrant_client):
+    """測試大量 point 會被切分為大小受限的 upsert 批次."""
+    points = [MagicMock() for _ in range(5)]
+    with patch('ai-orchestrator.app.services.document_service.QDRANT_UPSERT_BATCH_SIZE', 2):
+        await upsert_points_batched(points)
+
+    assert mock_qdrant_client.upsert.await_count == 3
+    assert all(call.kwargs["wait"] for call in mock_qdrant_client.upsert.call_args_list)
+
 @pytest.mark.asyncio
 async def test_search_documents_qdrant_no_results(mock_qdrant_client, mock_openai_embedding):
     """測試語意搜尋無結果的情境."""
@@ -104,3 +272,24 @@ async def test_summarize_document_uses_chat_llm(mock_chat_llm):
     mock_chat_llm.ainvoke.assert_called_once()
     assert "請簡潔、清晰地總結以下文件內容" in mock_chat_llm.ainvoke.call_args[0][0] # 檢查 prompt 內容
     assert summary == "這是一個模擬的 LLM 回應。"
+
+@pytest.mark.asyncio
+async def test_search_documents_qdrant_pushes_filters_to_qdrant(mock_qdrant_client, mock_openai_embedding):
+    """測試後端寫入的 metadata 欄位 (category、uploaded_by) 預設即可過濾，條件轉為 Qdrant Filter 隨搜尋送出."""
+    mock_qdrant_client.search.return_value = [
+        MagicMock(score=0.9, payload={"document_id": 7, "chunk_index": 0, "chunk_hash": "h", "text": "內容", "category": "Policy", "uploaded_by": 42, "original_name": "規章.txt"})
+    ]
+
+    results = await search_documents_qdrant("查詢", filters={"document_id": [7, 8], "category": "Policy", "uploaded_by": 42})
+
+    query_filter = mock_qdrant_client.search.call_args.kwargs["query_filter"]
+    assert {condition.key for condition in query_filter.must} == {"document_id", "category", "uploaded_by"}
+    assert results[0]["metadata"] == {"category": "Policy", "uploaded_by": 42, "original_name": "規章.txt"}
+
+@pytest.mark.asyncio
+async def test_search_documents_qdrant_rejects_undeclared_filter_fields(mock_qdrant_client, mock_openai_embedding):
+    """測試未宣告為可過濾的欄位會被拒絕，而不是送出無索引的過濾查詢."""
+    with pytest.raises(ValueError):
+        await search_documents_qdrant("查詢", filters={"department": "sales"})
+
+    mock_qdrant_client.search.assert_not_called()
@@ -0,0 +1,49 @@
+import pytest
+from ..app.services.embedding_cache import EmbeddingCache
+
+# --- 測試案例 ---
+
+def test_embedding_cache_miss_then_memory_hit(tmp_path):
+    """測試首次查詢未命中，寫入後從記憶體層命中."""
+    cache = EmbeddingCache("test-model", dim=4, cache_dir=str(tmp_path))
+
+    assert cache.get("你好") is None
+    cache.set("你好", [0.1, 0.2, 0.3, 0.4])
+
+    assert cache.get("你好") == pytest.approx([0.1, 0.2, 0.3, 0.4])
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["memory_hits"] == 1
+
+def test_embedding_cache_persists_to_disk(tmp_path):
+    """測試向量寫入磁碟層後，新的快取實例 (例如重啟後) 仍可讀取."""
+    EmbeddingCache("test-model", dim=4, cache_dir=str(tmp_path)).set("文件塊", [1.0, 0.0, 0.0, 0.0])
+
+    reloaded = EmbeddingCache("test-model", dim=4, cache_dir=str(tmp_path))
+
+    assert reloaded.get("文件塊") == pytest.approx([1.0, 0.0, 0.0, 0.0])
+    assert reloaded.stats()["disk_hits"] == 1
+
+def test_embedding_cache_key_includes_model_name(tmp_path):
+    """測試不同模型的相同文本不共用快取項目."""
+    cache_a = EmbeddingCache("model-a", dim=2, cache_dir=str(tmp_path))
+    cache_b = EmbeddingCache("model-b", dim=2, cache_dir=str(tmp_path))
+    cache_a.set("相同文本", [0.5, 0.5])
+
+    assert cache_b.get("相同文本") is None
+
+def test_embedding_cache_processes_sharing_a_directory_keep_rows_apart(tmp_path):
+    """測試兩個程序 (各自的快取實例) 寫入同一目錄時，列號取自實際檔案大小，不會互相覆蓋對應關係."""
+    worker_a = EmbeddingCache("test-model", dim=2, cache_dir=str(tmp_path))
+    worker_b = EmbeddingCache("test-model", dim=2, cache_dir=str(tmp_path))
+    worker_a.set("甲", [1.0, 0.0])
+    worker_b.set("乙", [0.0, 1.0])
+    worker_a.set("丙", [0.5, 0.5])
+
+    reloaded = EmbeddingCache("test-model", dim=2, cache_dir=str(tmp_path))
+
+    for cache in (worker_b, reloaded):
+        cache._memory.clear()
+    assert worker_b.get("乙") == pytest.approx([0.0, 1.0])
+    assert reloaded.get("甲") == pytest.approx([1.0, 0.0])
+    assert reloaded.get("乙") == pytest.approx([0.0, 1.0])
+    assert reloaded.get("丙") == pytest.approx([0.5, 0.5])
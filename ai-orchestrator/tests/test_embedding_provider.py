@@ -0,0 +1,46 @@
+import pytest
+import numpy as np
+from ..app.services.embedding_provider import HashingEmbeddingProvider, create_embedding_provider
+
+# --- 測試案例 ---
+
+@pytest.mark.asyncio
+async def test_hashing_provider_is_deterministic_and_normalized():
+    """測試雜湊 Embedding 對相同文本產生相同的單位向量，維度與 dim 一致."""
+    provider = HashingEmbeddingProvider(dim=64)
+
+    first = await provider.embed_query("蘋果公司成立於1976年")
+    second = await provider.embed_query("蘋果公司成立於1976年")
+
+    assert provider.dim == 64
+    assert first == second
+    assert len(first) == 64
+    assert np.linalg.norm(first) == pytest.approx(1.0, abs=1e-5)
+
+@pytest.mark.asyncio
+async def test_hashing_provider_shared_terms_are_more_similar():
+    """測試共享詞彙的文本 cosine 相似度高於無關文本."""
+    provider = HashingEmbeddingProvider(dim=256)
+    query, related, unrelated = await provider.embed_documents(["蘋果公司的創辦人", "蘋果公司由賈伯斯創辦", "今天天氣晴朗"])
+
+    assert np.dot(query, related) > np.dot(query, unrelated)
+
+@pytest.mark.asyncio
+async def test_embed_documents_batches_and_keeps_order():
+    """測試 embed_documents 依 batch_size 分批、回報進度並保持輸入順序."""
+    provider = HashingEmbeddingProvider(dim=32, batch_size=2)
+    texts = [f"chunk {i}" for i in range(5)]
+    reported = []
+
+    async def on_batch(size: int) -> None:
+        reported.append(size)
+
+    embeddings = await provider.embed_documents(texts, on_batch=on_batch)
+
+    assert sorted(reported) == [1, 2, 2]
+    assert embeddings == [await provider.embed_query(text) for text in texts]
+
+def test_create_embedding_provider_rejects_unknown_backend():
+    """測試不支援的後端名稱會立即報錯."""
+    with pytest.raises(ValueError):
+        create_embedding_provider("unknown")
@@ -0,0 +1,52 @@
+import pytest
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from ..app.services.ingestion_pipeline import StreamingTextSplitter, batched, prefetch, read_text_blocks, split_text_stream
+
+PARAGRAPHS = [f"第 {i} 段：" + "向量資料庫以 embedding 檢索相關的文件內容。" * (i % 7 + 1) for i in range(120)]
+TEXT = "\n\n".join(PARAGRAPHS)
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+# --- 測試案例 ---
+
+@pytest.mark.asyncio
+async def test_streaming_splitter_matches_full_split_across_blocks():
+    """測試逐區塊分割的結果與一次分割整份文字相同 (overlap 能跨越讀取邊界延續)."""
+    expected = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200).split_text(TEXT)
+    blocks = [TEXT[i:i + 1500] for i in range(0, len(TEXT), 1500)]
+
+    chunks = [chunk async for chunk in split_text_stream(_aiter(blocks), StreamingTextSplitter())]
+
+    assert chunks == expected
+
+@pytest.mark.asyncio
+async def test_read_text_blocks_keeps_multibyte_characters(tmp_path):
+    """測試區塊邊界切在多位元組字元中間時仍能正確解碼，並回報讀取進度."""
+    path = tmp_path / "doc.txt"
+    path.write_text(TEXT, encoding="utf-8")
+    reported = []
+
+    async def on_read(read, total):
+        reported.append((read, total))
+
+    blocks = [block async for block in read_text_blocks(str(path), block_bytes=1001, on_read=on_read)]
+
+    assert "".join(blocks) == TEXT
+    assert reported[-1][0] == reported[-1][1] == path.stat().st_size
+
+@pytest.mark.asyncio
+async def test_prefetch_propagates_upstream_errors():
+    """測試 prefetch 依序傳遞上游的批次，並在消費端重新拋出上游例外."""
+    async def failing():
+        yield [1, 2]
+        raise RuntimeError("embedding failed")
+
+    received = []
+    with pytest.raises(RuntimeError, match="embedding failed"):
+        async for batch in prefetch(failing(), maxsize=1):
+            received.append(batch)
+
+    assert received == [[1, 2]]
+    assert [batch async for batch in batched(_aiter(range(5)), 2)] == [[0, 1], [2, 3], [4]]
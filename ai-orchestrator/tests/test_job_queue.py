@@ -0,0 +1,155 @@
+import pytest
+from ..app.services.job_queue import JobQueue, JobStore, callback_url_allowed, JOB_COMPLETED, JOB_FAILED, JOB_QUEUED, JOB_RUNNING
+import asyncio
+
+# --- 輔助函式 ---
+async def wait_for_status(queue, job_id, statuses, timeout=2.0):
+    """輪詢直到任務進入指定狀態."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        job = await queue.get(job_id)
+        if job["status"] in statuses or asyncio.get_running_loop().time() > deadline:
+            return job
+        await asyncio.sleep(0.01)
+
+# --- 測試案例 ---
+
+@pytest.mark.asyncio
+async def test_job_runs_in_background_and_records_progress(tmp_path):
+    """測試任務排入後立即回傳，背景完成並記錄各階段進度與結果."""
+    async def handler(payload, progress):
+        await progress("split", 3, 3)
+        await progress("embed", 3, 3)
+        return {"summary": f"摘要 {payload['document_id']}"}
+
+    queue = JobQueue(handler, workers=1, db_path=str(tmp_path / "jobs.db"))
+    await queue.start()
+    job = await queue.enqueue({"document_id": 7}, document_id=7)
+    assert job["status"] == JOB_QUEUED
+
+    finished = await wait_for_status(queue, job["id"], {JOB_COMPLETED, JOB_FAILED})
+    await queue.stop()
+
+    assert finished["status"] == JOB_COMPLETED
+    assert finished["result"] == {"summary": "摘要 7"}
+    assert finished["progress"]["embed"] == {"completed": 3, "total": 3}
+
+@pytest.mark.asyncio
+async def test_failed_job_records_error(tmp_path):
+    """測試 handler 拋出例外時任務標記為 failed 並保存錯誤訊息."""
+    async def handler(payload, progress):
+        raise FileNotFoundError("文件未找到")
+
+    queue = JobQueue(handler, workers=1, db_path=str(tmp_path / "jobs.db"))
+    await queue.start()
+    job = await queue.enqueue({"document_id": 8}, document_id=8)
+    finished = await wait_for_status(queue, job["id"], {JOB_COMPLETED, JOB_FAILED})
+    await queue.stop()
+
+    assert finished["status"] == JOB_FAILED
+    assert "文件未找到" in finished["error"]
+
+@pytest.mark.asyncio
+async def test_unfinished_jobs_are_recovered_after_restart(tmp_path):
+    """測試重啟前仍在執行的任務，重啟後會被重新處理."""
+    db_path = str(tmp_path / "jobs.db")
+    store = JobStore(db_path)
+    store.create("job-1", 9, {"document_id": 9}, None)
+    store.update("job-1", status=JOB_RUNNING)
+    store.close()
+
+    async def handler(payload, progress):
+        return {"summary": "恢復後完成"}
+
+    queue = JobQueue(handler, workers=1, db_path=db_path)
+    await queue.start()
+    finished = await wait_for_status(queue, "job-1", {JOB_COMPLETED, JOB_FAILED})
+    await queue.stop()
+
+    assert finished["status"] == JOB_COMPLETED
+
+@pytest.mark.asyncio
+async def test_recovered_job_runs_once_across_processes(tmp_path):
+    """測試多個程序 (各自的 JobQueue) 共用資料庫時，恢復的任務只由認領成功的一個程序處理."""
+    db_path = str(tmp_path / "jobs.db")
+    store = JobStore(db_path)
+    store.create("job-1", 11, {"document_id": 11}, None)
+    store.update("job-1", status=JOB_RUNNING)
+    store.close()
+    runs = []
+
+    async def handler(payload, progress):
+        runs.append(payload["document_id"])
+        await asyncio.sleep(0.05)
+        return {"summary": "完成"}
+
+    queues = [JobQueue(handler, workers=2, db_path=db_path) for _ in range(3)]
+    for queue in queues:
+        await queue.start()
+    finished = await wait_for_status(queues[0], "job-1", {JOB_COMPLETED, JOB_FAILED})
+    await asyncio.sleep(0.1)
+    for queue in queues:
+        await queue.stop()
+
+    assert finished["status"] == JOB_COMPLETED
+    assert runs == [11]
+
+def test_claim_respects_unexpired_lease(tmp_path):
+    """測試租約未過期的任務不能被其他程序認領，過期後可以."""
+    store = JobStore(str(tmp_path / "jobs.db"))
+    store.create("job-1", 12, {"document_id": 12}, None)
+
+    assert store.claim("job-1", "worker-a", lease_seconds=60)
+    assert not store.claim("job-1", "worker-b", lease_seconds=60)
+    assert store.unfinished() == []
+    store.update("job-1", lease_until=0)
+    assert store.claim("job-1", "worker-b", lease_seconds=60)
+    store.close()
+
+@pytest.mark.asyncio
+async def test_callback_url_must_be_on_allowlist(tmp_path):
+    """測試通知網址的主機須在允許清單中，避免共享密鑰被送往呼叫端指定的任意網址."""
+    assert callback_url_allowed("http://backend/api/documents/1/ai-callback", {"backend"})
+    assert not callback_url_allowed("https://attacker.example/steal", {"backend"})
+    assert not callback_url_allowed("file:///etc/passwd", {"backend"})
+
+    async def handler(payload, progress):
+        return {}
+
+    queue = JobQueue(handler, workers=1, db_path=str(tmp_path / "jobs.db"))
+    await queue.start()
+    with pytest.raises(ValueError):
+        await queue.enqueue({"document_id": 10}, document_id=10, callback_url="https://attacker.example/steal")
+    await queue.stop()
+
+@pytest.mark.asyncio
+async def test_job_is_abandoned_when_lease_is_taken_over(tmp_path):
+    """測試租約被其他程序接手時中止處理，且不寫入最終狀態、不送出通知."""
+    db_path = str(tmp_path / "jobs.db")
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def handler(payload, progress):
+        started.set()
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return {"summary": "不應寫入"}
+
+    queue = JobQueue(handler, workers=1, db_path=db_path, lease_seconds=0.06)
+    await queue.start()
+    job = await queue.enqueue({"document_id": 13}, document_id=13, callback_url="http://backend/api/documents/13/ai-callback")
+    await asyncio.wait_for(started.wait(), timeout=1)
+
+    other = JobStore(db_path)
+    other.update(job["id"], worker="worker-b", lease_until=0)
+    assert other.claim(job["id"], "worker-b", lease_seconds=60)
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    await asyncio.sleep(0.05)
+
+    taken_over = other.get(job["id"])
+    assert taken_over["status"] == JOB_RUNNING and taken_over["worker"] == "worker-b"
+    assert not queue._store.finish(job["id"], queue.worker_id, status=JOB_COMPLETED)
+    await queue.stop()
+    other.close()
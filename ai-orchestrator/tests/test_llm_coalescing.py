@@ -0,0 +1,69 @@
+import pytest
+import asyncio
+from unittest.mock import AsyncMock
+from ..app.services.llm_coalescing import LLMCallAborted, LLMCallCoalescer
+from ..app.services.summarization import SummaryCache
+
+# --- Mock 設置 ---
+def slow_call(result="回應", delay=0.05):
+    async def call():
+        await asyncio.sleep(delay)
+        return result
+    return AsyncMock(side_effect=call)
+
+# --- 測試案例 ---
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_share_one_llm_call():
+    """測試同時進行的相同呼叫只執行一次，之後的重複呼叫由記憶體快取回應."""
+    coalescer = LLMCallCoalescer("test")
+    call = slow_call()
+
+    results = await asyncio.gather(*(coalescer.run("key", call) for _ in range(5)))
+    again = await coalescer.run("key", call)
+
+    assert results == ["回應"] * 5 and again == "回應"
+    assert call.await_count == 1
+
+@pytest.mark.asyncio
+async def test_failures_are_shared_but_not_cached():
+    """測試呼叫失敗時等待者收到同一個例外，且失敗不寫入快取 (下一次重新呼叫)."""
+    coalescer = LLMCallCoalescer("test")
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("LLM 錯誤")
+
+    call = AsyncMock(side_effect=failing)
+    results = await asyncio.gather(coalescer.run("key", call), coalescer.run("key", call), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert call.await_count == 1
+    assert await coalescer.run("key", slow_call("成功", 0)) == "成功"
+
+@pytest.mark.asyncio
+async def test_waiter_retries_when_shared_call_is_aborted():
+    """測試共用的呼叫被中止 (串流客戶端斷線) 時，等待者改為自行呼叫."""
+    coalescer = LLMCallCoalescer("test")
+    future = coalescer.begin("key")
+    waiter = asyncio.create_task(coalescer.run("key", slow_call("自行呼叫", 0)))
+    await asyncio.sleep(0)
+
+    coalescer.fail("key", future, GeneratorExit())
+
+    assert await waiter == "自行呼叫"
+    assert isinstance(future.exception(), LLMCallAborted)
+
+@pytest.mark.asyncio
+async def test_deterministic_calls_persist_across_restarts(tmp_path):
+    """測試 persist 的呼叫寫入磁碟層，新的實例 (模擬重啟) 不需再呼叫 LLM；未 persist 的呼叫不寫入磁碟."""
+    db_path = str(tmp_path / "llm_cache.db")
+    first = LLMCallCoalescer("test", persistent=SummaryCache(db_path))
+    await first.run("summary", slow_call("摘要", 0), persist=True)
+    await first.run("answer", slow_call("回答", 0))
+
+    restarted = LLMCallCoalescer("test", persistent=SummaryCache(db_path))
+    call = slow_call("不應呼叫", 0)
+
+    assert await restarted.run("summary", call, persist=True) == "摘要"
+    call.assert_not_awaited()
+    assert await restarted.run("answer", call) == "不應呼叫"
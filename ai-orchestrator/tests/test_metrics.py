@@ -0,0 +1,73 @@
+import pytest
+from ..app.services.metrics import MetricsRegistry, RequestMetricsMiddleware, STAGE_SECONDS, observe_stage
+
+# --- Mock 設置 ---
+
+async def _call(middleware: RequestMetricsMiddleware, headers=()):
+    """以最小的 HTTP scope 呼叫中介層，回傳送出的訊息."""
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await middleware({"type": "http", "method": "GET", "path": "/test", "headers": list(headers)}, receive, send)
+    return sent
+
+async def _endpoint(scope, receive, send):
+    """模擬路由：記錄兩個階段後回應."""
+    observe_stage("rag", "retrieve", 0.02)
+    observe_stage("rag", "generate", 0.5)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+# --- 測試案例 ---
+
+def test_registry_renders_prometheus_text():
+    """測試 counter、gauge 與 histogram 的 Prometheus 文字格式 (分桶為累計值)."""
+    registry = MetricsRegistry(prefix="test_")
+    requests = registry.counter("requests_total", "請求數", ["status"])
+    depth = registry.gauge("queue_depth", "佇列深度")
+    latency = registry.histogram("latency_seconds", "耗時", ["stage"], buckets=(0.1, 1.0))
+
+    requests.inc(status="ok")
+    requests.inc(2, status="ok")
+    depth.set_function(lambda: 3)
+    latency.observe(0.05, stage="embed")
+    latency.observe(0.5, stage="embed")
+    latency.observe(5, stage="embed")
+    text = registry.render()
+
+    assert "# TYPE test_requests_total counter" in text
+    assert 'test_requests_total{status="ok"} 3' in text
+    assert "test_queue_depth 3" in text
+    assert 'test_latency_seconds_bucket{stage="embed",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{stage="embed",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{stage="embed",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{stage="embed"} 3' in text
+
+def test_metric_rejects_wrong_labels():
+    """測試標籤不符時拋出 ValueError，避免悄悄產生不一致的時間序列."""
+    registry = MetricsRegistry(prefix="test_")
+    requests = registry.counter("requests_total", "請求數", ["status"])
+
+    with pytest.raises(ValueError):
+        requests.inc(code="200")
+
+@pytest.mark.asyncio
+async def test_middleware_adds_server_timing_on_request():
+    """測試 Server-Timing 預設關閉，可由請求標頭個別開啟，且階段耗時同時記錄到直方圖."""
+    middleware = RequestMetricsMiddleware(_endpoint, server_timing=False)
+    before = STAGE_SECONDS.count(pipeline="rag", stage="generate")
+
+    default_headers = dict((await _call(middleware))[0]["headers"])
+    requested_headers = dict((await _call(middleware, [(b"x-server-timing", b"1")]))[0]["headers"])
+
+    assert b"server-timing" not in default_headers
+    timing = requested_headers[b"server-timing"].decode()
+    assert "retrieve;dur=20.0" in timing
+    assert "generate;dur=500.0" in timing
+    assert "total;dur=" in timing
+    assert STAGE_SECONDS.count(pipeline="rag", stage="generate") == before + 2
@@ -0,0 +1,62 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from ..app.services.model_registry import ModelRegistry, ModelUnavailableError
+import asyncio
+
+# --- 測試案例 ---
+
+@pytest.mark.asyncio
+async def test_background_mode_serves_before_models_are_loaded():
+    """測試 background 模式：start 立即返回，ensure 等待載入完成後才就緒，暖機在載入後執行."""
+    loaded = asyncio.Event()
+
+    async def load():
+        await loaded.wait()
+
+    warmup = AsyncMock()
+    registry = ModelRegistry(mode="background")
+    registry.register("whisper", load, warmup=warmup)
+
+    await registry.start()
+    assert not registry.ready
+    assert registry.status()["components"]["whisper"]["status"] == "loading"
+
+    loaded.set()
+    await registry.ensure("whisper")
+
+    assert registry.ready
+    warmup.assert_awaited_once()
+    assert registry.status()["cold_start_seconds"] is not None
+    await registry.close()
+
+@pytest.mark.asyncio
+async def test_lazy_mode_loads_once_on_first_use():
+    """測試 lazy 模式：啟動時不載入，同時到達的請求共用同一次載入."""
+    load = MagicMock()
+    registry = ModelRegistry(mode="lazy", warmup=False)
+    registry.register("embedding", load)
+
+    await registry.start()
+    load.assert_not_called()
+    assert registry.ready # lazy 模式下未載入也可接受流量
+
+    await asyncio.gather(registry.ensure("embedding"), registry.ensure("embedding"))
+
+    load.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_failed_component_is_unavailable_and_not_ready():
+    """測試載入失敗時 ensure 拋出 ModelUnavailableError，就緒檢查回報失敗原因；暖機失敗不影響可用性."""
+    registry = ModelRegistry(mode="eager")
+    registry.register("qdrant", MagicMock(side_effect=RuntimeError("connection refused")))
+    registry.register("embedding", MagicMock(), warmup=AsyncMock(side_effect=RuntimeError("timeout")))
+
+    await registry.start()
+
+    with pytest.raises(ModelUnavailableError):
+        await registry.ensure("qdrant")
+    await registry.ensure("embedding")
+    status = registry.status()
+    assert not status["ready"]
+    assert status["components"]["qdrant"]["error"] == "connection refused"
+    assert status["components"]["embedding"]["warmup_error"] == "timeout"
@@ -0,0 +1,51 @@
+import pytest
+from qdrant_client import AsyncQdrantClient, models
+from ..app.services.qdrant_settings import CollectionSettings, estimate_vector_memory
+
+# --- Mock 設置 ---
+async def collection_info(settings: CollectionSettings, dim: int) -> models.CollectionInfo:
+    """以本地模式 (記憶體中) 的 Qdrant 建立 collection，取得真實的設定結構."""
+    client = AsyncQdrantClient(":memory:")
+    await client.recreate_collection(collection_name="docs", **settings.create_kwargs(dim))
+    info = await client.get_collection("docs")
+    await client.close()
+    return info
+
+# --- 測試案例 ---
+
+@pytest.mark.asyncio
+async def test_diff_is_empty_for_matching_settings_and_lists_changes():
+    """測試設定相同時沒有變更；改為量化與磁碟儲存時產生對應的 update_collection 參數."""
+    baseline = CollectionSettings()
+    info = await collection_info(baseline, 8)
+
+    assert baseline.diff(info, 8) == {}
+
+    changes = CollectionSettings(quantization="scalar", vectors_on_disk=True, hnsw_m=32).diff(info, 8)
+    assert set(changes) == {"quantization_config", "vectors_config", "hnsw_config"}
+    assert changes["vectors_config"][""].on_disk is True
+    assert changes["quantization_config"].scalar.type == models.ScalarType.INT8
+
+@pytest.mark.asyncio
+async def test_diff_rejects_dimension_change():
+    """測試向量維度不同時要求重建 collection，而不是嘗試就地更新."""
+    info = await collection_info(CollectionSettings(), 8)
+
+    with pytest.raises(RuntimeError):
+        CollectionSettings().diff(info, 16)
+
+def test_search_params_and_memory_estimate():
+    """測試量化時搜尋帶有 rescore/oversampling，預設設定不送出搜尋參數；binary 量化的記憶體估計遠小於 float32."""
+    assert CollectionSettings().search_params() is None
+    params = CollectionSettings(quantization="binary", oversampling=3.0, search_hnsw_ef=128).search_params()
+    assert params.hnsw_ef == 128
+    assert params.quantization == models.QuantizationSearchParams(rescore=True, oversampling=3.0)
+
+    baseline = estimate_vector_memory(1000, 1536, CollectionSettings())
+    binary_disk = estimate_vector_memory(1000, 1536, CollectionSettings(quantization="binary", vectors_on_disk=True))
+    assert binary_disk["ram_bytes"] * 32 == baseline["ram_bytes"]
+
+def test_rejects_unknown_quantization():
+    """測試不支援的量化方式在啟動時就報錯."""
+    with pytest.raises(ValueError):
+        CollectionSettings(quantization="product")
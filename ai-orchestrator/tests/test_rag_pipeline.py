@@ -1,7 +1,9 @@
 import pytest
 from unittest.mock import AsyncMock, patch, MagicMock
-from ..app.services.rag_pipeline import generate_response_from_rag
+from ..app.services.rag_pipeline import generate_response_from_rag, stream_response_from_rag, RagComponents, DocumentServiceRetriever
 from ..app.services.document_service import search_documents_qdrant
+from ..app.services.llm_coalescing import LLMCallCoalescer
+import asyncio
 import os
 
 # --- Mock 設置 ---
@@ -11,38 +13,40 @@ def mock_env_vars():
     with patch.dict(os.environ, {"OPENAI_API_KEY": "sk-test12345", "QDRANT_HOST": "localhost", "QDRANT_PORT": "6333"}):
         yield
 
-@pytest.fixture
-def mock_openai_embedding_for_retriever():
-    """模擬 OpenAIEmbeddings for retriever."""
-    with patch('ai-orchestrator.app.services.rag_pipeline.OpenAIEmbeddings') as MockEmbeddings:
-        mock_embeddings_instance = MockEmbeddings.return_value
-        mock_embeddings_instance.embed_query = MagicMock(return_value=[0.1] * 1536)
-        yield mock_embeddings_instance
+@pytest.fixture(autouse=True)
+def fresh_llm_coalescers():
+    """每個測試使用新的 LLM 呼叫合併層，避免回應快取影響其他測試."""
+    with patch('ai-orchestrator.app.services.rag_pipeline.rephrase_calls', LLMCallCoalescer("rephrase")), \
+         patch('ai-orchestrator.app.services.rag_pipeline.answer_calls', LLMCallCoalescer("generate")):
+        yield
 
 @pytest.fixture
-def mock_chat_llm_for_rag():
-    """模擬 ChatOpenAI for RAG."""
-    with patch('ai-orchestrator.app.services.rag_pipeline.ChatOpenAI') as MockChatLLM:
-        mock_llm_instance = MockChatLLM.return_value
-        mock_llm_instance.ainvoke = AsyncMock(return_value=MagicMock(content="這是一個來自 RAG 的模擬 LLM 回應。"))
-        yield mock_llm_instance
+def mock_search_documents_qdrant():
+    """模擬 document_service 的語意搜尋 (RAG Retriever 透過它檢索)."""
+    with patch('ai-orchestrator.app.services.rag_pipeline.search_documents_qdrant', new_callable=AsyncMock) as mock_search:
+        mock_search.return_value = []
+        yield mock_search
 
 @pytest.fixture
-def mock_qdrant_retriever():
-    """模擬 LangChain Qdrant Retriever."""
-    with patch('ai-orchestrator.app.services.rag_pipeline.Qdrant') as MockQdrant:
-        mock_retriever = MagicMock()
-        mock_retriever.as_retriever.return_value = MagicMock(aget_relevant_documents=AsyncMock(return_value=[]))
-        MockQdrant.return_value = mock_retriever
-        yield mock_retriever.as_retriever.return_value
+def mock_rag_components():
+    """模擬啟動時建立的 RAG 元件 (改寫鏈與回答鏈)，Retriever 仍透過 search_documents_qdrant 檢索."""
+    components = RagComponents(
+        retriever=DocumentServiceRetriever(limit=3),
+        rephrase_chain=MagicMock(),
+        document_chain=MagicMock(),
+    )
+    components.rephrase_chain.ainvoke = AsyncMock(return_value="蘋果公司的創辦人是誰？")
+    components.document_chain.ainvoke = AsyncMock(return_value="這是一個來自 RAG 鏈的最終回答。")
+    with patch('ai-orchestrator.app.services.rag_pipeline._get_rag_components', return_value=components):
+        yield components
 
 @pytest.mark.asyncio
-async def test_generate_response_from_rag_with_context(mock_search_documents_qdrant, mock_openai_embedding_for_retriever, mock_chat_llm_for_rag):
-    """測試 RAG 流程，當檢索到相關上下文時."""
+async def test_generate_response_from_rag_with_context(mock_search_documents_qdrant, mock_rag_components):
+    """測試 RAG 流程，當檢索到相關上下文且有對話歷史時 (先改寫問題再檢索)."""
     # 模擬 search_documents_qdrant 返回檢索結果
     mock_search_documents_qdrant.return_value = [
-        {"document_id": 1, "score": 0.85, "text_chunk": "蘋果公司成立於1976年，由史蒂夫·賈伯斯、史蒂夫·沃茲尼亞克和羅納德·韋恩創立。"},
-        {"document_id": 2, "score": 0.78, "text_chunk": "史蒂夫·賈伯斯也是皮克斯動畫工作室的創辦人之一。"}
+        {"document_id": 1, "score": 0.85, "text_chunk": "蘋果公司成立於1976年，由史蒂夫·賈伯斯、史蒂夫·沃茲尼亞克和羅納德·韋恩創立。", "metadata": {}},
+        {"document_id": 2, "score": 0.78, "text_chunk": "史蒂夫·賈伯斯也是皮克斯動畫工作室的創辦人之一。", "metadata": {}}
     ]
 
     user_id = "test_user_1"
@@ -52,20 +56,33 @@ async def test_generate_response_from_rag_with_context(mock_search_documents_qdr
         {"role": "assistant", "content": "您好！"}
     ]
 
-    # 因為 create_history_aware_retriever 和 create_retrieval_chain 內部邏輯複雜，
-    # 這裡我們主要測試它們的組合行為，並確保 LLM 被調用。
-    # 更深層的 LangChain 內部測試通常由 LangChain 庫本身保證。
-    with patch('ai-orchestrator.app.services.rag_pipeline.create_retrieval_chain', new=MagicMock()) as mock_retrieval_chain:
-        mock_retrieval_chain.return_value.ainvoke = AsyncMock(return_value={"answer": "這是一個來自 RAG 鏈的最終回答。"})
+    response = await generate_response_from_rag(user_id, prompt, conversation_history)
+
+    mock_rag_components.rephrase_chain.ainvoke.assert_called_once()
+    mock_search_documents_qdrant.assert_called_once_with(prompt, limit=3)
+    mock_rag_components.document_chain.ainvoke.assert_called_once()
+    chain_input = mock_rag_components.document_chain.ainvoke.call_args.args[0]
+    assert [doc.metadata["document_id"] for doc in chain_input["context"]] == [1, 2]
+    assert len(chain_input["chat_history"]) == 2
+    assert response == "這是一個來自 RAG 鏈的最終回答。"
+
+@pytest.mark.asyncio
+async def test_generate_response_from_rag_skips_rephrase_without_history(mock_search_documents_qdrant, mock_rag_components):
+    """測試單輪請求 (無對話歷史) 直接以原始問題檢索，不呼叫改寫用的 LLM."""
+    mock_search_documents_qdrant.return_value = [
+        {"document_id": 1, "score": 0.85, "text_chunk": "蘋果公司成立於1976年。", "metadata": {}}
+    ]
+    prompt = "蘋果公司成立於哪一年？"
 
-        response = await generate_response_from_rag(user_id, prompt, conversation_history)
+    response = await generate_response_from_rag("test_user_3", prompt, [])
 
-        mock_search_documents_qdrant.assert_called_once_with(prompt, limit=3)
-        mock_retrieval_chain.return_value.ainvoke.assert_called_once()
-        assert response == "這是一個來自 RAG 鏈的最終回答。"
+    mock_rag_components.rephrase_chain.ainvoke.assert_not_called()
+    mock_search_documents_qdrant.assert_called_once_with(prompt, limit=3)
+    mock_rag_components.document_chain.ainvoke.assert_called_once()
+    assert response == "這是一個來自 RAG 鏈的最終回答。"
 
 @pytest.mark.asyncio
-async def test_generate_response_from_rag_no_context(mock_search_documents_qdrant, mock_openai_embedding_for_retriever, mock_chat_llm_for_rag):
+async def test_generate_response_from_rag_no_context(mock_search_documents_qdrant, mock_rag_components):
     """測試 RAG 流程，當未能檢索到相關上下文時."""
     mock_search_documents_qdrant.return_value = [] # 模擬沒有檢索到結果
 
@@ -77,5 +94,60 @@ async def test_generate_response_from_rag_no_context(mock_search_documents_qdran
 
     mock_search_documents_qdrant.assert_called_once_with(prompt, limit=3)
     # 在沒有上下文時，應直接返回預設訊息，不觸發 RAG 鏈的 LLM 調用
-    mock_chat_llm_for_rag.ainvoke.assert_not_called() 
+    mock_rag_components.document_chain.ainvoke.assert_not_called()
     assert "很抱歉，我目前沒有找到相關的內部資料來回答您的問題" in response
+
+@pytest.mark.asyncio
+async def test_stream_response_from_rag_sends_sources_before_tokens(mock_search_documents_qdrant, mock_rag_components):
+    """測試串流 RAG：先送出檢索到的文件 ID，再逐段送出 LLM 產生的文字，最後送出完整回應."""
+    mock_search_documents_qdrant.return_value = [
+        {"document_id": 2, "score": 0.91, "text_chunk": "史蒂夫·賈伯斯也是皮克斯動畫工作室的創辦人之一。", "metadata": {}},
+        {"document_id": 1, "score": 0.85, "text_chunk": "蘋果公司成立於1976年。", "metadata": {}},
+        {"document_id": 2, "score": 0.80, "text_chunk": "皮克斯於1986年成立。", "metadata": {}}
+    ]
+
+    async def fake_astream(_inputs):
+        for token in ["賈伯斯", "是", "創辦人。"]:
+            yield token
+
+    mock_rag_components.document_chain.astream = fake_astream
+
+    events = [event async for event in stream_response_from_rag("test_user_4", "誰創辦了皮克斯？", [])]
+
+    assert events[0] == ("sources", {"document_ids": [2, 1]})
+    assert [data["text"] for name, data in events if name == "token"] == ["賈伯斯", "是", "創辦人。"]
+    assert events[-1][0] == "done"
+    assert events[-1][1]["response_text"] == "賈伯斯是創辦人。"
+    assert "first_token" in events[-1][1]["timings"]
+
+@pytest.mark.asyncio
+async def test_identical_concurrent_requests_share_one_llm_call(mock_search_documents_qdrant, mock_rag_components):
+    """測試同時送出的相同問題 (重試或重複送出) 只呼叫一次回答 LLM，之後的重複問題由快取回應，串流版本也共用."""
+    mock_search_documents_qdrant.return_value = [
+        {"document_id": 1, "score": 0.85, "text_chunk": "蘋果公司成立於1976年。", "metadata": {}}
+    ]
+
+    async def slow_answer(_inputs):
+        await asyncio.sleep(0.05)
+        return "蘋果公司成立於1976年。"
+
+    mock_rag_components.document_chain.ainvoke = AsyncMock(side_effect=slow_answer)
+
+    responses = await asyncio.gather(*(generate_response_from_rag(f"user_{i}", "蘋果公司成立於哪一年？", []) for i in range(3)))
+    events = [event async for event in stream_response_from_rag("user_3", "蘋果公司成立於哪一年？", [])]
+
+    assert responses == ["蘋果公司成立於1976年。"] * 3
+    assert mock_rag_components.document_chain.ainvoke.await_count == 1
+    assert events[-1][1]["response_text"] == "蘋果公司成立於1976年。"
+
+def test_retriever_supports_sync_invoke(mock_search_documents_qdrant):
+    """測試 Retriever 在事件迴圈外以同步 invoke 呼叫時執行非同步檢索."""
+    mock_search_documents_qdrant.return_value = [
+        {"document_id": 1, "score": 0.9, "text_chunk": "蘋果公司成立於1976年。", "metadata": {}, "chunk_index": 0}
+    ]
+
+    documents = DocumentServiceRetriever(limit=3).invoke("蘋果公司何時成立？")
+
+    assert [document.page_content for document in documents] == ["蘋果公司成立於1976年。"]
+    assert documents[0].metadata["document_id"] == 1
+    mock_search_documents_qdrant.assert_awaited_once_with("蘋果公司何時成立？", limit=3)
@@ -0,0 +1,30 @@
+import pytest
+from ..app.services.rate_limiter import ProviderRateLimiter, TokenBucket, estimate_tokens
+
+# --- 測試案例 ---
+
+def test_estimate_tokens_counts_cjk_per_character():
+    """測試 token 估計：ASCII 約 4 字元一個 token，中文約一字一個 token."""
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("蘋果公司") == 4
+    assert estimate_tokens("") == 1
+
+@pytest.mark.asyncio
+async def test_token_bucket_waits_when_exhausted():
+    """測試額度用完後需等待補充 (600/分鐘 = 每秒 10)."""
+    bucket = TokenBucket(per_minute=600)
+
+    assert await bucket.acquire(600) == pytest.approx(0, abs=0.05) # 初始即有一分鐘的額度
+    waited = await bucket.acquire(5)
+
+    assert 0.3 < waited < 1.0
+
+@pytest.mark.asyncio
+async def test_provider_rate_limiter_disabled_without_limits():
+    """測試未設定 RPM/TPM 時不限流."""
+    limiter = ProviderRateLimiter("test")
+
+    await limiter.acquire(10 ** 9)
+
+    assert not limiter.enabled
+    assert limiter.stats() == {"requests_waited_seconds": 0.0, "tokens_waited_seconds": 0.0}
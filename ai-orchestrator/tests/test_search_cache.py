@@ -0,0 +1,73 @@
+import pytest
+from unittest.mock import patch
+from ..app.services.search_cache import SearchCache
+
+RESULTS = [{"score": 0.9, "document_id": 1, "text_chunk": "蘋果公司成立於1976年。", "metadata": {}}]
+
+# --- 測試案例 ---
+
+def test_exact_hit_ignores_case_and_whitespace():
+    """測試精確層以正規化後的查詢與 limit 為鍵."""
+    cache = SearchCache(ttl=60)
+    cache.set("蘋果 公司", [1.0, 0.0], 5, RESULTS)
+
+    assert cache.get_exact("  蘋果   公司 ", 5) == RESULTS
+    assert cache.get_exact("蘋果 公司", 3) is None
+
+def test_filter_scopes_do_not_share_entries():
+    """測試不同過濾條件 (scope) 的結果互不重用，包括語意層."""
+    cache = SearchCache(ttl=60)
+    cache.set("蘋果公司", [1.0, 0.0], 5, RESULTS, scope='{"owner": "alice"}')
+
+    assert cache.get_exact("蘋果公司", 5, scope='{"owner": "alice"}') == RESULTS
+    assert cache.get_exact("蘋果公司", 5) is None
+    assert cache.get_semantic("蘋果公司", [1.0, 0.0], 5, scope='{"owner": "bob"}') is None
+
+def test_semantic_hit_above_threshold():
+    """測試相似的查詢 Embedding 超過門檻時重用結果，低於門檻時不命中."""
+    cache = SearchCache(ttl=60, semantic_threshold=0.95)
+    cache.set("蘋果公司的創辦人", [1.0, 0.0], 5, RESULTS)
+
+    assert cache.get_semantic("誰創辦了蘋果公司", [0.99, 0.05], 5) == RESULTS
+    assert cache.get_semantic("今天天氣如何", [0.0, 1.0], 5) is None
+    assert cache.get_exact("誰創辦了蘋果公司", 5) == RESULTS # 語意命中後回填精確層
+
+def test_invalidate_clears_entries_and_rejects_stale_writes():
+    """測試 collection 寫入後快取失效，且失效前開始的搜尋結果不會被寫入."""
+    cache = SearchCache(ttl=60)
+    cache.set("查詢", [1.0, 0.0], 5, RESULTS)
+    version_before = cache.version
+
+    cache.invalidate()
+    cache.set("另一個查詢", [0.0, 1.0], 5, RESULTS, version=version_before)
+
+    assert cache.get_exact("查詢", 5) is None
+    assert cache.get_exact("另一個查詢", 5) is None
+
+def test_invalidate_reaches_other_processes_sharing_the_version_file(tmp_path):
+    """測試共用版本檔時，一個程序 (worker) 失效後，另一個程序的快取在下一次查詢時也被清空."""
+    version_path = str(tmp_path / "search_cache.version")
+    ingesting = SearchCache(ttl=60, version_path=version_path)
+    searching = SearchCache(ttl=60, version_path=version_path)
+    searching.set("查詢", [1.0, 0.0], 5, RESULTS)
+    version_before = searching.current_version()
+
+    ingesting.invalidate()
+
+    assert searching.get_exact("查詢", 5) is None
+    assert searching.get_semantic("查詢", [1.0, 0.0], 5) is None
+    searching.set("另一個查詢", [0.0, 1.0], 5, RESULTS, version=version_before)
+    assert searching.get_exact("另一個查詢", 5) is None
+
+def test_cache_hits_do_not_reread_unchanged_version_file(tmp_path):
+    """測試版本檔未變更時，快取命中只比對檔案狀態，不重新讀取版本號."""
+    cache = SearchCache(ttl=60, version_path=str(tmp_path / "search_cache.version"))
+    cache.set("查詢", [1.0, 0.0], 5, RESULTS)
+
+    with patch.object(cache, "_read_shared_version", wraps=cache._read_shared_version) as read:
+        for _ in range(3):
+            assert cache.get_exact("查詢", 5) == RESULTS
+        assert read.call_count == 0
+        SearchCache(ttl=60, version_path=str(tmp_path / "search_cache.version")).invalidate()
+        assert cache.get_exact("查詢", 5) is None
+        assert read.call_count == 1
@@ -0,0 +1,48 @@
+import pytest
+from unittest.mock import patch
+from qdrant_client import models
+from ..app.services.search_filters import build_search_filter, indexed_payload_values, parse_filter_fields, payload_index_specs
+
+# --- 測試案例 ---
+
+def test_build_search_filter_maps_values_lists_and_ranges():
+    """測試單一值、列表與範圍分別轉為 MatchValue、MatchAny 與 Range 條件 (預設欄位為後端實際寫入的 metadata)."""
+    query_filter = build_search_filter({
+        "category": "Policy",
+        "document_id": [1, 2],
+        "uploaded_by": {"gte": 3},
+    })
+
+    category, document_id, uploaded_by = query_filter.must
+    assert category.match == models.MatchValue(value="Policy")
+    assert document_id.match == models.MatchAny(any=[1, 2])
+    assert uploaded_by.range == models.Range(gte=3)
+
+@pytest.fixture
+def created_at_field():
+    """額外宣告一個 datetime 欄位 (SEARCH_FILTER_FIELDS 可自訂)."""
+    with patch.dict('ai-orchestrator.app.services.search_filters.FILTER_FIELDS', {"created_at": "datetime"}):
+        yield
+
+def test_datetime_range_uses_epoch_seconds_field(created_at_field):
+    """測試 datetime 欄位的時間範圍轉為衍生 epoch 秒欄位上的整數 Range 條件."""
+    [created_at] = build_search_filter({"created_at": {"gte": "2024-01-01T00:00:00Z", "lt": "2024-02-01T00:00:00+00:00"}}).must
+
+    assert created_at.key == "created_at_ts"
+    assert created_at.range == models.Range(gte=1704067200, lt=1706745600)
+
+def test_build_search_filter_rejects_invalid_conditions(created_at_field):
+    """測試未宣告的欄位、時間欄位的精確比對、空列表與字串欄位的範圍條件都會被拒絕."""
+    assert build_search_filter({}) is None
+    for filters in ({"owner": "alice"}, {"created_at": "2024-01-01"}, {"category": []}, {"category": {"gte": "a"}}):
+        with pytest.raises(ValueError):
+            build_search_filter(filters)
+
+def test_datetime_fields_are_indexed_as_epoch_seconds(created_at_field):
+    """測試 datetime 欄位以衍生的 epoch 秒欄位建立整數 index，無法解析的時間略過."""
+    fields = parse_filter_fields("owner, created_at:datetime")
+
+    assert fields == {"document_id": "integer", "owner": "keyword", "created_at": "datetime"}
+    assert ("created_at_ts", models.PayloadSchemaType.INTEGER) in payload_index_specs(fields)
+    assert indexed_payload_values({"created_at": "2024-01-01T08:00:00+08:00"}) == {"created_at_ts": 1704067200}
+    assert indexed_payload_values({"created_at": "not a date"}) == {}
@@ -0,0 +1,114 @@
+import pytest
+import asyncio
+import hashlib
+from ..app.services.summarization import MapReduceSummarizer, SummaryCache
+
+# --- Mock 設置 ---
+class FakeCompletion:
+    """模擬 LLM：記錄呼叫次數與最大並發數，回傳由 prompt 決定的摘要."""
+
+    def __init__(self, delay: float = 0.0):
+        self.prompts = []
+        self.active = 0
+        self.max_active = 0
+        self._delay = delay
+
+    async def __call__(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self._delay)
+        self.active -= 1
+        return "摘要-" + hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+
+# --- 測試案例 ---
+
+@pytest.mark.asyncio
+async def test_map_reduce_builds_tree_with_bounded_concurrency():
+    """測試每個塊 map 一次，再依 fanout 逐層 reduce 成單一摘要，且並發數不超過上限."""
+    complete = FakeCompletion(delay=0.01)
+    summarizer = MapReduceSummarizer(complete, concurrency=3, fanout=4)
+    chunks = [f"第 {i} 段內容" for i in range(20)]
+
+    summary = await summarizer.summarize_chunks(1, chunks)
+
+    # 20 個 map + 5 個 reduce (第一層) + 2 個 reduce (第二層: 4 + 1，單一項直接傳遞) ... + 1 個最終 reduce
+    assert len(complete.prompts) == 20 + 5 + 1 + 1
+    assert complete.max_active <= 3
+    assert summary.startswith("摘要-")
+
+@pytest.mark.asyncio
+async def test_cached_partial_summaries_only_resummarize_changed_sections(tmp_path):
+    """測試部分摘要以內容雜湊快取：只修改一個塊時只重新摘要該塊與其上層."""
+    cache = SummaryCache(str(tmp_path / "summary_cache.db"))
+    chunks = [f"第 {i} 段內容" for i in range(16)]
+    first = FakeCompletion()
+    await MapReduceSummarizer(first, cache=cache, fanout=4).summarize_chunks(1, chunks)
+
+    unchanged = FakeCompletion()
+    await MapReduceSummarizer(unchanged, cache=cache, fanout=4).summarize_chunks(1, chunks)
+    assert unchanged.prompts == []
+
+    chunks[5] = "修改後的第 5 段內容"
+    changed = FakeCompletion()
+    await MapReduceSummarizer(changed, cache=cache, fanout=4).summarize_chunks(1, chunks)
+    assert len(changed.prompts) == 3 # 1 個 map + 第一層 1 個 reduce + 最終 reduce
+    assert "修改後的第 5 段內容" in changed.prompts[0]
+
+@pytest.mark.asyncio
+async def test_session_skips_map_reduce_for_short_documents():
+    """測試未超過 min_chars 的文件不會開始 map，由呼叫者改以單次呼叫摘要."""
+    complete = FakeCompletion()
+    summarizer = MapReduceSummarizer(complete)
+
+    short = summarizer.start(1, min_chars=100)
+    await short.add("短文件")
+    long = summarizer.start(2, min_chars=100)
+    for _ in range(3):
+        await long.add("長文件內容" * 10)
+    await long.result()
+
+    assert not short.mapped
+    assert long.mapped
+    assert len(complete.prompts) == 3 + 1
+
+@pytest.mark.asyncio
+async def test_cancelled_session_returns_its_slots():
+    """測試 map 任務在開始執行前被取消時仍歸還名額，之後的摘要不會因名額耗盡而卡住."""
+    complete = FakeCompletion()
+    summarizer = MapReduceSummarizer(complete, concurrency=2)
+
+    cancelled = summarizer.start(1)
+    await cancelled.add("第一段")
+    await cancelled.add("第二段")
+    cancelled.cancel() # 兩個任務都還沒開始執行
+    await asyncio.sleep(0)
+
+    summary = await asyncio.wait_for(summarizer.summarize_chunks(2, ["第三段", "第四段", "第五段"]), timeout=1.0)
+    assert summary.startswith("摘要-")
+
+@pytest.mark.asyncio
+async def test_add_does_not_wait_for_map_slots():
+    """測試名額被其他文件占滿時 add 仍立即回傳 (索引不受摘要並行數影響)，名額空出後才開始 map."""
+    release = asyncio.Event()
+    prompts = []
+
+    async def complete(prompt):
+        prompts.append(prompt)
+        await release.wait()
+        return "摘要"
+
+    summarizer = MapReduceSummarizer(complete, concurrency=1)
+    busy = summarizer.start(1)
+    await busy.add("占用名額的段落")
+    await asyncio.sleep(0.01)
+
+    session = summarizer.start(2)
+    await asyncio.wait_for(session.add("第一段"), timeout=0.1)
+    await asyncio.wait_for(session.add("第二段"), timeout=0.1)
+    await asyncio.sleep(0.01)
+    assert len(prompts) == 1
+
+    release.set()
+    assert await asyncio.wait_for(session.result(), timeout=1.0) == "摘要"
+    assert await busy.result() == "摘要"
@@ -0,0 +1,204 @@
+import pytest
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+from ..app.services.transcription_service import (
+    TranscriptionExecutor, StreamingTranscriptionSession, TranscriptionQueueFullError, TranscriptionUnavailableError, SAMPLE_RATE
+)
+import asyncio
+import numpy as np
+
+# --- Mock 設置 ---
+@pytest.fixture
+def blocking_whisper_model():
+    """模擬會阻塞直到被釋放的 WhisperModel，用來製造佇列壓力."""
+    release = threading.Event()
+
+    def transcribe(audio, **kwargs):
+        release.wait(timeout=5)
+        return iter([MagicMock(start=0.0, end=0.5, text=" 你好"), MagicMock(start=0.5, end=1.0, text=" 世界")]), MagicMock(duration=1.0)
+
+    model = MagicMock()
+    model.transcribe.side_effect = transcribe
+    yield model, release
+    release.set()
+
+# --- 測試案例 ---
+
+@pytest.mark.asyncio
+async def test_transcribe_runs_in_worker_pool(blocking_whisper_model):
+    """測試轉錄在工作池中完成，並串接所有 segment 的文字."""
+    model, release = blocking_whisper_model
+    release.set()
+    executor = TranscriptionExecutor(workers=1, max_queue=1)
+    executor.model = model
+
+    text = await executor.transcribe(MagicMock())
+
+    assert text == "你好 世界"
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_transcribe_rejects_when_queue_full(blocking_whisper_model):
+    """測試執行中與等待中的請求都滿時，新請求立即被拒絕並帶有佇列深度."""
+    model, release = blocking_whisper_model
+    executor = TranscriptionExecutor(workers=1, max_queue=1)
+    executor.model = model
+
+    running = asyncio.create_task(executor.transcribe(MagicMock()))
+    queued = asyncio.create_task(executor.transcribe(MagicMock()))
+    await asyncio.sleep(0)
+
+    with pytest.raises(TranscriptionQueueFullError) as exc_info:
+        await executor.transcribe(MagicMock())
+    assert exc_info.value.queue_depth == 1
+
+    release.set()
+    await asyncio.gather(running, queued)
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_transcribe_without_model_is_unavailable():
+    """測試模型未載入時拋出 TranscriptionUnavailableError."""
+    executor = TranscriptionExecutor(workers=1, max_queue=1)
+
+    with pytest.raises(TranscriptionUnavailableError):
+        await executor.transcribe(MagicMock())
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_stream_yields_segments_with_timestamps(blocking_whisper_model):
+    """測試串流轉錄逐段產出含時間戳的 segment."""
+    model, release = blocking_whisper_model
+    release.set()
+    executor = TranscriptionExecutor(workers=1, max_queue=1)
+    executor.model = model
+
+    segments = [segment async for segment in executor.stream(MagicMock())]
+
+    assert segments == [{"start": 0.0, "end": 0.5, "text": "你好"}, {"start": 0.5, "end": 1.0, "text": "世界"}]
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_batch():
+    """測試同時到達的請求合併為一次批次解碼，各自取得自己的 segments."""
+    executor = TranscriptionExecutor(workers=1, max_queue=4, batch_size=3, batch_window=5)
+    executor.model = MagicMock()
+    audios = [np.full(SAMPLE_RATE, i, dtype=np.float32) for i in range(3)]
+
+    def decode_batch(model, batch, beam_size):
+        return [([{"start": 0.0, "end": 1.0, "text": f"第 {int(audio[0])} 段"}], 1.0) for audio in batch]
+
+    with patch('ai-orchestrator.app.services.whisper_batching.decode_batch', side_effect=decode_batch) as mock_decode:
+        texts = await asyncio.gather(*(executor.transcribe(audio) for audio in audios))
+
+    assert texts == ["第 0 段", "第 1 段", "第 2 段"]
+    mock_decode.assert_called_once()
+    assert executor.in_flight == 0
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_batch_is_flushed_after_window():
+    """測試未湊滿批次時，等待 batch_window 後仍會送出；解碼失敗時例外傳給呼叫方."""
+    executor = TranscriptionExecutor(workers=1, max_queue=4, batch_size=8, batch_window=0.01)
+    executor.model = MagicMock()
+
+    with patch('ai-orchestrator.app.services.whisper_batching.decode_batch', side_effect=RuntimeError("decode failed")):
+        with pytest.raises(RuntimeError, match="decode failed"):
+            await asyncio.wait_for(executor.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32)), timeout=2)
+
+    assert executor.in_flight == 0
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_long_audio_skips_batch(blocking_whisper_model):
+    """測試超過 30 秒的音訊在排入批次前改走一般轉錄，不讓同批的短音訊等待它."""
+    model, release = blocking_whisper_model
+    release.set()
+    executor = TranscriptionExecutor(workers=2, max_queue=4, batch_size=2, batch_window=0.01)
+    executor.model = model
+    long_audio = np.zeros(SAMPLE_RATE * 45, dtype=np.float32)
+
+    def decode_batch(model, batch, beam_size):
+        return [([{"start": 0.0, "end": 1.0, "text": "短音訊"}], 1.0) for _ in batch]
+
+    with patch('ai-orchestrator.app.services.whisper_batching.decode_batch', side_effect=decode_batch) as mock_decode:
+        texts = await asyncio.gather(executor.transcribe(long_audio), executor.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32)))
+
+    assert texts == ["你好 世界", "短音訊"]
+    assert [len(audio) for audio in mock_decode.call_args.args[1]] == [SAMPLE_RATE]
+    model.transcribe.assert_called_once()
+    assert executor.in_flight == 0
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_batched_requests_reserve_before_decoding():
+    """測試批次路徑在解碼上傳音訊之前就保留名額：佇列已滿時立即拒絕，不會先解碼."""
+    executor = TranscriptionExecutor(workers=1, max_queue=0, batch_size=2, batch_window=5)
+    executor.model = MagicMock()
+    queued = asyncio.create_task(executor.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32)))
+    await asyncio.sleep(0.05)
+
+    with patch('ai-orchestrator.app.services.whisper_batching.load_audio') as load_audio:
+        with pytest.raises(TranscriptionQueueFullError):
+            await executor.transcribe(MagicMock())
+    load_audio.assert_not_called()
+
+    queued.cancel()
+    await asyncio.gather(queued, return_exceptions=True)
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_streaming_session_commits_segments_outside_holdback():
+    """測試即時轉錄只確認 holdback 之前的 segment，其餘作為暫定結果."""
+    executor = MagicMock()
+    executor.transcribe_segments = AsyncMock(return_value=[
+        {"start": 0.0, "end": 1.0, "text": "第一句"},
+        {"start": 1.0, "end": 1.9, "text": "第二"},
+    ])
+    session = StreamingTranscriptionSession(executor, step_seconds=1.0, holdback_seconds=0.5)
+    session.append(np.zeros(2 * SAMPLE_RATE, dtype="<i2").tobytes())
+    assert session.ready
+
+    committed, pending = await session.decode()
+
+    assert [s["text"] for s in committed] == ["第一句"]
+    assert [s["text"] for s in pending] == ["第二"]
+    assert session.transcribed_text == "第一句"
+
+@pytest.mark.asyncio
+async def test_streaming_session_bounds_decoded_audio_for_continuous_speech():
+    """測試長時間沒有停頓的語音也會在緩衝區超過上限時確認，每次解碼的音訊長度不隨錄音增長."""
+    decoded_lengths = []
+
+    async def transcribe_segments(audio):
+        decoded_lengths.append(len(audio))
+        return [{"start": 0.0, "end": len(audio) / SAMPLE_RATE, "text": "連續"}] # 整段是一個仍在進行的 segment
+
+    executor = MagicMock()
+    executor.transcribe_segments = AsyncMock(side_effect=transcribe_segments)
+    session = StreamingTranscriptionSession(executor, step_seconds=1.0, holdback_seconds=0.5, max_buffer_seconds=5, overlap_seconds=0.3)
+    for _ in range(60):
+        session.append(np.zeros(SAMPLE_RATE, dtype="<i2").tobytes())
+        await session.decode()
+
+    assert max(decoded_lengths) <= int(6.3 * SAMPLE_RATE)
+    assert len(session.final_segments) >= 9
+    assert session.final_segments[-1]["end"] > 50
+
+@pytest.mark.asyncio
+async def test_streaming_session_keeps_overlap_without_repeating_segments():
+    """測試確認點之前保留 overlap 作為上下文，落在重疊部分的 segment 不會再次確認."""
+    executor = MagicMock()
+    executor.transcribe_segments = AsyncMock(side_effect=[
+        [{"start": 0.0, "end": 1.0, "text": "第一句"}, {"start": 1.0, "end": 1.9, "text": "第二"}],
+        [{"start": 0.0, "end": 0.3, "text": "句"}, {"start": 0.3, "end": 1.3, "text": "第二句"}],
+    ])
+    session = StreamingTranscriptionSession(executor, step_seconds=1.0, holdback_seconds=0.5, overlap_seconds=0.3)
+    session.append(np.zeros(2 * SAMPLE_RATE, dtype="<i2").tobytes())
+    await session.decode()
+
+    committed, _ = await session.decode(final=True)
+
+    assert len(executor.transcribe_segments.call_args.args[0]) == int(1.3 * SAMPLE_RATE) # 重疊 0.3 秒 + 未確認的 1 秒
+    assert committed == [{"start": 1.0, "end": 2.0, "text": "第二句"}]
+    assert session.transcribed_text == "第一句 第二句"
@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+from ..app.services.whisper_batching import _parse_segments, _suppressed_tokens
+
+# --- Mock 設置 ---
+
+TIMESTAMP_BEGIN = 50364
+EOT = 50257
+
+def _tokenizer():
+    """模擬 faster-whisper 的 Tokenizer：文字 token 直接以字元編碼."""
+    return SimpleNamespace(timestamp_begin=TIMESTAMP_BEGIN, eot=EOT, decode=lambda tokens: "".join(chr(t) for t in tokens))
+
+def _timestamp(seconds):
+    return TIMESTAMP_BEGIN + round(seconds / 0.02)
+
+# --- 測試案例 ---
+
+def test_parse_segments_splits_on_timestamps():
+    """測試時間戳 token 之間的文字成為一個 segment，未結束的尾段延伸到音訊結尾並在 eot 停止."""
+    tokens = [_timestamp(0.0), *map(ord, "你好"), _timestamp(1.2), _timestamp(1.2), *map(ord, "世界"), EOT, *map(ord, "略過")]
+
+    segments = _parse_segments(tokens, _tokenizer(), duration=2.5)
+
+    assert segments == [{"start": 0.0, "end": 1.2, "text": "你好"}, {"start": 1.2, "end": 2.5, "text": "世界"}]
+
+def test_suppressed_tokens_expand_non_speech_and_special_tokens():
+    """測試 suppress_tokens 展開為非語音符號 token 與特殊 token (去除重複並排序)，而不是直接傳入 -1."""
+    tokenizer = SimpleNamespace(non_speech_tokens=(357, 1, 220), transcribe=50359, translate=50358, sot=50258, sot_prev=50361, sot_lm=50360)
+
+    assert _suppressed_tokens(tokenizer) == [1, 220, 357, 50258, 50358, 50359, 50360, 50361]
@@ -0,0 +1,117 @@
+import pytest
+import asyncio
+from unittest.mock import MagicMock, patch
+from ..app.services.transcription_service import TranscriptionExecutor, TranscriptionQueueFullError
+from ..app.services.whisper_sharing import WhisperModelShare
+import numpy as np
+
+# --- Mock 設置 ---
+
+def _fake_model():
+    """回傳兩個 segment 的 WhisperModel，並記錄收到的音訊長度."""
+    model = MagicMock()
+    model.transcribe.side_effect = lambda audio, **kwargs: (
+        iter([MagicMock(start=0.0, end=0.5, text=" 你好"), MagicMock(start=0.5, end=1.0, text=" 世界")]),
+        MagicMock(duration=1.0),
+    )
+    return model
+
+# --- 測試案例 ---
+
+@pytest.mark.asyncio
+async def test_second_worker_forwards_to_model_owner(tmp_path):
+    """測試第一個 worker 取得鎖並載入模型，第二個 worker 不載入模型，經 unix socket 轉送轉錄."""
+    socket_path = str(tmp_path / "whisper.sock")
+    owner_executor = TranscriptionExecutor(workers=1, max_queue=0)
+    owner_executor.load_model = lambda: setattr(owner_executor, "model", _fake_model())
+    client_executor = TranscriptionExecutor(workers=1, max_queue=0)
+    client_executor.load_model = MagicMock()
+    owner = WhisperModelShare(owner_executor, socket_path, wait_seconds=5)
+    client = WhisperModelShare(client_executor, socket_path, wait_seconds=5)
+
+    await owner.load()
+    await client.load()
+
+    assert (owner.role, client.role) == ("owner", "client")
+    client_executor.load_model.assert_not_called()
+    assert await client_executor.transcribe(np.zeros(16000, dtype=np.float32)) == "你好 世界"
+    sent_audio = owner_executor.model.transcribe.call_args[0][0]
+    assert isinstance(sent_audio, np.ndarray) and len(sent_audio) == 16000
+
+    await client.close()
+    await owner.close()
+    owner_executor.shutdown()
+    client_executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_owner_queue_full_is_reported_to_forwarding_worker(tmp_path):
+    """測試持有模型的 worker 佇列已滿時，轉送的 worker 收到 TranscriptionQueueFullError."""
+    socket_path = str(tmp_path / "whisper.sock")
+    owner_executor = TranscriptionExecutor(workers=1, max_queue=0)
+    owner_executor.load_model = lambda: setattr(owner_executor, "model", _fake_model())
+    client_executor = TranscriptionExecutor(workers=1, max_queue=0)
+    owner = WhisperModelShare(owner_executor, socket_path, wait_seconds=5)
+    client = WhisperModelShare(client_executor, socket_path, wait_seconds=5)
+    await owner.load()
+    await client.load()
+    owner_executor._pending = 1 # 唯一的工作執行緒正在忙碌
+
+    with pytest.raises(TranscriptionQueueFullError):
+        await client_executor.transcribe(np.zeros(16000, dtype=np.float32))
+
+    owner_executor._pending = 0
+    await client.close()
+    await owner.close()
+    owner_executor.shutdown()
+    client_executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_forwarding_worker_takes_over_when_owner_exits(tmp_path):
+    """測試持有模型的 worker 結束後，轉送的 worker 在下一次請求時接手鎖並載入模型，轉錄不會一直失敗."""
+    socket_path = str(tmp_path / "whisper.sock")
+    owner_executor = TranscriptionExecutor(workers=1, max_queue=0)
+    owner_executor.load_model = lambda: setattr(owner_executor, "model", _fake_model())
+    client_executor = TranscriptionExecutor(workers=1, max_queue=0)
+    client_executor.load_model = lambda: setattr(client_executor, "model", _fake_model())
+    owner = WhisperModelShare(owner_executor, socket_path, wait_seconds=5)
+    client = WhisperModelShare(client_executor, socket_path, wait_seconds=5)
+    await owner.load()
+    await client.load()
+
+    await owner.close() # 模擬擁有者程序結束 (socket 關閉、鎖釋放)
+    text = await client_executor.transcribe(np.zeros(16000, dtype=np.float32))
+
+    assert text == "你好 世界"
+    assert client.role == "owner" and client_executor.model is not None
+    await client.close()
+    owner_executor.shutdown()
+    client_executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_forwarded_requests_join_owner_micro_batch(tmp_path):
+    """測試轉送的不帶選項請求在擁有者端走 transcribe_segments，與本地請求共用微批次."""
+    socket_path = str(tmp_path / "whisper.sock")
+    owner_executor = TranscriptionExecutor(workers=1, max_queue=4, batch_size=2, batch_window=5)
+    owner_executor.load_model = lambda: setattr(owner_executor, "model", _fake_model())
+    client_executor = TranscriptionExecutor(workers=1, max_queue=0)
+    owner = WhisperModelShare(owner_executor, socket_path, wait_seconds=5)
+    client = WhisperModelShare(client_executor, socket_path, wait_seconds=5)
+    await owner.load()
+    await client.load()
+
+    def decode_batch(model, batch, beam_size):
+        return [([{"start": 0.0, "end": 1.0, "text": "批次"}], 1.0) for _ in batch]
+
+    with patch('ai-orchestrator.app.services.whisper_batching.decode_batch', side_effect=decode_batch) as mock_decode:
+        texts = await asyncio.wait_for(asyncio.gather(
+            owner_executor.transcribe(np.zeros(16000, dtype=np.float32)),
+            client_executor.transcribe(np.zeros(16000, dtype=np.float32)),
+        ), timeout=2)
+
+    assert texts == ["批次", "批次"]
+    mock_decode.assert_called_once()
+    owner_executor.model.transcribe.assert_not_called()
+    await client.close()
+    await owner.close()
+    owner_executor.shutdown()
+    client_executor.shutdown()
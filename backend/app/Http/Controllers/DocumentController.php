@@ -20,6 +20,7 @@ class DocumentController extends Controller
      * 上傳文件。
      *
      * 允許用戶上傳文件 (PDF, DOCX, TXT)，文件將被儲存，並觸發 AI 微服務進行向量化和摘要。
+     * AI 微服務在背景處理，完成後透過 ai-callback 回填摘要與狀態。
      *
      * @authenticated
      * @bodyParam file file required The file to upload (max 10MB, allowed types: pdf, doc, docx, txt). Example: (binary file)
@@ -59,7 +60,11 @@ class DocumentController extends Controller
         // 通知 AI Orchestrator 進行處理 (非同步，或使用佇列)
         try {
             // 使用 absolute path for AI service to read
-            $aiResponse = Http::timeout(120)->post(env('AI_ORCHESTRATOR_URL') . '/documents/upload', [
+            // AI 微服務將文件排入背景佇列後立即回傳 202，處理完成後呼叫 callback_url
+            // 通知網址需從 AI 微服務的容器連得到，不能使用對外的 APP_URL
+            $callbackBase = rtrim(env('BACKEND_INTERNAL_URL', 'http://backend'), '/');
+            $callbackUrl = "{$callbackBase}/api/documents/{$document->id}/ai-callback";
+            $aiResponse = Http::timeout(10)->post(env('AI_ORCHESTRATOR_URL') . '/documents/upload?callback_url=' . urlencode($callbackUrl), [
                 'document_id' => $document->id,
                 'file_path' => storage_path('app/' . $path),
                 'metadata' => [
@@ -69,7 +74,11 @@ class DocumentController extends Controller
                 ]
             ]);
 
-            if ($aiResponse->successful()) {
+            if ($aiResponse->status() === 202) {
+                $ai_result = $aiResponse->json();
+                $document->update(['status' => 'processing_ai']);
+                Log::info("文件 {$document->id} 已排入 AI 處理佇列，任務 ID: " . ($ai_result['job_id'] ?? 'unknown'));
+            } elseif ($aiResponse->successful()) {
                 $ai_result = $aiResponse->json();
                 $document->update([
                     'summary' => $ai_result['summary'] ?? null,
@@ -98,6 +107,51 @@ class DocumentController extends Controller
         ], 201);
     }
 
+    /**
+     * AI 處理完成通知。
+     *
+     * 供 AI Orchestrator 在背景任務完成後呼叫，回填文件摘要與處理狀態。
+     * 以 X-Callback-Token 標頭驗證，需與 AI_CALLBACK_TOKEN 一致；未設定 AI_CALLBACK_TOKEN 時一律拒絕。
+     *
+     * @unauthenticated
+     * @urlParam id integer required 文件 ID。Example: 1
+     * @bodyParam job_id string required AI 任務 ID。Example: "3f2c9a..."
+     * @bodyParam status string required 任務狀態 (completed/failed)。Example: "completed"
+     * @bodyParam result object 任務結果，包含 summary。
+     * @bodyParam error string 失敗原因。
+     */
+    public function aiCallback(Request $request, $id)
+    {
+        $expectedToken = (string) env('AI_CALLBACK_TOKEN', '');
+        if ($expectedToken === '') {
+            // 未設定共享密鑰時任何人都能竄改文件狀態，因此一律拒絕
+            Log::error("未設定 AI_CALLBACK_TOKEN，拒絕 AI 處理完成通知，文件 ID: {$id}。");
+            return response()->json(['message' => '未設定通知密鑰'], 401);
+        }
+        if (!hash_equals($expectedToken, (string) $request->header('X-Callback-Token'))) {
+            Log::warning("AI 處理完成通知驗證失敗，文件 ID: {$id}。");
+            return response()->json(['message' => '未授權的通知'], 401);
+        }
+
+        $document = Document::find($id);
+        if (!$document) {
+            return response()->json(['message' => '文件不存在'], 404);
+        }
+
+        if ($request->input('status') === 'completed') {
+            $document->update([
+                'summary' => $request->input('result.summary'),
+                'status' => 'processed_ai',
+            ]);
+            Log::info("文件 {$document->id} AI 背景處理成功 (任務 {$request->input('job_id')})。");
+        } else {
+            $document->update(['status' => 'ai_failed']);
+            Log::error("文件 {$document->id} AI 背景處理失敗 (任務 {$request->input('job_id')})。錯誤: " . $request->input('error'));
+        }
+
+        return response()->json(['message' => '已更新文件處理狀態', 'document' => $document]);
+    }
+
     /**
      * 語意搜尋文件。
      *
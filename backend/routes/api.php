@@ -21,6 +21,9 @@ use App\Http\Controllers\VoiceController;
 Route::post('/register', [AuthController::class, 'register']);
 Route::post('/login', [AuthController::class, 'login']);
 
+// AI Orchestrator 背景處理完成通知 (以 X-Callback-Token 驗證，不使用 Sanctum)
+Route::post('/documents/{id}/ai-callback', [DocumentController::class, 'aiCallback']);
+
 // 受保護的路由 (需要 Sanctum 認證)
 Route::middleware('auth:sanctum')->group(function () {
     Route::post('/logout', [AuthController::class, 'logout']);
@@ -6,6 +6,7 @@ use Illuminate->Foundation->Testing->RefreshDatabase;
 use Illuminate->Foundation->Testing->WithFaker;
 use Tests\TestCase;
 use App\Models\User;
+use App\Models\Document;
 use Illuminate->Http\UploadedFile;
 use Illuminate->Support->Facades\Storage;
 use Illuminate->Support->Facades\Http;
@@ -25,12 +26,13 @@ class DocumentTest extends TestCase
 
         // 模擬 AI Orchestrator 的回應
         Http::fake([
-            // 模擬文件上傳後的處理
-            env('AI_ORCHESTRATOR_URL') . '/documents/upload' => Http::response([
+            // 模擬文件上傳後排入 AI 背景處理佇列
+            env('AI_ORCHESTRATOR_URL') . '/documents/upload*' => Http::response([
+                'job_id' => 'test-job-1',
                 'document_id' => 1,
-                'summary' => '這是一份測試文件的模擬摘要。',
-                'status' => 'processed'
-            ], 200),
+                'status' => 'queued',
+                'status_url' => '/jobs/test-job-1'
+            ], 202),
             // 模擬文件搜尋
             env('AI_ORCHESTRATOR_URL') . '/documents/search*' => Http::response([
                 'query' => '測試搜尋',
@@ -68,19 +70,68 @@ class DocumentTest extends TestCase
                  ->assertJsonFragment([
                      'message' => '文件已上傳並發送至AI處理',
                      'name' => 'test_document.txt',
-                     'status' => 'processed_ai',
-                     'summary' => '這是一份測試文件的模擬摘要。'
+                     'status' => 'processing_ai',
+                     'job_id' => 'test-job-1'
                  ]);
 
         Storage::disk('local')->assertExists('documents/' . $file->hashName());
         $this->assertDatabaseHas('documents', [
             'name' => 'test_document.txt',
             'user_id' => $this->user->id,
+            'status' => 'processing_ai',
+            'summary' => null
+        ]);
+    }
+
+    /**
+     * 測試 AI 背景處理完成通知會回填摘要與狀態。
+     *
+     * @return void
+     */
+    public function test_ai_callback_updates_document_summary()
+    {
+        putenv('AI_CALLBACK_TOKEN=test-token');
+
+        $document = Document::factory()->create([
+            'user_id' => $this->user->id,
+            'status' => 'processing_ai',
+            'summary' => null,
+        ]);
+
+        $response = $this->withHeaders(['X-Callback-Token' => 'test-token'])
+                         ->postJson("/api/documents/{$document->id}/ai-callback", [
+                             'job_id' => 'test-job-1',
+                             'document_id' => $document->id,
+                             'status' => 'completed',
+                             'result' => ['summary' => '這是一份測試文件的模擬摘要。'],
+                             'error' => null,
+                         ]);
+
+        $response->assertStatus(200);
+        $this->assertDatabaseHas('documents', [
+            'id' => $document->id,
             'status' => 'processed_ai',
             'summary' => '這是一份測試文件的模擬摘要。'
         ]);
     }
 
+    /**
+     * 測試 AI 處理完成通知在密鑰錯誤時被拒絕。
+     *
+     * @return void
+     */
+    public function test_ai_callback_rejects_invalid_token()
+    {
+        putenv('AI_CALLBACK_TOKEN=test-token');
+        $document = Document::factory()->create(['user_id' => $this->user->id, 'status' => 'processing_ai']);
+
+        $response = $this->withHeaders(['X-Callback-Token' => 'wrong-token'])
+                         ->postJson("/api/documents/{$document->id}/ai-callback", ['job_id' => 'x', 'status' => 'completed']);
+
+        $response->assertStatus(401);
+        $this->assertDatabaseHas('documents', ['id' => $document->id, 'status' => 'processing_ai']);
+    }
+
     /**
      * 測試未認證用戶無法上傳文件。
      *